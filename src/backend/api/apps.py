@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        # Connects the signal that drops deleted tokens from the token cache
+        from . import auth  # noqa: F401
+        from . import timing
+
+        timing.connect_signals()
@@ -0,0 +1,320 @@
+"""
+Async versions of the search, route and crawl endpoints, for running under an ASGI server.
+
+They answer exactly like their sync counterparts in api.views and share their parameter handling, but wait on Google
+and ORS through httpx instead of blocking a worker thread, so one process can serve many requests that are mostly
+waiting on upstream APIs. Database work goes through Django's async ORM where it is a plain query, and through
+sync_to_async for the bulk upserts.
+"""
+
+import asyncio
+import logging
+
+import googlemaps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.views import View
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import clients, search_cache, singleflight, timing, writeback
+from .auth import CachedTokenAuthentication
+from .matrix import acluster_matrices, acrawl_matrix
+from .models import Location
+from .routes import aroute_legs, compact_geometry, stitch_legs
+from .views import LocationSearchMixin, OptimizedCrawlMixin, RouteMixin, handle_api_error
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAPIView(View):
+    """
+    Async Django view that only lets knox token authenticated users through.
+
+    DRF's APIView cannot run async handlers, so authentication is done here with the same knox backend and answered
+    with the same 401 body DRF sends.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user_auth = await sync_to_async(CachedTokenAuthentication().authenticate)(request)
+        except AuthenticationFailed as e:
+            return self.unauthorized(e.detail)
+        if user_auth is None:
+            return self.unauthorized("Authentication credentials were not provided.")
+        request.user, request.auth = user_auth
+        return await super().dispatch(request, *args, **kwargs)
+
+    def unauthorized(self, detail):
+        response = JsonResponse({"detail": str(detail)}, status=401)
+        response["WWW-Authenticate"] = CachedTokenAuthentication().authenticate_header(None)
+        return response
+
+
+class AsyncLocationSearchView(LocationSearchMixin, AsyncAPIView):
+    async def get_places_by_type(self, location, radius, place_type, on_page=None):
+        """
+        Get places of a specific type with pagination handling
+
+        on_page is called with the results of every page as soon as it arrives.
+        """
+        places = []
+        result = await clients.async_google.places_nearby(location=location, radius=radius, type=place_type)
+
+        if result.get("results"):
+            places.extend(result["results"])
+            if on_page:
+                on_page(result["results"])
+
+        while "next_page_token" in result:
+            result = await self.get_next_page(location, radius, place_type, result["next_page_token"])
+            if result.get("results"):
+                places.extend(result["results"])
+                if on_page:
+                    on_page(result["results"])
+
+        return places
+
+    async def get_next_page(self, location, radius, place_type, page_token):
+        """Fetch the next page of a nearby search, see LocationSearchView.get_next_page"""
+        delay = settings.PLACES_PAGE_TOKEN_DELAY
+        for attempt in range(settings.PLACES_PAGE_TOKEN_ATTEMPTS):
+            await asyncio.sleep(delay)
+            try:
+                return await clients.async_google.places_nearby(
+                    location=location, radius=radius, type=place_type, page_token=page_token
+                )
+            except googlemaps.exceptions.ApiError as e:
+                if e.status != "INVALID_REQUEST" or attempt == settings.PLACES_PAGE_TOKEN_ATTEMPTS - 1:
+                    raise
+                delay *= 2
+
+    async def get_places_by_keyword(self, location, radius, keyword, on_page=None):
+        """
+        Get places by keyword search
+        """
+        result = await clients.async_google.places(query=keyword, location=location, radius=radius)
+
+        places = [place for place in result.get("results", []) if self.is_alcohol_venue(place)]
+        if on_page:
+            on_page(places)
+        return places
+
+    async def get(self, request):
+        params = self.search_params(request)
+        if isinstance(params, HttpResponse):
+            return params
+        if params["stream"]:
+            return self.stream_response(params, self.stream_search(params))
+        lat, lng, radius_miles, search_type = params["lat"], params["lng"], params["radius_miles"], params["type"]
+
+        if params["source"] == "local":
+            with timing.phase("local"):
+                locations = await sync_to_async(Location.objects.within_radius)(lat, lng, radius_miles)
+            cache_status, fetched_at = "bypass", None
+        else:
+            with timing.phase("cache"):
+                locations, fetched_at = await sync_to_async(search_cache.find)(lat, lng, radius_miles, search_type)
+            cache_status = "hit"
+            if locations is None:
+                location = (params["latitude"], params["longitude"])
+
+                async def search():
+                    locations = await self.search_google(location, radius_miles, search_type)
+                    return await sync_to_async(self.store_search)(params, locations)
+
+                with timing.phase("places"):
+                    locations, shared = await singleflight.searches.ado(self.search_key(params), search)
+                locations = self.trim_search(params, locations)
+                cache_status, fetched_at = "coalesced" if shared else "miss", timezone.now()
+
+        return self.search_response(request, params, locations, cache_status, fetched_at)
+
+    async def search_google(self, location, radius_miles, search_type):
+        """Async version of LocationSearchView.search_google, at most SEARCH_MAX_CONCURRENCY queries run at once"""
+        limit = asyncio.Semaphore(settings.SEARCH_MAX_CONCURRENCY)
+
+        async def run(query, center, radius, term):
+            async with limit:
+                return await query(center, radius, term)
+
+        queries = await sync_to_async(self.search_queries)(location, radius_miles, search_type)
+        tasks = [asyncio.create_task(run(*query)) for query in queries]
+        results = []
+        all_places = []
+        try:
+            # Results are taken in query order, so deduplication stays deterministic
+            while len(results) < len(tasks):
+                places = await tasks[len(results)]
+                tiles = self.tile_queries(location, radius_miles, queries[len(results)], places)
+                queries += tiles
+                tasks += [asyncio.create_task(run(*query)) for query in tiles]
+                results.append(places)
+                all_places.extend(places)
+                if len(results) < len(tasks) and self.enough_places(all_places):
+                    self.fanout_complete = False
+                    break
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        # The venues of the queries that finished before stopping early are kept
+        results += [None] * (len(tasks) - len(results))
+        for index, task in enumerate(tasks):
+            if results[index] is None and task.done() and not task.cancelled() and task.exception() is None:
+                results[index] = task.result()
+                all_places.extend(results[index])
+
+        await sync_to_async(self.record_yields)(location, search_type, queries, results)
+        return await sync_to_async(self.save_places)(all_places)
+
+    async def stream_search(self, params):
+        """Async version of LocationSearchView.stream_search"""
+        lat, lng, radius_miles, search_type = params["lat"], params["lng"], params["radius_miles"], params["type"]
+        try:
+            if params["source"] == "local":
+                locations = await sync_to_async(Location.objects.within_radius)(lat, lng, radius_miles)
+                cache_status = "bypass"
+            else:
+                locations = await sync_to_async(search_cache.lookup)(lat, lng, radius_miles, search_type)
+                cache_status = "hit"
+
+            if locations is None:
+                cache_status = "miss"
+                locations = []
+                location = (params["latitude"], params["longitude"])
+                async for found in self.stream_google(location, radius_miles, search_type):
+                    locations.append(found)
+                    if self.in_radius(params, found):
+                        yield self.location_record(params, found)
+                locations = await sync_to_async(self.save_locations)(locations)
+                locations = await sync_to_async(self.cache_search)(params, locations)
+            else:
+                for location in locations:
+                    yield self.location_record(params, location)
+
+            yield self.stream_record(params, "summary", self.search_summary(params, len(locations), cache_status))
+        except Exception as e:
+            logger.error(f"API Error in stream_search: {str(e)}")
+            yield self.stream_record(params, "error", {"error": str(e)})
+
+    async def stream_google(self, location, radius_miles, search_type):
+        """Async version of LocationSearchView.stream_google"""
+        limit = asyncio.Semaphore(settings.SEARCH_MAX_CONCURRENCY)
+        # (index of the query, page), or (index, None) once the query is done
+        pages = asyncio.Queue()
+
+        async def run(index, query, center, radius, term):
+            try:
+                async with limit:
+                    await query(center, radius, term, on_page=lambda page: pages.put_nowait((index, page)))
+            except Exception as e:
+                pages.put_nowait(e)
+            finally:
+                pages.put_nowait((index, None))
+
+        queries = await sync_to_async(self.search_queries)(location, radius_miles, search_type)
+        tasks = [asyncio.create_task(run(index, *query)) for index, query in enumerate(queries)]
+
+        seen_place_ids = set()
+        found_places = []
+        # Places of every query, kept for the ones that finish
+        results = [[] for _ in queries]
+        finished = set()
+        try:
+            while len(finished) < len(queries):
+                if self.enough_places(found_places):
+                    self.fanout_complete = False
+                    break
+                page = await pages.get()
+                if isinstance(page, Exception):
+                    raise page
+                index, page = page
+                if page is None:
+                    finished.add(index)
+                    for tile in self.tile_queries(location, radius_miles, queries[index], results[index]):
+                        queries.append(tile)
+                        results.append([])
+                        tasks.append(asyncio.create_task(run(len(queries) - 1, *tile)))
+                else:
+                    results[index].extend(page)
+                    found_places.extend(page)
+                    for found in self.place_locations(page, seen_place_ids):
+                        yield found
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        # Pages that arrived before stopping early are kept
+        while not pages.empty():
+            page = pages.get_nowait()
+            if isinstance(page, Exception):
+                continue
+            index, page = page
+            if page is None:
+                finished.add(index)
+            else:
+                results[index].extend(page)
+                for found in self.place_locations(page, seen_place_ids):
+                    yield found
+
+        results = [places if index in finished else None for index, places in enumerate(results)]
+        await sync_to_async(self.record_yields)(location, search_type, queries, results)
+
+
+class AsyncRouteView(RouteMixin, AsyncAPIView):
+    @handle_api_error
+    async def get(self, request):
+        points = self.route_params(request)
+        if isinstance(points, HttpResponse):
+            return points
+
+        with timing.phase("legs"):
+            leg = (await aroute_legs(list(points)))[0]
+        return self.route_response(request, leg)
+
+
+class AsyncOptimizedCrawlView(OptimizedCrawlMixin, AsyncAPIView):
+    async def get(self, request):
+        params = self.crawl_params(request)
+        if isinstance(params, HttpResponse):
+            return params
+        await sync_to_async(writeback.locations.flush_pending)(params["location_ids"])
+        locations = [location async for location in Location.objects.filter(place_id__in=params["location_ids"])]
+        locations = self.crawl_locations(locations, params["location_ids"])
+        if isinstance(locations, HttpResponse):
+            return locations
+
+        async def plan():
+            if self.clustered(params, locations):
+                clusters = self.crawl_clusters(locations)
+                with timing.phase("matrix"):
+                    durations, matrix_source = await acluster_matrices(
+                        [[locations[i] for i in members] for members in clusters], params["matrix"]
+                    )
+                with timing.phase("solve"):
+                    solution = await sync_to_async(self.find_clustered_route, thread_sensitive=False)(
+                        locations, clusters, durations, start=params["start"], budget_ms=params["budget_ms"]
+                    )
+            else:
+                with timing.phase("matrix"):
+                    durations, _, matrix_source = await acrawl_matrix(locations, params["matrix"])
+
+                # The solver is CPU bound, keep it off the event loop
+                with timing.phase("solve"):
+                    solution = await sync_to_async(self.find_optimal_route, thread_sensitive=False)(
+                        durations, start=params["start"], solver=params["solver"], budget_ms=params["budget_ms"]
+                    )
+            ordered_locations = [locations[i] for i in solution.order]
+
+            with timing.phase("legs"):
+                legs = await aroute_legs([(location.latitude, location.longitude) for location in ordered_locations])
+            return ordered_locations, legs, solution, matrix_source
+
+        (ordered_locations, legs, solution, matrix_source), _ = await singleflight.crawls.ado(
+            self.crawl_key(params), plan
+        )
+        geo_json = compact_geometry(stitch_legs(legs), **params["geometry"])
+
+        return self.crawl_response(ordered_locations, geo_json, solution, matrix_source)
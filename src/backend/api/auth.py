@@ -0,0 +1,70 @@
+"""
+Knox token authentication with a short-lived cache of validated tokens.
+
+knox looks the token up, checks the user's other tokens for expiry and compares digests on every request, several
+queries before the view runs. CachedTokenAuthentication keeps the validated AuthToken, with its user, in the
+AUTH_TOKEN_CACHE cache for AUTH_TOKEN_CACHE_TTL seconds (never past the token's expiry), keyed by the token digest.
+
+Entries are dropped as soon as their AuthToken row is deleted, which covers logout, logoutall, deleting the account and
+knox's own expiry clean-up, but only from the cache of the process that deleted it unless AUTH_TOKEN_CACHE is shared.
+With the default per-process cache other workers trust a revoked token until their entry times out, hence the short
+default TTL. Expired rows of users that never come back are removed by the purge_expired_tokens command.
+"""
+
+import binascii
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from knox.auth import TokenAuthentication
+from knox.crypto import hash_token
+from knox.models import AuthToken
+from knox.settings import knox_settings
+
+from . import metrics
+
+
+def cache_key(digest):
+    return f"auth-token:{digest}"
+
+
+def token_cache():
+    return caches[settings.AUTH_TOKEN_CACHE]
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in replacement for knox.auth.TokenAuthentication"""
+
+    def authenticate_credentials(self, token):
+        if settings.AUTH_TOKEN_CACHE_TTL <= 0:
+            return super().authenticate_credentials(token)
+        try:
+            digest = hash_token(token.decode("utf-8"))
+        except (TypeError, UnicodeDecodeError, binascii.Error):
+            # Malformed tokens get knox's own error
+            return super().authenticate_credentials(token)
+
+        auth_token = token_cache().get(cache_key(digest))
+        if auth_token is not None and (auth_token.expiry is None or auth_token.expiry > timezone.now()):
+            metrics.auth_token_cache.inc(outcome="hit")
+            if knox_settings.AUTO_REFRESH and auth_token.expiry:
+                # renew_token only writes once MIN_REFRESH_INTERVAL has passed
+                self.renew_token(auth_token)
+            return self.validate_user(auth_token)
+
+        metrics.auth_token_cache.inc(outcome="miss")
+        user, auth_token = super().authenticate_credentials(token)
+        timeout = settings.AUTH_TOKEN_CACHE_TTL
+        if auth_token.expiry is not None:
+            timeout = min(timeout, (auth_token.expiry - timezone.now()).total_seconds())
+        if timeout > 0:
+            token_cache().set(cache_key(digest), auth_token, timeout)
+        return user, auth_token
+
+
+@receiver(post_delete, sender=AuthToken)
+def forget_token(sender, instance, **kwargs):
+    """Stop trusting a cached token once it is deleted"""
+    token_cache().delete(cache_key(instance.digest))
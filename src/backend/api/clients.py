@@ -0,0 +1,345 @@
+"""
+Shared outbound HTTP clients for Google Places and OpenRouteService.
+
+Each provider gets one keep-alive connection pool per process, instead of a new connection (and TLS handshake) for
+every request. Every call has a deadline, transient failures are retried a bounded number of times with jittered
+exponential backoff, and a circuit breaker per provider fails fast while an upstream is down instead of letting it
+pin every worker. Latency and outcome of each call are recorded per endpoint in api.metrics.
+
+The async views use httpx based counterparts, AsyncORSClient and AsyncGooglePlaces, which follow the same retry
+policy and share the circuit breakers of the sync clients.
+"""
+
+import asyncio
+import contextvars
+import logging
+import random
+import threading
+import time
+import weakref
+
+import googlemaps
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from . import metrics, timing
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying, anything else in the 4xx range means the request itself is wrong
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling an upstream while its circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream after failure_threshold consecutive failures.
+
+    While open every call fails immediately. Once reset_timeout seconds have passed a single trial call is let
+    through; it closes the breaker again if it succeeds.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                raise CircuitOpenError(f"{self.name} circuit breaker is open")
+            # Let this call through as the trial, and hold off the next one for another reset_timeout
+            self._opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold and self._opened_at is None:
+                logger.warning(f"Opening {self.name} circuit breaker after {self._failures} failures")
+                self._opened_at = time.monotonic()
+
+    def reset(self):
+        self.record_success()
+
+
+def pooled_session():
+    """requests session that keeps up to UPSTREAM_POOL_SIZE connections per host alive between requests"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.UPSTREAM_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def backoff(attempt):
+    """Exponential backoff with +/-50% jitter so retries from many workers do not line up"""
+    return settings.UPSTREAM_RETRY_BACKOFF * 2**attempt * random.uniform(0.5, 1.5)
+
+
+class ORSClient:
+    """OpenRouteService client, use the module level ors instance"""
+
+    def __init__(self):
+        self.session = pooled_session()
+        self.breaker = CircuitBreaker("ors", settings.CIRCUIT_BREAKER_FAILURES, settings.CIRCUIT_BREAKER_RESET)
+
+    def post(self, path, endpoint, deadline=None, **kwargs):
+        """
+        POST to an ORS path and return the decoded JSON body.
+
+        endpoint names the call in metrics. The whole call, retries included, is bounded by deadline seconds
+        (ORS_TIMEOUT by default). Timeouts, connection errors, 429 and 5xx responses are retried up to
+        UPSTREAM_RETRIES times; the last error is raised once retries or time run out.
+        """
+        url = f"{settings.ORS_BASE_URL}{path}"
+        headers = {"Authorization": settings.ORS_API_KEY, "Content-Type": "application/json; charset=utf-8"}
+        give_up_at = time.monotonic() + (deadline or settings.ORS_TIMEOUT)
+
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            started = time.monotonic()
+            try:
+                response = self.session.post(url, headers=headers, timeout=give_up_at - started, **kwargs)
+                response.raise_for_status()
+                body = response.json()
+            except requests.RequestException as e:
+                transient = is_transient(e)
+                record("ors", endpoint, started, "retryable_error" if transient else "error")
+                if not transient:
+                    # The service answered, it is the request that is wrong
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                delay = backoff(attempt)
+                if attempt >= settings.UPSTREAM_RETRIES or time.monotonic() + delay >= give_up_at:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            record("ors", endpoint, started, "ok")
+            self.breaker.record_success()
+            return body
+
+
+def is_transient(error):
+    """Whether an upstream error, from requests or httpx, is worth retrying"""
+    if isinstance(error, (requests.Timeout, requests.ConnectionError, httpx.TransportError)):
+        return True
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+        return getattr(error.response, "status_code", None) in RETRY_STATUSES
+    return False
+
+
+def submit(executor, fn, *args):
+    """
+    Schedule fn(*args) on executor in a copy of the current context.
+
+    Threads of a pool do not inherit the context of the request, the copy makes the Google and ORS calls they make count
+    towards the request timing.
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def record(provider, endpoint, started, outcome):
+    elapsed = time.monotonic() - started
+    timing.upstream(provider, elapsed)
+    metrics.upstream_latency.observe(elapsed, provider=provider, endpoint=endpoint)
+    metrics.upstream_requests.inc(provider=provider, endpoint=endpoint, outcome=outcome)
+
+
+class GoogleMapsClient:
+    """
+    Wraps a googlemaps.Client so every call is timed and goes through the Google circuit breaker.
+
+    googlemaps does its own jittered retries, bounded here by GOOGLE_RETRY_TIMEOUT.
+    """
+
+    TRANSIENT_ERRORS = (googlemaps.exceptions.Timeout, googlemaps.exceptions.TransportError)
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name):
+        method = getattr(self._client, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            google_breaker.before_call()
+            started = time.monotonic()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                status = getattr(e, "status_code", None)
+                if isinstance(e, self.TRANSIENT_ERRORS) or (isinstance(status, int) and status >= 500):
+                    google_breaker.record_failure()
+                    record("google", name, started, "retryable_error")
+                else:
+                    record("google", name, started, "error")
+                raise
+            google_breaker.record_success()
+            record("google", name, started, "ok")
+            return result
+
+        return call
+
+
+def google_maps():
+    """
+    A googlemaps client on the shared Google connection pool.
+
+    Building the client itself is cheap, the expensive part (connections) lives in the shared session.
+    """
+    client = googlemaps.Client(
+        key=settings.GOOGLE_MAPS_API_KEY,
+        requests_session=google_session,
+        timeout=settings.GOOGLE_TIMEOUT,
+        retry_timeout=settings.GOOGLE_RETRY_TIMEOUT,
+        base_url=settings.GOOGLE_MAPS_BASE_URL,
+    )
+    return GoogleMapsClient(client)
+
+
+class AsyncUpstream:
+    """
+    Base of the async clients: an httpx connection pool per event loop plus the ORSClient retry loop.
+
+    httpx connections are bound to the event loop that opened them, so each loop (normally one per ASGI worker) gets
+    its own pool of up to UPSTREAM_POOL_SIZE connections.
+    """
+
+    provider = None
+
+    def __init__(self, breaker):
+        self.breaker = breaker
+        self._pools = weakref.WeakKeyDictionary()
+
+    @property
+    def http(self):
+        loop = asyncio.get_running_loop()
+        client = self._pools.get(loop)
+        if client is None:
+            limits = httpx.Limits(
+                max_connections=settings.UPSTREAM_POOL_SIZE, max_keepalive_connections=settings.UPSTREAM_POOL_SIZE
+            )
+            client = self._pools[loop] = httpx.AsyncClient(limits=limits)
+        return client
+
+    async def request(self, method, url, endpoint, deadline, attempt_timeout=None, **kwargs):
+        """
+        Send a request and return (response, started) once the response has a non error status.
+
+        The whole call, retries included, is bounded by deadline seconds, and each attempt by attempt_timeout.
+        Timeouts, connection errors, 429 and 5xx responses are retried up to UPSTREAM_RETRIES times, like
+        ORSClient.post. Recording the successful outcome is left to the caller, which may still reject the body.
+        """
+        give_up_at = time.monotonic() + deadline
+
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            started = time.monotonic()
+            try:
+                timeout = min(give_up_at - started, attempt_timeout or deadline)
+                response = await self.http.request(method, url, timeout=timeout, **kwargs)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                transient = is_transient(e)
+                record(self.provider, endpoint, started, "retryable_error" if transient else "error")
+                if not transient:
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                delay = backoff(attempt)
+                if attempt >= settings.UPSTREAM_RETRIES or time.monotonic() + delay >= give_up_at:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            return response, started
+
+
+class AsyncORSClient(AsyncUpstream):
+    """asyncio counterpart of ORSClient, use the module level async_ors instance"""
+
+    provider = "ors"
+
+    async def post(self, path, endpoint, deadline=None, **kwargs):
+        """POST to an ORS path and return the decoded JSON body, see ORSClient.post"""
+        url = f"{settings.ORS_BASE_URL}{path}"
+        headers = {"Authorization": settings.ORS_API_KEY, "Content-Type": "application/json; charset=utf-8"}
+        response, started = await self.request(
+            "POST", url, endpoint, deadline or settings.ORS_TIMEOUT, headers=headers, **kwargs
+        )
+        record("ors", endpoint, started, "ok")
+        return response.json()
+
+
+class AsyncGooglePlaces(AsyncUpstream):
+    """
+    The two Places web service calls the search uses, over httpx. Use the module level async_google instance.
+
+    Method names, arguments and errors match googlemaps.Client, so a non OK status raises
+    googlemaps.exceptions.ApiError just like the sync client.
+    """
+
+    provider = "google"
+
+    async def places_nearby(self, location, radius, type=None, page_token=None):
+        params = {"location": f"{location[0]},{location[1]}", "radius": radius}
+        if page_token:
+            params["pagetoken"] = page_token
+        if type:
+            params["type"] = type
+        return await self._get("/maps/api/place/nearbysearch/json", "places_nearby", params)
+
+    async def places(self, query, location, radius):
+        params = {"query": query, "location": f"{location[0]},{location[1]}", "radius": radius}
+        return await self._get("/maps/api/place/textsearch/json", "places", params)
+
+    async def _get(self, path, endpoint, params):
+        url = f"{settings.GOOGLE_MAPS_BASE_URL}{path}"
+        response, started = await self.request(
+            "GET",
+            url,
+            endpoint,
+            settings.GOOGLE_RETRY_TIMEOUT,
+            attempt_timeout=settings.GOOGLE_TIMEOUT,
+            params={**params, "key": settings.GOOGLE_MAPS_API_KEY},
+        )
+        body = response.json()
+        if body["status"] not in ("OK", "ZERO_RESULTS"):
+            record("google", endpoint, started, "error")
+            raise googlemaps.exceptions.ApiError(body["status"], body.get("error_message"))
+        record("google", endpoint, started, "ok")
+        return body
+
+
+ors = ORSClient()
+google_session = pooled_session()
+google_breaker = CircuitBreaker("google", settings.CIRCUIT_BREAKER_FAILURES, settings.CIRCUIT_BREAKER_RESET)
+async_ors = AsyncORSClient(ors.breaker)
+async_google = AsyncGooglePlaces(google_breaker)
@@ -0,0 +1,238 @@
+"""Small geographic helpers shared by the search and routing code"""
+
+import math
+
+import numpy as np
+
+EARTH_RADIUS_MILES = 3958.8
+METERS_PER_MILE = 1609.34
+# Length of the geohash stored on every Location, cells are roughly 5m x 5m
+GEOHASH_PRECISION = 9
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Ways route geometry can be sent, see encode_line
+GEOMETRY_ENCODINGS = ("geojson", "polyline", "delta")
+
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in miles"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (float(lat1), float(lng1), float(lat2), float(lng2)))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def haversine_miles_array(lat, lng, lats, lngs):
+    """Vectorized great-circle distance in miles from one point to arrays of points"""
+    lat, lng = math.radians(float(lat)), math.radians(float(lng))
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lngs - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+
+
+def haversine_matrix_miles(lats, lngs):
+    """Vectorized great-circle distances in miles between every pair of points"""
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+    dlat = lats[None, :] - lats[:, None]
+    dlng = lngs[None, :] - lngs[:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lats)[:, None] * np.cos(lats)[None, :] * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def project_miles(lats, lngs):
+    """(n, 2) array of planar (x, y) miles from an equirectangular projection around the points' mean latitude"""
+    lats = np.radians(np.asarray(lats, dtype=float))
+    lngs = np.radians(np.asarray(lngs, dtype=float))
+    return np.stack([lngs * math.cos(lats.mean()), lats], axis=1) * EARTH_RADIUS_MILES
+
+
+def geohash_encode(lat, lng, precision=7):
+    """Encode a coordinate as a geohash string of the given length"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    lat, lng = float(lat), float(lng)
+    chars = []
+    bits = 0
+    bit_count = 0
+    use_lng = True
+
+    while len(chars) < precision:
+        value, value_range = (lng, lng_range) if use_lng else (lat, lat_range)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            value_range[0] = mid
+        else:
+            bits = bits * 2
+            value_range[1] = mid
+        use_lng = not use_lng
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def geohash_cell_size(precision):
+    """(lat, lng) degrees spanned by one geohash cell of the given length"""
+    bits = 5 * precision
+    return 180 / 2 ** (bits // 2), 360 / 2 ** ((bits + 1) // 2)
+
+
+def covering_geohashes(lat, lng, radius_miles, max_cells=16):
+    """
+    Geohash prefixes whose cells together cover a circle.
+
+    The finest precision that needs at most max_cells cells is used, so the prefixes can be turned into a handful of
+    indexed LIKE 'prefix%' lookups.
+    """
+    lat, lng = float(lat), float(lng)
+    lat_reach = math.degrees(radius_miles / EARTH_RADIUS_MILES)
+    lng_reach = lat_reach / max(math.cos(math.radians(lat)), 0.01)
+    south, north = max(lat - lat_reach, -90.0), min(lat + lat_reach, 90.0)
+    west, east = max(lng - lng_reach, -180.0), min(lng + lng_reach, 180.0)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lng = geohash_cell_size(precision)
+        first_row, last_row = math.floor((south + 90) / cell_lat), math.floor((north + 90) / cell_lat)
+        first_col, last_col = math.floor((west + 180) / cell_lng), math.floor((east + 180) / cell_lng)
+        if (last_row - first_row + 1) * (last_col - first_col + 1) > max_cells:
+            continue
+        return {
+            geohash_encode(min((row + 0.5) * cell_lat - 90, 90.0), min((col + 0.5) * cell_lng - 180, 180.0), precision)
+            for row in range(first_row, last_row + 1)
+            for col in range(first_col, last_col + 1)
+        }
+
+    # The circle spans most of the globe, every geohash matches the empty prefix
+    return {""}
+
+
+def simplify(coordinates, tolerance_meters, keep=()):
+    """
+    Douglas-Peucker simplification of a [lng, lat] line, returns the sorted indices of the points to keep.
+
+    Points are dropped while the simplified line stays within tolerance_meters of every original point. The first and
+    last points and the indices in keep (e.g. the ends of every leg and step) are always kept, and simplification never
+    crosses them, so each span between two of them is simplified on its own.
+    """
+    count = len(coordinates)
+    if count <= 2 or tolerance_meters <= 0:
+        return list(range(count))
+
+    # An equirectangular projection around the line is accurate to well under a meter at crawl scale
+    points = np.radians(np.asarray(coordinates, dtype=float)[:, :2])
+    meters_per_radian = EARTH_RADIUS_MILES * METERS_PER_MILE
+    x = points[:, 0] * math.cos(points[:, 1].mean()) * meters_per_radian
+    y = points[:, 1] * meters_per_radian
+
+    kept = np.zeros(count, dtype=bool)
+    kept[[0, count - 1, *keep]] = True
+    anchors = np.flatnonzero(kept)
+    spans = list(zip(anchors[:-1], anchors[1:]))
+    while spans:
+        first, last = spans.pop()
+        if last - first < 2:
+            continue
+        dx, dy = x[last] - x[first], y[last] - y[first]
+        px, py = x[first + 1 : last] - x[first], y[first + 1 : last] - y[first]
+        length = dx * dx + dy * dy
+        # Distance to the closest point of the segment, not the infinite line, so doubling back is not dropped
+        t = np.clip((px * dx + py * dy) / length, 0, 1) if length else 0
+        distances = np.hypot(px - t * dx, py - t * dy)
+        farthest = int(np.argmax(distances))
+        if distances[farthest] > tolerance_meters:
+            middle = first + 1 + farthest
+            kept[middle] = True
+            spans.extend([(first, middle), (middle, last)])
+    return np.flatnonzero(kept).tolist()
+
+
+def _scaled(coordinates, precision):
+    """[lng, lat] coordinates as (lat, lng) integers scaled by 10^precision, rounded half up like Google does"""
+    points = np.asarray(coordinates, dtype=float).reshape(-1, 2)[:, ::-1]
+    return np.floor(points * 10**precision + 0.5).astype(np.int64)
+
+
+def delta_encode(coordinates, precision=5):
+    """
+    [lng, lat] coordinates as a flat list of integers [lat, lng, dlat, dlng, ...] scaled by 10^precision.
+
+    The first pair is absolute and every following pair is the change from the previous point, the same values an
+    encoded polyline holds, for clients that would rather not decode the polyline string.
+    """
+    scaled = _scaled(coordinates, precision)
+    if len(scaled) == 0:
+        return []
+    return np.diff(scaled, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel().tolist()
+
+
+def encode_polyline(coordinates, precision=5):
+    """Encode [lng, lat] coordinates with Google's encoded polyline algorithm"""
+    chars = []
+    for delta in delta_encode(coordinates, precision):
+        value = ~(delta << 1) if delta < 0 else delta << 1
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def decode_polyline(polyline, precision=5):
+    """Decode a Google encoded polyline back to [lng, lat] coordinates"""
+    values = []
+    value = shift = 0
+    for char in polyline:
+        byte = ord(char) - 63
+        value |= (byte & 0x1F) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    points = np.cumsum(np.asarray(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10**precision
+    return points[:, ::-1].tolist()
+
+
+def encode_line(coordinates, encoding="geojson", precision=5):
+    """[lng, lat] coordinates in one of the GEOMETRY_ENCODINGS"""
+    if encoding == "polyline":
+        return encode_polyline(coordinates, precision)
+    if encoding == "delta":
+        return delta_encode(coordinates, precision)
+    return coordinates
+
+
+def hex_cover(lat, lng, radius_miles, cell_radius_miles):
+    """
+    Centers of circles of cell_radius_miles that together cover the circle of radius_miles around (lat, lng).
+
+    The centers sit on a hexagonal grid sqrt(3) cell radii apart, where equal circles cover the plane with the least
+    overlap. The search center comes first and the rest follow nearest first.
+    """
+    lat, lng = float(lat), float(lng)
+    if cell_radius_miles >= radius_miles:
+        return [(lat, lng)]
+
+    spacing = math.sqrt(3) * cell_radius_miles
+    rows = math.ceil((radius_miles + cell_radius_miles) / (1.5 * cell_radius_miles))
+    cols = math.ceil((radius_miles + cell_radius_miles) / spacing) + 1
+    cells = []
+    for row in range(-rows, rows + 1):
+        y = row * 1.5 * cell_radius_miles
+        for col in range(-cols, cols + 1):
+            x = (col + (row % 2) / 2) * spacing
+            # Every point of a cell's hexagon is within one cell radius of its center, so the cells whose center is
+            # closer than that to the circle are the ones that can cover part of it
+            distance = math.hypot(x, y)
+            if distance < radius_miles + cell_radius_miles:
+                cells.append((distance, y, x))
+    cells.sort()
+
+    miles_per_degree_lat = math.radians(EARTH_RADIUS_MILES)
+    miles_per_degree_lng = miles_per_degree_lat * max(math.cos(math.radians(lat)), 0.01)
+    return [(lat + y / miles_per_degree_lat, lng + x / miles_per_degree_lng) for _, y, x in cells]
@@ -0,0 +1,55 @@
+"""
+Validators and Cache-Control for conditional GETs, so a client that still has a response can reuse or revalidate it
+instead of downloading it again.
+
+Views compute an ETag from whatever their response is built from and answer a matching If-None-Match (or a
+If-Modified-Since no older than Last-Modified) with an empty 304 Not Modified. Every response varies on
+Authorization, so a cache in front of the app keeps one copy per token and never hands one user's response to
+another.
+
+- Search and route responses may be reused for max_age seconds, by the app or a reverse proxy
+- Saved crawls change whenever their owner edits them, so they are private and revalidated before every reuse
+"""
+
+import hashlib
+
+import orjson
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+def etag(*parts, weak=False):
+    """
+    Quoted ETag hashing the JSON encoding of parts.
+
+    A weak ETag marks responses that are equivalent rather than byte for byte equal, e.g. differing in a cache status.
+    """
+    digest = hashlib.sha256(orjson.dumps(parts, default=str, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    return f'{"W/" if weak else ""}"{digest[:32]}"'
+
+
+def not_modified(request, etag, last_modified=None, max_age=None):
+    """The 304 response to send when the client's copy is still current, otherwise None"""
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified and int(last_modified.timestamp())
+    )
+    if response is not None:
+        add_validators(response, etag, last_modified, max_age)
+    return response
+
+
+def add_validators(response, etag, last_modified=None, max_age=None):
+    """
+    Set the ETag, Last-Modified, Cache-Control and Vary headers.
+
+    Without max_age the response is private and has to be revalidated before every reuse.
+    """
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified.timestamp())
+    if max_age is None:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=max_age)
+    patch_vary_headers(response, ["Authorization"])
+    return response
@@ -0,0 +1,69 @@
+"""
+Compare the sync (WSGI) and async (ASGI) versions of an endpoint under concurrent load.
+
+Google and ORS are replaced by a local fake that answers every call after a fixed latency, so the numbers show how
+well each path overlaps upstream waits rather than how fast the real APIs are. Every request uses fresh coordinates
+or stops, so none of them are answered from the search, leg or matrix caches.
+
+The sync path runs the requests through the WSGI handler on --threads worker threads, like a threaded WSGI server.
+The async path runs them through the ASGI handler on a single event loop, with up to --concurrency in flight.
+
+    python manage.py bench_async --endpoint route --requests 200 --latency 0.3
+"""
+
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from knox.models import AuthToken
+
+from api.management.loadtest import ENDPOINTS, PREFIX, FakeUpstream, Workload, run_async, run_sync, summarize
+
+
+class Command(BaseCommand):
+    help = "Benchmark the sync and async search/route/optimize endpoints against a fake upstream"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoint", choices=ENDPOINTS, default="route")
+        parser.add_argument("--requests", type=int, default=100, help="Requests per run")
+        parser.add_argument("--threads", type=int, default=8, help="Worker threads of the sync run")
+        parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight in the async run")
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds the fake upstream takes per call")
+        parser.add_argument("--stops", type=int, default=5, help="Stops per crawl for --endpoint optimize")
+
+    def handle(self, *args, **options):
+        upstream = FakeUpstream(options["latency"]).start()
+
+        user = User.objects.create(username=f"{PREFIX}{uuid.uuid4().hex[:8]}")
+        token = AuthToken.objects.create(user)[1]
+        self.headers = {"authorization": f"Token {token}"}
+        self.workload = Workload(options["endpoint"], options["stops"])
+
+        try:
+            with upstream.settings():
+                results = [
+                    self.run_sync(options["requests"], options["threads"]),
+                    self.run_async(options["requests"], options["concurrency"]),
+                ]
+        finally:
+            upstream.shutdown()
+            self.workload.clean_up()
+            user.delete()
+
+        self.stdout.write(
+            f"{options['endpoint']}: {options['requests']} requests, {options['latency'] * 1000:.0f}ms upstream"
+        )
+        self.stdout.write(f"{'path':<24}{'wall s':>8}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}")
+        for name, result in results:
+            self.stdout.write(
+                f"{name:<24}{result['wall_seconds']:>8.2f}{result['throughput']:>8.1f}"
+                f"{result['p50_ms']:>9.0f}{result['p95_ms']:>9.0f}{result['errors']:>8}"
+            )
+
+    def run_sync(self, count, threads):
+        requests = [self.workload.request() for _ in range(count)]
+        return f"sync, {threads} threads", summarize(*run_sync(requests, self.headers, threads))
+
+    def run_async(self, count, concurrency):
+        requests = [self.workload.request() for _ in range(count)]
+        return f"async, {concurrency} in flight", summarize(*run_async(requests, self.headers, concurrency))
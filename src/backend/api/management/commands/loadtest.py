@@ -0,0 +1,163 @@
+"""
+Load test the search, route and optimize endpoints against local Google Places and ORS stand-ins.
+
+Every endpoint is driven at each of the --concurrency levels with fresh requests that none of the caches can answer.
+The fake upstream's latency, jitter, pagination and error rate are configurable, see api.management.loadtest.
+Throughput and p50/p95/p99 latency are reported per endpoint and level, and --output writes them as JSON together with
+the git commit and the options used, so runs on different commits can be compared with --compare.
+
+    python manage.py loadtest --concurrency 1,8,32 --requests 200 --latency 0.2 --output results.json
+    python manage.py loadtest --concurrency 1,8,32 --requests 200 --latency 0.2 --compare results.json
+"""
+
+import json
+import subprocess
+import uuid
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from knox.models import AuthToken
+
+from api.management.loadtest import ENDPOINTS, PREFIX, FakeUpstream, Workload, run_async, run_sync, summarize
+
+
+def git_commit():
+    """(commit hash, whether the tree has uncommitted changes), or (None, None) outside a git checkout"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        status = subprocess.run(
+            ["git", "status", "--porcelain"], cwd=Path(__file__).parent, capture_output=True, text=True, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(status.strip())
+
+
+def concurrency_levels(value):
+    try:
+        levels = [int(level) for level in value.split(",")]
+    except ValueError:
+        raise CommandError("--concurrency must be a comma separated list of integers, e.g. 1,8,32")
+    if any(level < 1 for level in levels):
+        raise CommandError("--concurrency levels must be at least 1")
+    return levels
+
+
+class Command(BaseCommand):
+    help = "Load test the search/route/optimize endpoints against fake Google Places and ORS servers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--endpoint", action="append", choices=ENDPOINTS, help="Endpoint to test, repeatable (default all)"
+        )
+        parser.add_argument("--concurrency", default="1,8,32", help="Comma separated concurrency levels")
+        parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint and level")
+        parser.add_argument("--async", action="store_true", dest="use_async", help="Test the /api/async/ views")
+        parser.add_argument("--latency", type=float, default=0.2, help="Seconds the fake upstream takes per call")
+        parser.add_argument("--jitter", type=float, default=0, help="Extra random upstream latency, up to seconds")
+        parser.add_argument("--error-rate", type=float, default=0, help="Share of upstream calls answered with 503")
+        parser.add_argument("--pages", type=int, default=1, help="Pages of results per nearby search")
+        parser.add_argument("--results-per-page", type=int, default=1, help="Places on every page")
+        parser.add_argument("--stops", type=int, default=5, help="Stops per crawl for the optimize endpoint")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the injected jitter and errors")
+        parser.add_argument("--output", help="Write the results as JSON to this file")
+        parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+
+    def handle(self, *args, **options):
+        levels = concurrency_levels(options["concurrency"])
+        endpoints = options["endpoint"] or list(ENDPOINTS)
+        baseline = json.loads(Path(options["compare"]).read_text()) if options["compare"] else None
+
+        upstream = FakeUpstream(
+            options["latency"],
+            jitter=options["jitter"],
+            error_rate=options["error_rate"],
+            pages=options["pages"],
+            results_per_page=options["results_per_page"],
+            seed=options["seed"],
+        ).start()
+        user = User.objects.create(username=f"{PREFIX}{uuid.uuid4().hex[:8]}")
+        headers = {"authorization": f"Token {AuthToken.objects.create(user)[1]}"}
+        workloads = {endpoint: Workload(endpoint, options["stops"]) for endpoint in endpoints}
+        drive = run_async if options["use_async"] else run_sync
+
+        results = []
+        self.stdout.write(
+            f"{'endpoint':<10}{'conc':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}{'upstream':>10}"
+        )
+        try:
+            with upstream.settings():
+                for endpoint in endpoints:
+                    for level in levels:
+                        requests = [workloads[endpoint].request() for _ in range(options["requests"])]
+                        calls = upstream.calls
+                        result = summarize(*drive(requests, headers, level))
+                        result = {"endpoint": endpoint, "concurrency": level, **result}
+                        result["upstream_calls"] = upstream.calls - calls
+                        results.append(result)
+                        self.report(result, baseline)
+        finally:
+            upstream.shutdown()
+            for workload in workloads.values():
+                workload.clean_up()
+            user.delete()
+
+        if options["output"]:
+            commit, dirty = git_commit()
+            config = {
+                key: options[key]
+                for key in (
+                    "requests",
+                    "use_async",
+                    "latency",
+                    "jitter",
+                    "error_rate",
+                    "pages",
+                    "results_per_page",
+                    "stops",
+                    "seed",
+                )
+            }
+            data = {
+                "commit": commit,
+                "dirty": dirty,
+                "created": timezone.now().isoformat(),
+                "database": settings.DATABASES["default"]["ENGINE"],
+                "config": config,
+                "results": results,
+            }
+            Path(options["output"]).write_text(json.dumps(data, indent=2))
+            self.stdout.write(f"Wrote {options['output']}")
+
+    def report(self, result, baseline):
+        self.stdout.write(
+            f"{result['endpoint']:<10}{result['concurrency']:>5}{result['throughput']:>9.1f}{result['p50_ms']:>9.0f}"
+            f"{result['p95_ms']:>9.0f}{result['p99_ms']:>9.0f}{result['errors']:>8}{result['upstream_calls']:>10}"
+        )
+        if baseline is None:
+            return
+        before = next(
+            (
+                old
+                for old in baseline["results"]
+                if (old["endpoint"], old["concurrency"]) == (result["endpoint"], result["concurrency"])
+            ),
+            None,
+        )
+        if before is not None:
+            self.stdout.write(
+                f"{'':<10}{'vs':>5}{self.change(before['throughput'], result['throughput']):>9}"
+                f"{self.change(before['p50_ms'], result['p50_ms']):>9}{self.change(before['p95_ms'], result['p95_ms']):>9}"
+                f"{self.change(before['p99_ms'], result['p99_ms']):>9}  {(baseline.get('commit') or '')[:10]}"
+            )
+
+    def change(self, before, after):
+        """Relative change as a signed percentage"""
+        if not before:
+            return "n/a"
+        return f"{(after - before) / before * 100:+.0f}%"
@@ -0,0 +1,27 @@
+"""
+Delete expired knox AuthToken rows.
+
+knox only deletes expired tokens of users that authenticate again, so tokens of users that never come back pile up.
+Run this periodically, e.g. hourly from cron:
+
+    python manage.py purge_expired_tokens
+"""
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from knox.models import AuthToken
+
+
+class Command(BaseCommand):
+    help = "Delete expired auth tokens"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Tokens deleted per query")
+
+    def handle(self, *args, **options):
+        expired = AuthToken.objects.filter(expiry__lt=timezone.now())
+        purged = 0
+        # Deleting in batches keeps each statement, and the locks it holds, short on a large table
+        while batch := list(expired.values_list("pk", flat=True)[: options["batch_size"]]):
+            purged += AuthToken.objects.filter(pk__in=batch).delete()[0]
+        self.stdout.write(f"Purged {purged} expired auth tokens")
@@ -0,0 +1,288 @@
+"""
+Pieces shared by the bench_async and loadtest commands: a local stand-in for Google Places and ORS, the requests
+sent to the app, the sync and async drivers and the latency summary.
+
+The fake upstream answers after a configurable latency, can spread search results over several pages and fails a
+share of the calls with a 503, so the retry, pagination and fallback paths are exercised like they are in production.
+"""
+
+import asyncio
+import json
+import random
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.test import AsyncClient, Client, override_settings
+
+from api import search_cache, writeback
+from api.models import Location, RouteLeg, SearchTile
+from api.routes import point_key
+
+PREFIX = "bench-"
+# Center of the fake searches and crawls, stops are scattered up to about 3 miles around it
+CENTER = (39.9526, -75.1652)
+ENDPOINTS = ("search", "route", "optimize")
+
+
+class FakeUpstream(ThreadingHTTPServer):
+    """
+    Answers Google Places and ORS requests on localhost.
+
+    Every call waits latency seconds, plus up to jitter seconds more, and fails with a 503 with probability
+    error_rate. Nearby searches return results_per_page places on each of pages pages. Call start() and shutdown().
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency, jitter=0, error_rate=0, pages=1, results_per_page=1, seed=None):
+        super().__init__(("127.0.0.1", 0), FakeUpstreamHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.pages = pages
+        self.results_per_page = results_per_page
+        self.random = random.Random(seed)
+        self.calls = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def settings(self):
+        """override_settings pointing the app at this server"""
+        return override_settings(
+            # The test clients send requests as testserver
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+            GOOGLE_MAPS_BASE_URL=self.url,
+            GOOGLE_MAPS_API_KEY="AIza-benchmark",
+            ORS_BASE_URL=self.url,
+            PLACES_PAGE_TOKEN_DELAY=0,
+            # Text searches find nothing here, which would teach the planner to skip keywords for real users
+            SEARCH_PLANNER=False,
+        )
+
+    def roll(self):
+        """Count a call and pick how it goes, returns (delay, fail)"""
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+            self.failures += fail
+        return delay, fail
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    # Keep connections alive, both clients pool them
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.delay():
+            return
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if "nearbysearch" not in url.path:
+            self.send_json({"status": "ZERO_RESULTS", "results": []})
+            return
+
+        # Page tokens are "<page>:<lat>,<lng>", the coordinates of the first request
+        page, location = 1, query.get("location")
+        if "pagetoken" in query:
+            page, location = query["pagetoken"].split(":", 1)
+            page = int(page)
+        lat, lng = (float(part) for part in location.split(","))
+        places = [
+            {
+                "place_id": f"{PREFIX}{uuid.uuid4().hex}",
+                "name": "Benchmark Bar",
+                "vicinity": "1 Bench St",
+                "types": ["bar"],
+                "geometry": {"location": {"lat": lat, "lng": lng}},
+            }
+            for _ in range(self.server.results_per_page)
+        ]
+        body = {"status": "OK", "results": places}
+        if page < self.server.pages:
+            body["next_page_token"] = f"{page + 1}:{location}"
+        self.send_json(body)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.delay():
+            return
+        if "matrix" in self.path:
+            rows, cols = body["sources"], body["destinations"]
+            self.send_json(
+                {
+                    "durations": [[0 if r == c else 600 for c in cols] for r in rows],
+                    "distances": [[0 if r == c else 0.5 for c in cols] for r in rows],
+                }
+            )
+            return
+
+        coordinates = body["coordinates"]
+        legs = len(coordinates) - 1
+        self.send_json(
+            {
+                "type": "FeatureCollection",
+                "features": [
+                    {
+                        "properties": {
+                            "segments": [{"distance": 800, "duration": 600, "steps": []} for _ in range(legs)],
+                            "way_points": list(range(len(coordinates))),
+                            "summary": {"distance": 800 * legs, "duration": 600 * legs},
+                        },
+                        "geometry": {"coordinates": coordinates},
+                    }
+                ],
+            }
+        )
+
+    def delay(self):
+        """Wait out the latency of this call, returns True when it was answered with an injected error"""
+        delay, fail = self.server.roll()
+        time.sleep(delay)
+        if fail:
+            self.send_json({"error": "injected failure"}, status=503)
+        return fail
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def random_point():
+    return CENTER[0] + random.uniform(-0.04, 0.04), CENTER[1] + random.uniform(-0.04, 0.04)
+
+
+class Workload:
+    """
+    Builds requests for one endpoint that none of the search, leg or matrix caches can answer, and removes everything
+    they stored afterwards with clean_up().
+    """
+
+    def __init__(self, endpoint, stops=5):
+        self.endpoint = endpoint
+        self.stops = stops
+        self.route_keys = []
+        self.tile_keys = []
+
+    def request(self):
+        """(path under /api/, query params) of a fresh request"""
+        if self.endpoint == "search":
+            lat, lng = random_point()
+            self.tile_keys.append(search_cache.tile_key(lat, lng, 1, "bar"))
+            return "search/", {"latitude": lat, "longitude": lng, "radius": 1}
+        if self.endpoint == "route":
+            (start_lat, start_lng), (end_lat, end_lng) = random_point(), random_point()
+            self.route_keys += [point_key(start_lat, start_lng), point_key(end_lat, end_lng)]
+            params = {"start_lat": start_lat, "start_lng": start_lng, "end_lat": end_lat, "end_lng": end_lng}
+            return "route/", params
+
+        stops = []
+        for _ in range(self.stops):
+            lat, lng = random_point()
+            stops.append(
+                Location(
+                    place_id=f"{PREFIX}{uuid.uuid4().hex}",
+                    name="Benchmark Bar",
+                    latitude=lat,
+                    longitude=lng,
+                    user_ratings_total=0,
+                )
+            )
+            self.route_keys.append(point_key(lat, lng))
+        for location in stops:
+            location.save()
+        return "optimize-crawl/", {"location": [location.place_id for location in stops], "matrix": "ors"}
+
+    def clean_up(self):
+        # Write out the queued venues first, or they would be written back after being deleted
+        writeback.locations.flush()
+        # Walking distances go with their locations
+        Location.objects.filter(place_id__startswith=PREFIX).delete()
+        RouteLeg.objects.filter(origin__in=self.route_keys).delete()
+        SearchTile.objects.filter(key__in=self.tile_keys).delete()
+
+
+def run_sync(requests, headers, threads):
+    """
+    Send (path, params) requests through the WSGI handler on threads worker threads, like a threaded WSGI server.
+
+    Returns the wall time and the (seconds, status) of every request.
+    """
+    local = threading.local()
+
+    def send(request):
+        if not hasattr(local, "client"):
+            local.client = Client()
+        path, params = request
+        started = time.monotonic()
+        response = local.client.get(f"/api/{path}", params, headers=headers)
+        return time.monotonic() - started, response.status_code
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        outcomes = list(executor.map(send, requests))
+    return time.monotonic() - started, outcomes
+
+
+def run_async(requests, headers, concurrency):
+    """Send requests to the /api/async/ views through the ASGI handler on one event loop, concurrency in flight"""
+    client = AsyncClient()
+
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+
+        async def send(request):
+            path, params = request
+            async with limit:
+                started = time.monotonic()
+                response = await client.get(f"/api/async/{path}", params, headers=headers)
+                return time.monotonic() - started, response.status_code
+
+        return await asyncio.gather(*(send(request) for request in requests))
+
+    started = time.monotonic()
+    outcomes = asyncio.run(run())
+    return time.monotonic() - started, outcomes
+
+
+def percentile(values, q):
+    """Nearest-rank percentile (0-100) of a list of numbers, 0 for an empty list"""
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(len(values) * q / 100 + 0.5) - 1))]
+
+
+def summarize(wall, outcomes):
+    """Throughput and latency of a run from its (seconds, status) outcomes, latencies only count 200s"""
+    latencies = [latency for latency, status in outcomes if status == 200]
+    return {
+        "requests": len(outcomes),
+        "errors": len(outcomes) - len(latencies),
+        "wall_seconds": round(wall, 3),
+        "throughput": round(len(latencies) / wall, 2) if wall else 0,
+        "p50_ms": round(statistics.median(latencies or [0]) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+    }
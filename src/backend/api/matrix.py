@@ -0,0 +1,358 @@
+"""
+Walking duration/distance matrices for crawls.
+
+Pairs of stops recur across users, so every pair ORS has measured is stored in the WalkingDistance table. A crawl
+only asks ORS for the rows and columns that still have missing or stale pairs, using the matrix endpoint's
+sources/destinations parameters, and the full matrix is assembled locally.
+
+When the stops are only a few blocks apart, or ORS is unavailable, the matrix is estimated from great-circle distances
+instead, see estimate_matrix.
+
+Crawls too large for one matrix request are split into clusters of nearby stops, see solver.solve_clustered, and only
+the matrix within each cluster is requested, see cluster_matrices.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import clients
+from .geo import haversine_matrix_miles
+from .models import WalkingDistance
+
+logger = logging.getLogger(__name__)
+
+MATRIX_PATH = "/v2/matrix/foot-walking"
+# Most sub-matrix requests made for one crawl before falling back to a single bigger request
+MAX_MATRIX_REQUESTS = 3
+
+
+def matrix_body(locations, sources, destinations):
+    """ORS matrix request for the sources x destinations block, sending only the stops that take part in it"""
+    involved = sorted(set(sources) | set(destinations))
+    position = {i: p for p, i in enumerate(involved)}
+    return {
+        "locations": [[float(locations[i].longitude), float(locations[i].latitude)] for i in involved],
+        "sources": [position[i] for i in sources],
+        "destinations": [position[j] for j in destinations],
+        "metrics": ["duration", "distance"],
+        "resolve_locations": True,
+        "units": "mi",
+    }
+
+
+def fetch_matrix(locations, sources, destinations):
+    """Ask ORS for the durations and distances from every source index to every destination index"""
+    body = matrix_body(locations, sources, destinations)
+    matrix_data = clients.ors.post(MATRIX_PATH, endpoint="matrix", json=body, deadline=settings.ORS_MATRIX_TIMEOUT)
+    return matrix_data["durations"], matrix_data["distances"]
+
+
+async def afetch_matrix(locations, sources, destinations):
+    """Async version of fetch_matrix"""
+    body = matrix_body(locations, sources, destinations)
+    matrix_data = await clients.async_ors.post(
+        MATRIX_PATH, endpoint="matrix", json=body, deadline=settings.ORS_MATRIX_TIMEOUT
+    )
+    return matrix_data["durations"], matrix_data["distances"]
+
+
+def estimate_matrix(locations):
+    """
+    Estimate the (durations, distances) matrices between locations without any network call.
+
+    Straight-line distances are stretched by WALKING_DETOUR_FACTOR to account for the street grid and converted to
+    durations at WALKING_SPEED_MPH.
+    """
+    distances = haversine_matrix_miles(
+        [location.latitude for location in locations], [location.longitude for location in locations]
+    )
+    distances *= settings.WALKING_DETOUR_FACTOR
+    durations = distances / settings.WALKING_SPEED_MPH * 3600
+    return durations.tolist(), distances.tolist()
+
+
+def crawl_matrix(locations, mode="auto"):
+    """
+    Return the (durations, distances, source) for a crawl.
+
+    mode "ors" always uses measured walking times and "estimate" always uses estimate_matrix. "auto" estimates when
+    every stop is within WALKING_ESTIMATE_MAX_MILES of each other and uses ORS otherwise. source reports what was
+    used: "estimate", "ors", or "ors_fallback" when ORS was unavailable and missing pairs had to be estimated.
+    """
+    estimate = estimated_matrix(locations, mode)
+    if estimate is not None:
+        return estimate
+    return walking_matrix(locations)
+
+
+async def acrawl_matrix(locations, mode="auto"):
+    """Async version of crawl_matrix"""
+    estimate = estimated_matrix(locations, mode)
+    if estimate is not None:
+        return estimate
+    return await awalking_matrix(locations)
+
+
+def estimated_matrix(locations, mode):
+    """The estimated (durations, distances, "estimate") when crawl_matrix should not use ORS, otherwise None"""
+    if mode == "estimate":
+        return *estimate_matrix(locations), "estimate"
+
+    if mode == "auto":
+        durations, distances = estimate_matrix(locations)
+        spread = max(max(row) for row in distances) / settings.WALKING_DETOUR_FACTOR
+        if spread <= settings.WALKING_ESTIMATE_MAX_MILES:
+            return durations, distances, "estimate"
+    return None
+
+
+def cluster_matrices(groups, mode="auto"):
+    """
+    crawl_matrix for every group of locations, with the ORS requests of all groups made concurrently.
+
+    Returns the durations matrix of every group and the least precise of their sources.
+    """
+    results = [estimated_matrix(locations, mode) for locations in groups]
+    measured = [g for g, result in enumerate(results) if result is None]
+    for g, result in zip(measured, walking_matrices([groups[g] for g in measured])):
+        results[g] = result
+    return [durations for durations, _, _ in results], least_precise(source for _, _, source in results)
+
+
+async def acluster_matrices(groups, mode="auto"):
+    """Async version of cluster_matrices"""
+    results = [estimated_matrix(locations, mode) for locations in groups]
+    measured = [g for g, result in enumerate(results) if result is None]
+    for g, result in zip(measured, await awalking_matrices([groups[g] for g in measured])):
+        results[g] = result
+    return [durations for durations, _, _ in results], least_precise(source for _, _, source in results)
+
+
+def least_precise(sources):
+    sources = set(sources)
+    return next(source for source in ("ors_fallback", "ors", "estimate") if source in sources)
+
+
+def walking_matrix(locations):
+    """
+    Return the (durations, distances, source) matrices between locations, in seconds and miles.
+
+    Cached pairs younger than WALKING_MATRIX_TTL are reused, everything else is fetched from ORS in a few
+    sub-matrix requests, see missing_blocks. If ORS times out or fails, the pairs that are still missing are
+    estimated and source is "ors_fallback" instead of "ors".
+    """
+    return walking_matrices([locations])[0]
+
+
+async def awalking_matrix(locations):
+    """Async version of walking_matrix"""
+    return (await awalking_matrices([locations]))[0]
+
+
+def extend_matrix(locations, durations, distances, mode="auto"):
+    """
+    crawl_matrix for a saved crawl that gained stops.
+
+    durations and distances are the measured matrices of the first len(durations) locations, which are used as they
+    are. Only pairs with one of the new locations are looked up, and fetched from ORS when they are not stored yet.
+    """
+    estimate = estimated_matrix(locations, mode)
+    if estimate is not None:
+        return estimate
+
+    known = len(durations)
+    full_durations, full_distances, missing = cached_matrix(locations)
+    for i in range(known):
+        full_durations[i][:known] = durations[i]
+        full_distances[i][:known] = distances[i]
+    missing = [(i, j) for i, j in missing if i >= known or j >= known]
+    return walking_matrices([locations], [(full_durations, full_distances, missing)])[0]
+
+
+def walking_matrices(groups, cached=None):
+    """
+    walking_matrix of every group of locations, at most ORS_MAX_CONCURRENCY sub-matrix requests run at once.
+
+    cached can pass the cached_matrix result of every group in.
+    """
+    if cached is None:
+        cached = [cached_matrix(locations) for locations in groups]
+    requested = missing_requests(groups, cached)
+
+    def fetch(request):
+        g, sources, destinations = request
+        try:
+            return fetch_matrix(groups[g], sources, destinations)
+        except requests.RequestException as e:
+            return e
+
+    if len(requested) > 1:
+        with ThreadPoolExecutor(max_workers=min(settings.ORS_MAX_CONCURRENCY, len(requested))) as executor:
+            futures = [clients.submit(executor, fetch, request) for request in requested]
+            results = [future.result() for future in futures]
+    else:
+        results = [fetch(request) for request in requested]
+
+    blocks = fetched_blocks(groups, requested, results)
+    return [
+        complete_matrix(locations, *matrices, group_blocks) if matrices[2] else (*matrices[:2], "ors")
+        for locations, matrices, group_blocks in zip(groups, cached, blocks)
+    ]
+
+
+async def awalking_matrices(groups):
+    """Async version of walking_matrices"""
+    cached = await sync_to_async(lambda: [cached_matrix(locations) for locations in groups])()
+    requested = missing_requests(groups, cached)
+    limit = asyncio.Semaphore(settings.ORS_MAX_CONCURRENCY)
+
+    async def fetch(request):
+        g, sources, destinations = request
+        async with limit:
+            return await afetch_matrix(groups[g], sources, destinations)
+
+    results = await asyncio.gather(*(fetch(request) for request in requested), return_exceptions=True)
+    blocks = fetched_blocks(groups, requested, results)
+
+    def complete():
+        return [
+            complete_matrix(locations, *matrices, group_blocks) if matrices[2] else (*matrices[:2], "ors")
+            for locations, matrices, group_blocks in zip(groups, cached, blocks)
+        ]
+
+    return await sync_to_async(complete)()
+
+
+def missing_requests(groups, cached):
+    """The (group index, sources, destinations) sub-matrix requests for the missing pairs of every group"""
+    requested = []
+    for g, (_, _, missing) in enumerate(cached):
+        for sources, destinations in missing_blocks(missing) if missing else []:
+            logger.debug(f"Fetching {len(sources)}x{len(destinations)} walking matrix")
+            requested.append((g, sources, destinations))
+    return requested
+
+
+def fetched_blocks(groups, requested, results):
+    """
+    The (sources, destinations, durations, distances) blocks fetched for every group.
+
+    Requests that failed transiently are left out, so their pairs get estimated, other failures are raised.
+    """
+    blocks = [[] for _ in groups]
+    for (g, sources, destinations), result in zip(requested, results):
+        if isinstance(result, Exception):
+            if not clients.is_transient(result):
+                raise result
+            logger.warning(f"ORS matrix unavailable, estimating walking times instead: {result}")
+            continue
+        blocks[g].append((sources, destinations, *result))
+    return blocks
+
+
+def cached_matrix(locations):
+    """
+    Start the (durations, distances) matrices from the stored pairs younger than WALKING_MATRIX_TTL.
+
+    Returns them along with the (i, j) pairs that are still missing, which are None in both matrices.
+    """
+    n = len(locations)
+    index = {location.place_id: i for i, location in enumerate(locations)}
+    durations = [[0.0 if i == j else None for j in range(n)] for i in range(n)]
+    distances = [[0.0 if i == j else None for j in range(n)] for i in range(n)]
+    known = {(i, i) for i in range(n)}
+
+    fresh_after = timezone.now() - timedelta(seconds=settings.WALKING_MATRIX_TTL)
+    cached = WalkingDistance.objects.filter(
+        origin_id__in=index, destination_id__in=index, updated_at__gte=fresh_after
+    ).values_list("origin_id", "destination_id", "duration_seconds", "distance_miles")
+    for origin_id, destination_id, duration, distance in cached:
+        i, j = index[origin_id], index[destination_id]
+        durations[i][j] = duration
+        distances[i][j] = distance
+        known.add((i, j))
+
+    missing = [(i, j) for i in range(n) for j in range(n) if (i, j) not in known]
+    return durations, distances, missing
+
+
+def complete_matrix(locations, durations, distances, missing, blocks):
+    """
+    Fill the fetched (sources, destinations, durations, distances) blocks into the matrices and store them.
+
+    Pairs no block covered, because its request failed, are estimated. Returns (durations, distances, source).
+    """
+    now = timezone.now()
+    pairs = []
+    fetched = set()
+    for sources, destinations, sub_durations, sub_distances in blocks:
+        for row, i in enumerate(sources):
+            for col, j in enumerate(destinations):
+                fetched.add((i, j))
+                durations[i][j] = sub_durations[row][col]
+                distances[i][j] = sub_distances[row][col]
+                if i != j:
+                    pairs.append(
+                        WalkingDistance(
+                            origin_id=locations[i].place_id,
+                            destination_id=locations[j].place_id,
+                            duration_seconds=sub_durations[row][col],
+                            distance_miles=sub_distances[row][col],
+                            updated_at=now,
+                        )
+                    )
+
+    WalkingDistance.objects.bulk_create(
+        pairs,
+        update_conflicts=True,
+        unique_fields=["origin", "destination"],
+        update_fields=["duration_seconds", "distance_miles", "updated_at"],
+    )
+
+    unfilled = [pair for pair in missing if pair not in fetched]
+    if not unfilled:
+        return durations, distances, "ors"
+
+    # Estimates are only used for this crawl, they are never stored
+    estimated_durations, estimated_distances = estimate_matrix(locations)
+    for i, j in unfilled:
+        durations[i][j] = estimated_durations[i][j]
+        distances[i][j] = estimated_distances[i][j]
+    return durations, distances, "ors_fallback"
+
+
+def submatrix(matrix, indices):
+    """The rows and columns of a list of lists matrix at indices, in that order"""
+    return [[matrix[i][j] for j in indices] for i in indices]
+
+
+def missing_blocks(missing):
+    """
+    Split missing (source, destination) pairs into rectangular sources x destinations blocks to request.
+
+    Rows missing the same set of destinations share a block, so adding a stop to a known crawl costs one row and one
+    column instead of the whole matrix. Irregular gaps, or splits that would not save at least half of the elements,
+    fall back to a single block spanning every missing pair.
+    """
+    columns_by_row = {}
+    for i, j in missing:
+        columns_by_row.setdefault(i, set()).add(j)
+
+    rows_by_columns = {}
+    for i, columns in columns_by_row.items():
+        rows_by_columns.setdefault(tuple(sorted(columns)), []).append(i)
+
+    blocks = [(sorted(rows), list(columns)) for columns, rows in rows_by_columns.items()]
+    single = (sorted(columns_by_row), sorted({j for _, j in missing}))
+    # Extra round trips only pay off when they save most of the elements
+    block_size = sum(len(rows) * len(columns) for rows, columns in blocks)
+    if len(blocks) > MAX_MATRIX_REQUESTS or block_size * 2 >= len(single[0]) * len(single[1]):
+        return [single]
+    return blocks
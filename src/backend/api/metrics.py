@@ -0,0 +1,166 @@
+"""
+In-process counters, gauges and histograms used to observe requests, caches, upstream calls and background writes.
+
+Every metric registers itself in REGISTRY, which render() exposes in the Prometheus text format, see MetricsView.
+The values are per process, so with several workers each one is scraped (or summed) separately.
+"""
+
+import bisect
+import math
+import threading
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+class Counter:
+    """Thread-safe monotonically increasing counter, optionally split by labels"""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    @property
+    def value(self):
+        """Total over every label combination"""
+        return sum(self._values.values())
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Gauge:
+    """Thread-safe value that can go up and down, optionally split by labels"""
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def get(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Thread-safe histogram of observed values (seconds by default), optionally split by labels"""
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0})
+            series["counts"][bisect.bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def get(self, **labels):
+        """{"counts", "sum", "count"} for one label combination, counts are per bucket (not cumulative)"""
+        return self._series.get(
+            tuple(sorted(labels.items())), {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+        )
+
+    def samples(self):
+        """Cumulative _bucket samples with their le label, then _sum and _count, for every label combination"""
+        with self._lock:
+            series = [
+                (dict(key), list(values["counts"]), values["sum"], values["count"])
+                for key, values in self._series.items()
+            ]
+        samples = []
+        for labels, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, math.inf), counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", {**labels, "le": format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+            samples.append((f"{self.name}_count", labels, count))
+        return samples
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render():
+    """Every registered metric in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for metric in REGISTRY:
+        kind = {Counter: "counter", Gauge: "gauge", Histogram: "histogram"}[type(metric)]
+        lines.append(f"# HELP {metric.name} {escape(metric.description)}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        for name, labels, value in metric.samples():
+            label_text = ",".join(f'{key}="{escape(label)}"' for key, label in labels.items())
+            lines.append(
+                f"{name}{{{label_text}}} {format_value(value)}" if label_text else f"{name} {format_value(value)}"
+            )
+    return "\n".join(lines) + "\n"
+
+
+search_cache_hits = Counter("search_cache_hits_total", "Searches answered from the geo-tile cache")
+search_cache_misses = Counter("search_cache_misses_total", "Searches that had to query Google Places")
+keyword_queries = Counter(
+    "keyword_queries_total", "Keyword text searches planned by outcome, run, explored or skipped for their low yield"
+)
+
+upstream_requests = Counter("upstream_requests_total", "Calls made to Google and ORS by provider, endpoint and outcome")
+upstream_latency = Histogram("upstream_request_seconds", "Latency of calls made to Google and ORS")
+
+location_writes_pending = Gauge("location_writes_pending", "Location upserts waiting in the write-behind queue")
+location_writes = Counter("location_writes_total", "Queued Location upserts by outcome, written or unchanged")
+location_flush_latency = Histogram("location_flush_seconds", "Time taken to flush a batch of Location upserts")
+coalesced_requests = Counter(
+    "coalesced_requests_total", "Searches and crawls by kind and role, leader ran the work and follower shared it"
+)
+auth_token_cache = Counter("auth_token_cache_total", "Token authentications by outcome, hit or miss of the token cache")
+
+request_latency = Histogram("request_seconds", "Time taken to answer a request by view and status")
+request_phase_latency = Histogram("request_phase_seconds", "Time spent in each phase of a request by view and phase")
+request_db_queries = Histogram(
+    "request_db_queries", "Database queries made by a request", buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200)
+)
+request_upstream_calls = Histogram(
+    "request_upstream_calls", "Google and ORS calls made by a request", buckets=(0, 1, 2, 5, 10, 20, 50)
+)
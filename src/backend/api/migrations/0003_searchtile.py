@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0002_alter_location_address"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SearchTile",
+            fields=[
+                ("key", models.CharField(primary_key=True, serialize=False)),
+                ("search_type", models.CharField()),
+                ("radius_miles", models.IntegerField()),
+                ("latitude", models.FloatField()),
+                ("longitude", models.FloatField()),
+                ("place_ids", models.JSONField(default=list)),
+                ("fetched_at", models.DateTimeField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["search_type", "latitude", "longitude"], name="api_searcht_search__be10b4_idx")
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+GEOHASH_PRECISION = 9
+
+
+def populate_geohash(apps, schema_editor):
+    from api.geo import geohash_encode
+
+    Location = apps.get_model("api", "Location")
+    locations = list(Location.objects.all())
+    for location in locations:
+        location.geohash = geohash_encode(location.latitude, location.longitude, GEOHASH_PRECISION)
+    Location.objects.bulk_update(locations, ["geohash"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0003_searchtile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="location",
+            name="geohash",
+            field=models.CharField(db_index=True, default="", max_length=GEOHASH_PRECISION),
+        ),
+        migrations.RunPython(populate_geohash, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0004_location_geohash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WalkingDistance",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("duration_seconds", models.FloatField(blank=True, null=True)),
+                ("distance_miles", models.FloatField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField()),
+                (
+                    "destination",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="+", to="api.location"),
+                ),
+                (
+                    "origin",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name="+", to="api.location"),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("origin", "destination"), name="unique_walking_distance")
+                ],
+            },
+        ),
+    ]
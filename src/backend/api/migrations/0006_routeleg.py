@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0005_walkingdistance"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RouteLeg",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("origin", models.CharField()),
+                ("destination", models.CharField()),
+                ("summary", models.JSONField()),
+                ("steps", models.JSONField(default=list)),
+                ("coordinates", models.JSONField(default=list)),
+                ("updated_at", models.DateTimeField()),
+            ],
+            options={
+                "constraints": [models.UniqueConstraint(fields=("origin", "destination"), name="unique_route_leg")],
+            },
+        ),
+    ]
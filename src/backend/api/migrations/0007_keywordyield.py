@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0006_routeleg"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="KeywordYield",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("area", models.CharField()),
+                ("search_type", models.CharField()),
+                ("keyword", models.CharField()),
+                ("queries", models.IntegerField(default=0)),
+                ("new_places", models.IntegerField(default=0)),
+                ("recent_yield", models.FloatField(default=0)),
+                ("updated_at", models.DateTimeField()),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(fields=("area", "search_type", "keyword"), name="unique_keyword_yield")
+                ],
+            },
+        ),
+    ]
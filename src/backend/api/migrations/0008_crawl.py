@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0007_keywordyield"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Crawl",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("place_ids", models.JSONField(default=list)),
+                ("fixed_start", models.BooleanField(default=False)),
+                ("matrix", models.CharField(default="auto")),
+                ("matrix_source", models.CharField()),
+                ("durations", models.JSONField(default=list)),
+                ("distances", models.JSONField(default=list)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="crawls", to=settings.AUTH_USER_MODEL
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 14:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0008_crawl"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="crawl",
+            name="etag",
+            field=models.CharField(default=""),
+        ),
+        migrations.AddField(
+            model_name="crawl",
+            name="geo_json",
+            field=models.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name="crawl",
+            name="total_distance_miles",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="crawl",
+            name="total_time_seconds",
+            field=models.FloatField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 15:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0009_crawl_route"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="searchtile",
+            name="complete",
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -1,4 +1,37 @@
+import hashlib
+
+import numpy as np
+import orjson
+from django.conf import settings
 from django.db import models
+from django.db.models import Q
+
+from .geo import GEOHASH_PRECISION, covering_geohashes, geohash_encode, haversine_miles_array
+
+
+class LocationQuerySet(models.QuerySet):
+    def within_radius(self, latitude, longitude, radius_miles):
+        """
+        Locations within radius_miles of a point, nearest first.
+
+        Candidates are narrowed down with prefix lookups on the indexed geohash column, then the exact great-circle
+        distance of every candidate is computed in one vectorized pass.
+        """
+        prefix_filter = Q()
+        for prefix in covering_geohashes(latitude, longitude, radius_miles):
+            prefix_filter |= Q(geohash__startswith=prefix)
+
+        candidates = list(self.filter(prefix_filter))
+        if not candidates:
+            return []
+
+        distances = haversine_miles_array(
+            latitude,
+            longitude,
+            [candidate.latitude for candidate in candidates],
+            [candidate.longitude for candidate in candidates],
+        )
+        return [candidates[i] for i in np.argsort(distances, kind="stable") if distances[i] <= radius_miles]
 
 
 class Location(models.Model):
@@ -9,3 +42,121 @@ class Location(models.Model):
     longitude = models.DecimalField(max_digits=10, decimal_places=7)
     rating = models.DecimalField(blank=True, null=True, max_digits=2, decimal_places=1)
     user_ratings_total = models.IntegerField()
+    # Spatial index key, kept in sync with latitude/longitude
+    geohash = models.CharField(max_length=GEOHASH_PRECISION, db_index=True, default="")
+
+    objects = LocationQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        self.geohash = geohash_encode(self.latitude, self.longitude, GEOHASH_PRECISION)
+        super().save(*args, **kwargs)
+
+
+class SearchTile(models.Model):
+    """Place ids Google returned for a search, keyed on the snapped tile, radius bucket and type of the search"""
+
+    key = models.CharField(primary_key=True)
+    search_type = models.CharField()
+    radius_miles = models.IntegerField()
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    place_ids = models.JSONField(default=list)
+    fetched_at = models.DateTimeField()
+    # False when the search stopped early with enough venues, it then does not cover its whole circle
+    complete = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["search_type", "latitude", "longitude"])]
+
+
+class WalkingDistance(models.Model):
+    """Walking time and distance from one stop to another, as reported by the ORS matrix API"""
+
+    origin = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="+")
+    destination = models.ForeignKey(Location, on_delete=models.CASCADE, related_name="+")
+    # Null when ORS could not find a walking route between the two
+    duration_seconds = models.FloatField(blank=True, null=True)
+    distance_miles = models.FloatField(blank=True, null=True)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["origin", "destination"], name="unique_walking_distance")]
+
+
+class RouteLeg(models.Model):
+    """
+    Walking directions between two points, as one segment of an ORS directions response.
+
+    Points are keyed on their coordinates rounded to 5 decimals (about a meter). Distances are in meters and
+    durations in seconds, the ORS defaults.
+    """
+
+    origin = models.CharField()
+    destination = models.CharField()
+    # {"distance": ..., "duration": ...}
+    summary = models.JSONField()
+    # ORS steps, with way_points relative to this leg's coordinates
+    steps = models.JSONField(default=list)
+    # [lng, lat] pairs like GeoJSON
+    coordinates = models.JSONField(default=list)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["origin", "destination"], name="unique_route_leg")]
+
+
+class KeywordYield(models.Model):
+    """How many new venues text searches for a keyword add to the searches of a type in an area, see api.query_planner"""
+
+    # Geohash of the area the searches were centered in
+    area = models.CharField()
+    search_type = models.CharField()
+    keyword = models.CharField()
+    queries = models.IntegerField(default=0)
+    # Venues no type query or earlier keyword of the same search had found, in total and as a moving average per query
+    new_places = models.IntegerField(default=0)
+    recent_yield = models.FloatField(default=0)
+    updated_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=["area", "search_type", "keyword"], name="unique_keyword_yield")]
+
+
+class Crawl(models.Model):
+    """
+    A saved crawl, its stops in walking order, its route and the walking matrix between the stops, see CrawlView.
+
+    Keeping the route lets the crawl be reopened without any ORS calls, keeping the matrix lets stops be added and
+    removed later without measuring the existing pairs again.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="crawls")
+    # Stops in walking order
+    place_ids = models.JSONField(default=list)
+    # Whether the first stop stays first when stops are added
+    fixed_start = models.BooleanField(default=False)
+    # The matrix param the crawl was optimized with and where its walking times came from, see matrix.crawl_matrix
+    matrix = models.CharField(default="auto")
+    matrix_source = models.CharField()
+    # Walking durations (seconds) and distances (miles) between the stops, rows and columns in walking order
+    durations = models.JSONField(default=list)
+    distances = models.JSONField(default=list)
+    # The stitched route, see routes.stitch_legs, before the geometry params of a request are applied
+    geo_json = models.JSONField(default=dict)
+    total_distance_miles = models.FloatField(default=0)
+    total_time_seconds = models.FloatField(default=0)
+    # Hash of the stops and route, kept in sync with them
+    etag = models.CharField(default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def set_route(self, geo_json):
+        """Store a stitched route and its totals"""
+        summary = geo_json["features"][0]["properties"]["summary"]
+        self.geo_json = geo_json
+        self.total_distance_miles = summary["distance"]
+        self.total_time_seconds = summary["duration"]
+
+    def save(self, *args, **kwargs):
+        self.etag = hashlib.sha256(orjson.dumps([self.place_ids, self.geo_json])).hexdigest()[:32]
+        super().save(*args, **kwargs)
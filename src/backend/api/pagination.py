@@ -0,0 +1,90 @@
+"""
+Server-side sorting and cursor pagination of search results.
+
+Every venue of a search gets a sort key, a tuple that is smallest for the venue that should come first, and a page is
+the limit smallest keys, picked with a heap in O(n log limit) instead of sorting every candidate. The cursor of the
+next page is the key of the last venue on this one, so the next page starts right after it (keyset pagination).
+Cursors are opaque to clients.
+
+With a sort the key is the sorted field and the place id, so venues the search picks up or drops between pages do
+not shift the others; only a venue whose rating or review count changed in between can move across the cursor.
+Without a sort the venues keep the order of the search and their key is their position in it, which is only an
+offset: when the search changes between pages, venues can be skipped or repeated.
+"""
+
+import base64
+import binascii
+import heapq
+
+import orjson
+
+from .geo import haversine_miles_array
+
+SORTS = ("rating", "distance", "popularity")
+# Types of the elements of a sort key, to reject cursors whose key cannot be compared with the venues'
+_KEY_TYPES = {
+    None: (int,),
+    "rating": (bool, (int, float), int, str),
+    "distance": ((int, float), str),
+    "popularity": (int, (int, float), str),
+}
+
+
+def sort_keys(locations, sort, latitude, longitude):
+    """The sort key of every location, ties are broken by place id so the order is total"""
+    if sort is None:
+        return [(index,) for index in range(len(locations))]
+    if sort == "distance":
+        distances = haversine_miles_array(
+            latitude,
+            longitude,
+            [location.latitude for location in locations],
+            [location.longitude for location in locations],
+        )
+        return [(float(distance), location.place_id) for distance, location in zip(distances, locations)]
+    if sort == "rating":
+        # Best rated first, venues without a rating last, the more reviewed of two equal ratings first
+        return [
+            (
+                location.rating is None,
+                -float(location.rating or 0),
+                -location.user_ratings_total,
+                location.place_id,
+            )
+            for location in locations
+        ]
+    return [(-location.user_ratings_total, -float(location.rating or 0), location.place_id) for location in locations]
+
+
+def page(locations, keys, limit=None, after=None):
+    """
+    The locations of a page, in order, and the key of its last location when more follow, otherwise None.
+
+    after is the key of the last location of the previous page.
+    """
+    candidates = [(key, index) for index, key in enumerate(keys) if after is None or key > after]
+    if limit is None:
+        return [locations[index] for _, index in sorted(candidates)], None
+    # One more than asked for, to know whether another page follows
+    chosen = heapq.nsmallest(limit + 1, candidates)
+    more = len(chosen) > limit
+    chosen = chosen[:limit]
+    return [locations[index] for _, index in chosen], chosen[-1][0] if more else None
+
+
+def encode_cursor(sort, key):
+    return base64.urlsafe_b64encode(orjson.dumps([sort, key])).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor, sort):
+    """The key a cursor continues after, raises ValueError when it is malformed or was made for another sort"""
+    try:
+        cursor_sort, key = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort:
+        raise ValueError("cursor belongs to a search with another sort")
+    types = _KEY_TYPES[sort]
+    if not isinstance(key, list) or len(key) != len(types) or not all(map(isinstance, key, types)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
@@ -0,0 +1,92 @@
+"""
+Adaptive planning of the keyword text searches of a search.
+
+After its type queries, a search runs one text search per keyword ("bar", "pub", "tavern", ...), and in most areas those
+mostly return venues the type queries already found. For every area (a ~5km geohash tile), search type and keyword the
+planner keeps a moving average of how many new venues a query contributed. Once a keyword has SEARCH_PLANNER_MIN_SAMPLES
+searches behind it and its average is below SEARCH_PLANNER_MIN_YIELD, it is skipped in that area. A
+SEARCH_PLANNER_EXPLORE share of searches still runs the skipped keywords, last, so the averages follow the area when
+new venues open.
+"""
+
+import random
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .geo import geohash_encode
+from .models import KeywordYield
+
+AREA_PRECISION = 5
+# Weight of the latest search in the moving average
+SMOOTHING = 0.3
+
+
+def area_key(latitude, longitude):
+    return geohash_encode(float(latitude), float(longitude), AREA_PRECISION)
+
+
+def plan(latitude, longitude, search_type, keywords):
+    """Split keywords into (keywords to search, low yield keywords explored this time), the others are skipped"""
+    if not settings.SEARCH_PLANNER:
+        return list(keywords), []
+
+    stats = {
+        row.keyword: row
+        for row in KeywordYield.objects.filter(
+            area=area_key(latitude, longitude), search_type=search_type, keyword__in=keywords
+        )
+    }
+    eager, explored = [], []
+    for keyword in keywords:
+        row = stats.get(keyword)
+        if row is None or row.queries < settings.SEARCH_PLANNER_MIN_SAMPLES:
+            outcome = "run"
+        elif row.recent_yield >= settings.SEARCH_PLANNER_MIN_YIELD:
+            outcome = "run"
+        else:
+            outcome = "explored" if random.random() < settings.SEARCH_PLANNER_EXPLORE else "skipped"
+        metrics.keyword_queries.inc(outcome=outcome)
+        if outcome == "run":
+            eager.append(keyword)
+        elif outcome == "explored":
+            explored.append(keyword)
+    return eager, explored
+
+
+def record(latitude, longitude, search_type, yields):
+    """Add the {keyword: new venues} of a finished search to the moving averages of its area"""
+    if not settings.SEARCH_PLANNER or not yields:
+        return
+
+    area = area_key(latitude, longitude)
+    stats = {
+        row.keyword: row
+        for row in KeywordYield.objects.filter(area=area, search_type=search_type, keyword__in=list(yields))
+    }
+    now = timezone.now()
+    rows = []
+    for keyword, new_places in yields.items():
+        row = stats.get(keyword)
+        recent_yield = new_places
+        if row is not None and row.queries:
+            recent_yield = row.recent_yield + SMOOTHING * (new_places - row.recent_yield)
+        rows.append(
+            KeywordYield(
+                area=area,
+                search_type=search_type,
+                keyword=keyword,
+                queries=(row.queries if row else 0) + 1,
+                new_places=(row.new_places if row else 0) + new_places,
+                recent_yield=recent_yield,
+                updated_at=now,
+            )
+        )
+    # Concurrent searches of an area can overwrite each other's sample, which the averages can live with
+    KeywordYield.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["area", "search_type", "keyword"],
+        update_fields=["queries", "new_places", "recent_yield", "updated_at"],
+    )
@@ -0,0 +1,249 @@
+"""
+Walking directions built from cached legs.
+
+A leg is the route between two consecutive points. Legs are stored in the RouteLeg table the first time ORS returns
+them, so a two point route or a whole crawl only asks ORS for the legs that have not been seen before. Consecutive
+missing legs are fetched together in multi-stop directions requests of at most ORS_MAX_WAYPOINTS stops, made
+concurrently, and split back into legs.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import clients
+from .geo import METERS_PER_MILE, encode_line, simplify
+from .models import RouteLeg
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS_PATH = "/v2/directions/foot-walking/geojson"
+
+
+def point_key(lat, lng):
+    """Cache key of a point, rounded to about a meter"""
+    return f"{float(lat):.5f},{float(lng):.5f}"
+
+
+def directions_body(points):
+    """ORS directions request through (lat, lng) points"""
+    return {
+        "coordinates": [[float(lng), float(lat)] for lat, lng in points],
+        "preference": "shortest",
+        "instructions": "true",
+    }
+
+
+def fetch_route(points):
+    """Ask ORS for walking directions through (lat, lng) points, in meters and seconds"""
+    return clients.ors.post(DIRECTIONS_PATH, endpoint="directions", json=directions_body(points))
+
+
+async def afetch_route(points):
+    """Async version of fetch_route"""
+    return await clients.async_ors.post(DIRECTIONS_PATH, endpoint="directions", json=directions_body(points))
+
+
+def split_legs(geo_json, count):
+    """Split a multi-stop ORS route into count legs of {"summary", "steps", "coordinates"}"""
+    feature = geo_json["features"][0]
+    coordinates = feature["geometry"].get("coordinates", [])
+    way_points = feature["properties"].get("way_points")
+    if way_points is None and count == 1:
+        way_points = [0, max(len(coordinates) - 1, 0)]
+    segments = feature["properties"].get("segments") or [feature["properties"]["summary"]]
+
+    legs = []
+    for i in range(count):
+        first, last = way_points[i], way_points[i + 1]
+        segment = segments[i]
+        steps = [
+            {**step, "way_points": [index - first for index in step.get("way_points", [first, first])]}
+            for step in segment.get("steps", [])
+        ]
+        legs.append(
+            {
+                "summary": {"distance": segment["distance"], "duration": segment["duration"]},
+                "steps": steps,
+                "coordinates": coordinates[first : last + 1],
+            }
+        )
+    return legs
+
+
+def route_legs(points):
+    """
+    Return the leg between every pair of consecutive (lat, lng) points, fetching only the missing ones.
+
+    At most ORS_MAX_CONCURRENCY runs of missing legs are requested at once.
+    """
+    pairs, legs = cached_legs(points)
+    runs = missing_runs(legs, settings.ORS_MAX_WAYPOINTS - 1)
+    chunks = [points[i : j + 1] for i, j in runs]
+    if len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=min(settings.ORS_MAX_CONCURRENCY, len(chunks))) as executor:
+            futures = [clients.submit(executor, fetch_route, chunk) for chunk in chunks]
+            routes = [future.result() for future in futures]
+    else:
+        routes = [fetch_route(chunk) for chunk in chunks]
+    for (i, j), geo_json in zip(runs, routes):
+        legs[i:j] = split_legs(geo_json, j - i)
+    save_legs(pairs, legs, runs)
+    return legs
+
+
+async def aroute_legs(points):
+    """Async version of route_legs"""
+    pairs, legs = await sync_to_async(cached_legs)(points)
+    runs = missing_runs(legs, settings.ORS_MAX_WAYPOINTS - 1)
+    if not runs:
+        return legs
+
+    limit = asyncio.Semaphore(settings.ORS_MAX_CONCURRENCY)
+
+    async def fetch(i, j):
+        async with limit:
+            return await afetch_route(points[i : j + 1])
+
+    routes = await asyncio.gather(*(fetch(i, j) for i, j in runs))
+    for (i, j), geo_json in zip(runs, routes):
+        legs[i:j] = split_legs(geo_json, j - i)
+    await sync_to_async(save_legs)(pairs, legs, runs)
+    return legs
+
+
+def cached_legs(points):
+    """
+    Return the (origin, destination) key pairs of the legs between consecutive points, and the legs themselves.
+
+    Legs with no stored copy younger than ROUTE_LEG_TTL are None.
+    """
+    keys = [point_key(lat, lng) for lat, lng in points]
+    pairs = list(zip(keys, keys[1:]))
+
+    fresh_after = timezone.now() - timedelta(seconds=settings.ROUTE_LEG_TTL)
+    cached = {
+        (leg.origin, leg.destination): {"summary": leg.summary, "steps": leg.steps, "coordinates": leg.coordinates}
+        for leg in RouteLeg.objects.filter(origin__in=keys, destination__in=keys, updated_at__gte=fresh_after)
+    }
+    return pairs, [cached.get(pair) for pair in pairs]
+
+
+def missing_runs(legs, max_legs=None):
+    """[start, end) ranges of consecutive missing legs, at most max_legs long, each run is fetched with one request"""
+    runs = []
+    i = 0
+    while i < len(legs):
+        if legs[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j < len(legs) and legs[j] is None and (max_legs is None or j - i < max_legs):
+            j += 1
+        logger.debug(f"Fetching {j - i} route legs from ORS")
+        runs.append((i, j))
+        i = j
+    return runs
+
+
+def save_legs(pairs, legs, runs):
+    """Store the legs fetched for runs"""
+    new_legs = [i for start, end in runs for i in range(start, end)]
+    now = timezone.now()
+    RouteLeg.objects.bulk_create(
+        [
+            RouteLeg(origin=pairs[i][0], destination=pairs[i][1], updated_at=now, **legs[i])
+            # The same leg can appear twice in one route, it only needs storing once
+            for i in {pairs[i]: i for i in new_legs}.values()
+        ],
+        update_conflicts=True,
+        unique_fields=["origin", "destination"],
+        update_fields=["summary", "steps", "coordinates", "updated_at"],
+    )
+
+
+def stitch_legs(legs):
+    """
+    Join legs into one ORS style GeoJSON FeatureCollection.
+
+    Distances are converted to miles (rounded like ORS does with units=mi), durations stay in seconds.
+    """
+
+    def miles(meters):
+        return round(meters / METERS_PER_MILE, 3)
+
+    coordinates = []
+    way_points = [0]
+    segments = []
+    for leg in legs:
+        offset = max(len(coordinates) - 1, 0)
+        # Every leg starts where the previous one ended, so drop the shared point
+        coordinates.extend(leg["coordinates"][1:] if coordinates else leg["coordinates"])
+        way_points.append(max(len(coordinates) - 1, 0))
+        segments.append(
+            {
+                "distance": miles(leg["summary"]["distance"]),
+                "duration": leg["summary"]["duration"],
+                "steps": [
+                    {
+                        **step,
+                        "distance": miles(step["distance"]),
+                        "way_points": [index + offset for index in step["way_points"]],
+                    }
+                    for step in leg["steps"]
+                ],
+            }
+        )
+
+    summary = {
+        "distance": miles(sum(leg["summary"]["distance"] for leg in legs)),
+        "duration": round(sum(leg["summary"]["duration"] for leg in legs), 1),
+    }
+    feature = {
+        "type": "Feature",
+        "properties": {"segments": segments, "way_points": way_points, "summary": summary},
+        "geometry": {"type": "LineString", "coordinates": coordinates},
+    }
+    if coordinates:
+        lngs = [coordinate[0] for coordinate in coordinates]
+        lats = [coordinate[1] for coordinate in coordinates]
+        feature["bbox"] = [min(lngs), min(lats), max(lngs), max(lats)]
+
+    geo_json = {"type": "FeatureCollection", "features": [feature]}
+    if "bbox" in feature:
+        geo_json["bbox"] = feature["bbox"]
+    return geo_json
+
+
+def compact_geometry(geo_json, encoding="geojson", precision=5, tolerance=0):
+    """
+    Simplify and encode the line of a stitched crawl in place, see geo.simplify and geo.encode_line.
+
+    The ends of every leg and step are kept through simplification and their way_points are renumbered to match.
+    """
+    feature = geo_json["features"][0]
+    properties = feature["properties"]
+    coordinates = feature["geometry"]["coordinates"]
+
+    steps = [step for segment in properties["segments"] for step in segment["steps"]]
+    keep = {*properties["way_points"], *(index for step in steps for index in step["way_points"])}
+    kept = simplify(coordinates, tolerance, keep=keep)
+    if len(kept) < len(coordinates):
+        coordinates = [coordinates[i] for i in kept]
+        # keep is a subset of kept, so every way point lands exactly on its new index
+        kept = np.asarray(kept)
+        properties["way_points"] = np.searchsorted(kept, properties["way_points"]).tolist()
+        for step in steps:
+            step["way_points"] = np.searchsorted(kept, step["way_points"]).tolist()
+
+    feature["geometry"] = {"type": "LineString", "coordinates": encode_line(coordinates, encoding, precision)}
+    if encoding != "geojson":
+        feature["geometry"].update(encoding=encoding, precision=precision)
+    return geo_json
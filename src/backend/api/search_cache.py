@@ -0,0 +1,132 @@
+"""
+Geo-tile cache for search results.
+
+A search is keyed on the geohash tile its center falls in, the radius rounded up to a fixed bucket and the search type.
+Each entry remembers which place ids Google returned, so a repeat search in the same tile (or inside the circle of a
+bigger search nearby) can be answered from the Location table without calling Google again.
+"""
+
+import logging
+import math
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics, writeback
+from .geo import EARTH_RADIUS_MILES, geohash_encode, haversine_miles
+from .models import Location, SearchTile
+
+logger = logging.getLogger(__name__)
+
+# Radii (miles) that searches get rounded up to. Google caps nearby searches at 50km (~31 miles).
+RADIUS_BUCKETS = (1, 2, 5, 10, 15, 20, 25, 31)
+
+
+def radius_bucket(radius_miles):
+    """Round a radius up to the nearest bucket, radii past the last bucket are left as is"""
+    return next((bucket for bucket in RADIUS_BUCKETS if bucket >= radius_miles), radius_miles)
+
+
+def tile_precision(radius_miles):
+    """Geohash length used to snap a search center, kept well below the search radius"""
+    if radius_miles <= 2:
+        return 7  # ~150m tiles
+    if radius_miles <= 10:
+        return 6  # ~1.2km x 0.6km tiles
+    return 5  # ~4.9km tiles
+
+
+def tile_key(latitude, longitude, radius_miles, search_type):
+    bucket = radius_bucket(radius_miles)
+    return f"{search_type}:{bucket}:{geohash_encode(latitude, longitude, tile_precision(bucket))}"
+
+
+def within_radius(locations, latitude, longitude, radius_miles):
+    return [
+        location
+        for location in locations
+        if haversine_miles(latitude, longitude, location.latitude, location.longitude) <= radius_miles
+    ]
+
+
+def _load(tile):
+    """Load the Location rows of a tile in the order Google returned them, None if any have disappeared"""
+    # Venues of a search a moment ago may still be waiting in the write-behind queue
+    locations = {**Location.objects.in_bulk(tile.place_ids), **writeback.locations.pending(tile.place_ids)}
+    if len(locations) != len(tile.place_ids):
+        return None
+    return [locations[place_id] for place_id in tile.place_ids]
+
+
+def _covering_tile(latitude, longitude, radius_miles, search_type, fresh_after):
+    """Find a fresh entry from any tile whose search circle fully contains the requested circle"""
+    # Only entries whose center is within the largest possible radius can cover this search
+    lat_reach = math.degrees(RADIUS_BUCKETS[-1] / EARTH_RADIUS_MILES)
+    lng_reach = lat_reach / max(math.cos(math.radians(latitude)), 0.01)
+    candidates = SearchTile.objects.filter(
+        search_type=search_type,
+        complete=True,
+        radius_miles__gte=radius_miles,
+        fetched_at__gte=fresh_after,
+        latitude__range=(latitude - lat_reach, latitude + lat_reach),
+        longitude__range=(longitude - lng_reach, longitude + lng_reach),
+    ).order_by("radius_miles", "-fetched_at")
+
+    for tile in candidates:
+        if haversine_miles(latitude, longitude, tile.latitude, tile.longitude) + radius_miles <= tile.radius_miles:
+            return tile
+    return None
+
+
+def lookup(latitude, longitude, radius_miles, search_type):
+    """
+    Return the cached locations for a search, or None on a miss.
+
+    The exact tile is tried first. Failing that, any fresh overlapping search whose circle covers this one is reused
+    and trimmed down to the requested radius.
+    """
+    return find(latitude, longitude, radius_miles, search_type)[0]
+
+
+def find(latitude, longitude, radius_miles, search_type):
+    """lookup, along with when Google was asked for the venues, (None, None) on a miss"""
+    fresh_after = timezone.now() - timedelta(seconds=settings.SEARCH_CACHE_TTL)
+    key = tile_key(latitude, longitude, radius_miles, search_type)
+
+    tile = SearchTile.objects.filter(key=key, fetched_at__gte=fresh_after).first()
+    if tile is None:
+        tile = _covering_tile(latitude, longitude, radius_miles, search_type, fresh_after)
+
+    locations = _load(tile) if tile is not None else None
+    if locations is None:
+        metrics.search_cache_misses.inc()
+        logger.debug(f"Search cache miss for {key}")
+        return None, None
+
+    metrics.search_cache_hits.inc()
+    logger.debug(f"Search cache hit for {key} served by {tile.key}")
+    if tile.key != key or tile.radius_miles > radius_miles:
+        locations = within_radius(locations, latitude, longitude, radius_miles)
+    return locations, tile.fetched_at
+
+
+def store(latitude, longitude, radius_miles, search_type, place_ids, complete=True):
+    """
+    Remember the place ids Google returned for a search made at the bucketed radius.
+
+    An incomplete search, one that stopped early with enough venues, only answers repeats of itself. Its venues are
+    the ones nearest its center, so other searches inside its circle must not be trimmed from it.
+    """
+    SearchTile.objects.update_or_create(
+        key=tile_key(latitude, longitude, radius_miles, search_type),
+        defaults={
+            "search_type": search_type,
+            "radius_miles": radius_bucket(radius_miles),
+            "latitude": latitude,
+            "longitude": longitude,
+            "place_ids": place_ids,
+            "fetched_at": timezone.now(),
+            "complete": complete,
+        },
+    )
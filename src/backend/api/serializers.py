@@ -1,3 +1,6 @@
+import decimal
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth.models import User
 from rest_framework.validators import UniqueValidator
@@ -46,4 +49,46 @@ class RegisterSerializer(serializers.ModelSerializer):
 class LocationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Location
-        fields = "__all__"
+        exclude = ("geohash",)
+
+
+def decimal_formatter(field):
+    """Format values of a model DecimalField the way DRF's DecimalField does, as a fixed point string"""
+    quantum = Decimal(1).scaleb(-field.decimal_places)
+    context = decimal.getcontext().copy()
+    context.prec = field.max_digits
+
+    def format(value):
+        if value is None:
+            return None
+        if not isinstance(value, Decimal):
+            value = Decimal(str(value).strip())
+        return f"{value.quantize(quantum, context=context):f}"
+
+    return format
+
+
+_latitude = decimal_formatter(Location._meta.get_field("latitude"))
+_longitude = decimal_formatter(Location._meta.get_field("longitude"))
+_rating = decimal_formatter(Location._meta.get_field("rating"))
+
+
+def location_data(locations):
+    """
+    Same output as LocationSerializer(locations, many=True).data, built directly.
+
+    Search and crawl responses serialize whole venue lists, where DRF's per-field machinery is most of the cost.
+    Keep the fields in sync with LocationSerializer.
+    """
+    return [
+        {
+            "place_id": location.place_id,
+            "name": location.name,
+            "address": location.address,
+            "latitude": _latitude(location.latitude),
+            "longitude": _longitude(location.longitude),
+            "rating": _rating(location.rating),
+            "user_ratings_total": location.user_ratings_total,
+        }
+        for location in locations
+    ]
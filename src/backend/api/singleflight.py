@@ -0,0 +1,94 @@
+"""
+Single-flight coalescing of identical requests that are in flight at the same time.
+
+When several people open the app at the same bar, their searches arrive within a second of each other and would each
+run the full Google fan-out, since none of them is in the tile cache yet. With a SingleFlight the first request for a
+key does the work and every request for the same key that arrives before it finishes waits for, and shares, its
+result (or its exception). Nothing is kept once the work is done, repeat requests are the caches' job.
+
+Coalescing is per process: do() coalesces threads of a sync worker, ado() coroutines on one event loop.
+"""
+
+import asyncio
+import threading
+import weakref
+
+from django.conf import settings
+
+from . import metrics
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces calls by key, use the module level searches and crawls instances"""
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        # {event loop: {key: task}}, tasks cannot be awaited from another loop
+        self._tasks = weakref.WeakKeyDictionary()
+
+    def do(self, key, fn):
+        """Call fn() unless a call for key is already running, returns (result, whether it was shared)"""
+        if not settings.REQUEST_COALESCING:
+            return fn(), False
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.coalesced_requests.inc(kind=self.name, role="follower")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value, True
+
+        metrics.coalesced_requests.inc(kind=self.name, role="leader")
+        try:
+            call.value = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.value, False
+
+    async def ado(self, key, fn):
+        """Async version of do(), fn is a coroutine function"""
+        if not settings.REQUEST_COALESCING:
+            return await fn(), False
+
+        tasks = self._tasks.setdefault(asyncio.get_running_loop(), {})
+        task = tasks.get(key)
+        shared = task is not None
+        if shared:
+            metrics.coalesced_requests.inc(kind=self.name, role="follower")
+        else:
+            metrics.coalesced_requests.inc(kind=self.name, role="leader")
+            # Run as its own task, so the others still get a result when the first request is cancelled
+            task = tasks[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda done: self._finish(tasks, key, done))
+        return await asyncio.shield(task), shared
+
+    def _finish(self, tasks, key, task):
+        if tasks.get(key) is task:
+            del tasks[key]
+        # Mark the exception as retrieved, every waiter may have gone away
+        if not task.cancelled():
+            task.exception()
+
+
+searches = SingleFlight("search")
+crawls = SingleFlight("optimize")
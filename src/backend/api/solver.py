@@ -0,0 +1,427 @@
+"""
+Stop ordering for crawls.
+
+Every solver works on a square matrix of walking durations and returns an open path (the crawl does not return to its
+first stop). Paths either start at a fixed stop or at whichever stop gives the shortest walk.
+
+Crawls too large for one walking matrix are split into clusters of nearby stops with k-means and solved cluster by
+cluster, see solve_clustered.
+"""
+
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+# Held-Karp is O(2^n * n^2), past this many stops local search is used instead
+HELD_KARP_MAX_STOPS = 12
+# Generous estimate of the time Held-Karp takes per 2^n * n^2 step, to tell whether it fits in a latency budget
+HELD_KARP_NS_PER_STEP = 500
+# The anytime solver stops early after this many perturbations in a row found nothing better
+ANYTIME_MAX_STALL = 200
+# Stand-in cost for pairs ORS could not route between
+UNREACHABLE = 1e7
+
+
+@dataclass
+class Solution:
+    order: list[int]
+    cost: float
+    solver: str
+    solve_time_ms: float
+    greedy_cost: float
+    clusters: int = 1
+    # Perturbation rounds of the anytime solver
+    iterations: int = 0
+
+    @property
+    def improvement_percent(self):
+        if not self.greedy_cost:
+            return 0.0
+        return (self.greedy_cost - self.cost) / self.greedy_cost * 100
+
+
+def as_matrix(durations):
+    """Convert an ORS style list of lists (which may contain None) into a float matrix"""
+    return np.array([[UNREACHABLE if d is None else d for d in row] for row in durations], dtype=float)
+
+
+def path_cost(matrix, order):
+    order = np.asarray(order)
+    return float(matrix[order[:-1], order[1:]].sum())
+
+
+def nearest_neighbor(matrix, start=0):
+    """Greedy path that always walks to the closest unvisited stop"""
+    n = len(matrix)
+    unvisited = set(range(n)) - {start}
+    route = [start]
+
+    while unvisited:
+        current = route[-1]
+        next_location = min(unvisited, key=lambda x: matrix[current][x])
+        route.append(next_location)
+        unvisited.remove(next_location)
+
+    return route
+
+
+def held_karp(matrix, start=None):
+    """Exact shortest open path by dynamic programming over subsets of visited stops"""
+    n = len(matrix)
+    full = (1 << n) - 1
+    cost = np.full((1 << n, n), np.inf)
+    parent = np.full((1 << n, n), -1, dtype=int)
+    starts = range(n) if start is None else [start]
+    for s in starts:
+        cost[1 << s, s] = 0
+
+    bits = 1 << np.arange(n)
+    for mask in range(1, full):
+        if not np.isfinite(cost[mask]).any():
+            continue
+        # Best way to reach every stop k from any stop j already in the path
+        candidates = cost[mask][:, None] + matrix
+        best_prev = candidates.argmin(axis=0)
+        best_cost = candidates[best_prev, np.arange(n)]
+        for k in np.flatnonzero((mask & bits) == 0):
+            next_mask = mask | (1 << k)
+            if best_cost[k] < cost[next_mask, k]:
+                cost[next_mask, k] = best_cost[k]
+                parent[next_mask, k] = best_prev[k]
+
+    last = int(cost[full].argmin())
+    route = []
+    mask = full
+    while last != -1:
+        route.append(last)
+        mask, last = mask ^ (1 << last), int(parent[mask, last])
+    return route[::-1]
+
+
+def held_karp_ms(n):
+    """Estimated time Held-Karp takes over n stops, in milliseconds"""
+    return (1 << n) * n * n * HELD_KARP_NS_PER_STEP / 1e6
+
+
+def out_of_time(deadline):
+    return deadline is not None and time.perf_counter() >= deadline
+
+
+def two_opt(matrix, order, fixed_start=True, deadline=None):
+    """Reverse sub-paths while doing so shortens the walk, evaluating every reversal at once"""
+    order = np.array(order)
+    n = len(order)
+    if n < 3:
+        return order.tolist()
+    first = 1 if fixed_start else 0
+
+    while not out_of_time(deadline):
+        forward = np.concatenate(([0], np.cumsum(matrix[order[:-1], order[1:]])))
+        backward = np.concatenate(([0], np.cumsum(matrix[order[1:], order[:-1]])))
+        i, j = np.triu_indices(n, k=1)
+        keep = i >= first
+        i, j = i[keep], j[keep]
+        has_prev = i > 0
+        has_next = j < n - 1
+        prev_stop = order[np.maximum(i - 1, 0)]
+        next_stop = order[np.minimum(j + 1, n - 1)]
+
+        old = forward[j] - forward[i]
+        old = old + np.where(has_prev, matrix[prev_stop, order[i]], 0)
+        old = old + np.where(has_next, matrix[order[j], next_stop], 0)
+        new = backward[j] - backward[i]
+        new = new + np.where(has_prev, matrix[prev_stop, order[j]], 0)
+        new = new + np.where(has_next, matrix[order[i], next_stop], 0)
+
+        best = int(np.argmin(new - old))
+        if new[best] - old[best] >= -1e-9:
+            break
+        order[i[best] : j[best] + 1] = order[i[best] : j[best] + 1][::-1]
+    return order.tolist()
+
+
+def or_opt(matrix, order, fixed_start=True, deadline=None):
+    """Move runs of 1-3 consecutive stops to a better spot in the path, returns the first improvement found"""
+    n = len(order)
+    first = 1 if fixed_start else 0
+
+    for length in (1, 2, 3):
+        if length >= n - first:
+            break
+        for i in range(first, n - length + 1):
+            if out_of_time(deadline):
+                return None
+            head, tail = order[i], order[i + length - 1]
+            prev_stop = order[i - 1] if i > 0 else None
+            next_stop = order[i + length] if i + length < n else None
+            removed = 0.0
+            if prev_stop is not None:
+                removed += matrix[prev_stop, head]
+            if next_stop is not None:
+                removed += matrix[tail, next_stop]
+            if prev_stop is not None and next_stop is not None:
+                removed -= matrix[prev_stop, next_stop]
+
+            # Cost of splicing the run back in before every position of the remaining path
+            rest = np.array(order[:i] + order[i + length :])
+            positions = np.arange(first, len(rest) + 1)
+            has_before = positions > 0
+            has_after = positions < len(rest)
+            before = rest[np.maximum(positions - 1, 0)]
+            after = rest[np.minimum(positions, len(rest) - 1)]
+            added = np.where(has_before, matrix[before, head], 0) + np.where(has_after, matrix[tail, after], 0)
+            added -= np.where(has_before & has_after, matrix[before, after], 0)
+
+            delta = added - removed
+            delta[positions == i] = 0
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                rest = rest.tolist()
+                position = int(positions[best])
+                return rest[:position] + order[i : i + length] + rest[position:]
+    return None
+
+
+def local_search(matrix, order, fixed_start=True, deadline=None):
+    """Alternate 2-opt and Or-opt until neither improves the path, or until deadline (a time.perf_counter() value)"""
+    order = list(order)
+    while True:
+        order = two_opt(matrix, order, fixed_start, deadline)
+        improved = or_opt(matrix, order, fixed_start, deadline)
+        if improved is None:
+            return order
+        order = improved
+
+
+def double_bridge(order, first, rng):
+    """Swap two random consecutive sub-paths, a jump local search cannot undo in one move"""
+    a, b, c = sorted(rng.choice(np.arange(first + 1, len(order)), size=3, replace=False))
+    return order[:a] + order[b:c] + order[a:b] + order[c:]
+
+
+def anytime(matrix, order, fixed_start, deadline, seed=0):
+    """
+    Improve a path until deadline (a time.perf_counter() value), returns the best path found and the rounds it took.
+
+    The path is brought to a local optimum first. Every round then perturbs the best path with a double bridge and
+    runs local search on the result again, keeping it when it is shorter. Small crawls run out of new paths long before
+    the deadline, so the search also ends after ANYTIME_MAX_STALL rounds without an improvement.
+    """
+    rng = np.random.default_rng(seed)
+    first = 1 if fixed_start else 0
+    best = local_search(matrix, order, fixed_start, deadline)
+    best_cost = path_cost(matrix, best)
+    iterations = stall = 0
+    while len(best) - first > 3 and stall < ANYTIME_MAX_STALL and not out_of_time(deadline):
+        iterations += 1
+        candidate = local_search(matrix, double_bridge(best, first, rng), fixed_start, deadline)
+        cost = path_cost(matrix, candidate)
+        if cost < best_cost - 1e-9:
+            best, best_cost, stall = candidate, cost, 0
+        else:
+            stall += 1
+    return best, iterations
+
+
+def solve(durations, start=None, solver="auto", end=None, budget_ms=None):
+    """
+    Order the stops of a crawl.
+
+    start fixes the first stop, otherwise the best starting stop is chosen as well. end likewise fixes the last stop.
+    solver is one of "auto", "held_karp", "local_search", "greedy" or "anytime"; "auto" uses Held-Karp for small crawls
+    and local search for larger ones. The greedy nearest neighbour path from the first stop is always computed as a
+    baseline. With budget_ms, "auto" and "local_search" become "anytime", which improves the greedy path until
+    budget_ms after the start, see anytime. Crawls small enough for Held-Karp to fit in the budget, see held_karp_ms,
+    are solved exactly instead.
+    """
+    costs = as_matrix(durations)
+    matrix = costs
+    n = len(matrix)
+    started = time.perf_counter()
+
+    if end is not None and end != start and n > 1:
+        # Walking on from the last stop costs more than any path, so every solver leaves it for last
+        matrix = costs.copy()
+        matrix[end] += costs.sum() + 1
+
+    greedy = nearest_neighbor(matrix, 0 if start is None else start)
+    if end is not None and end != start and n > 1:
+        greedy.remove(end)
+        greedy.append(end)
+    if budget_ms is not None and solver in ("auto", "local_search"):
+        solver = "held_karp" if n <= HELD_KARP_MAX_STOPS and held_karp_ms(n) <= budget_ms else "anytime"
+    elif solver == "auto":
+        solver = "held_karp" if n <= HELD_KARP_MAX_STOPS else "local_search"
+
+    iterations = 0
+    if solver == "greedy":
+        order = greedy
+    elif solver == "anytime":
+        order, iterations = anytime(matrix, greedy, start is not None, started + (budget_ms or 0) / 1000)
+    elif solver == "held_karp":
+        order = held_karp(matrix, start)
+    elif solver == "local_search":
+        if start is None:
+            # Seed with the best greedy path over every possible first stop
+            order = min((nearest_neighbor(matrix, s) for s in range(n)), key=lambda o: path_cost(matrix, o))
+        else:
+            order = greedy
+        order = local_search(matrix, order, fixed_start=start is not None)
+    else:
+        raise ValueError(f"Unknown solver {solver}")
+
+    return Solution(
+        order=[int(i) for i in order],
+        cost=path_cost(costs, order),
+        solver=solver,
+        solve_time_ms=(time.perf_counter() - started) * 1000,
+        greedy_cost=path_cost(costs, greedy),
+        iterations=iterations,
+    )
+
+
+def kmeans(points, k, iterations=100, seed=0):
+    """Lloyd's k-means with k-means++ seeding over an (n, 2) array of planar points, returns every point's cluster"""
+    points = np.asarray(points, dtype=float)
+    n = len(points)
+    rng = np.random.default_rng(seed)
+
+    centers = np.empty((k, 2))
+    centers[0] = points[rng.integers(n)]
+    nearest = ((points - centers[0]) ** 2).sum(axis=1)
+    for c in range(1, k):
+        # Later centers are picked with a probability growing with the squared distance to the closest center so far
+        total = nearest.sum()
+        centers[c] = points[rng.choice(n, p=nearest / total) if total else rng.integers(n)]
+        nearest = np.minimum(nearest, ((points - centers[c]) ** 2).sum(axis=1))
+
+    labels = None
+    for _ in range(iterations):
+        distances = ((points[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=points[:, axis], minlength=k) for axis in (0, 1)], axis=1)
+        # Centers that lost all their points stay where they are
+        moved = counts > 0
+        centers[moved] = sums[moved] / counts[moved, None]
+    return labels
+
+
+def cluster(points, max_size, seed=0):
+    """Split stops at planar points into groups of at most max_size nearby stops, returns lists of stop indices"""
+    points = np.asarray(points, dtype=float)
+    pending = [np.arange(len(points))]
+    groups = []
+    while pending:
+        indices = pending.pop()
+        if len(indices) <= max_size:
+            groups.append(indices.tolist())
+            continue
+        labels = kmeans(points[indices], math.ceil(len(indices) / max_size), seed=seed)
+        parts = [indices[labels == label] for label in np.unique(labels)]
+        if len(parts) == 1:
+            # Every stop is at the same spot
+            parts = [indices[i : i + max_size] for i in range(0, len(indices), max_size)]
+        # k-means does not balance cluster sizes, oversized clusters are split again
+        pending.extend(parts)
+    return groups
+
+
+def solve_clustered(estimated, clusters, cluster_durations, start=None, solver="auto", budget_ms=None):
+    """
+    Order a crawl too large for one walking matrix, cluster by cluster.
+
+    estimated holds estimated durations between every pair of stops, clusters the stop indices of every cluster and
+    cluster_durations the measured durations between the stops within each cluster. The clusters are ordered by the
+    estimated walk between their closest stops. Each cluster's path then runs from where the previous cluster left
+    off to its stop closest to the next cluster. Costs are measured within clusters and estimated between them.
+    budget_ms is shared out between the clusters by their number of stops.
+    """
+    started = time.perf_counter()
+    estimated = np.asarray(estimated, dtype=float)
+    costs = estimated.copy()
+    for members, durations in zip(clusters, cluster_durations):
+        costs[np.ix_(members, members)] = as_matrix(durations)
+
+    between = np.array(
+        [
+            [0 if a == b else estimated[np.ix_(first, second)].min() for b, second in enumerate(clusters)]
+            for a, first in enumerate(clusters)
+        ]
+    )
+    first_cluster = None if start is None else next(c for c, members in enumerate(clusters) if start in members)
+    cluster_order = solve(between, start=first_cluster, solver=solver).order
+
+    order = []
+    iterations = 0
+    entry = start
+    for position, c in enumerate(cluster_order):
+        members = clusters[c]
+        local_start = None if entry is None else members.index(entry)
+        local_end = None
+        if position + 1 < len(cluster_order):
+            following = clusters[cluster_order[position + 1]]
+            exits = estimated[np.ix_(members, following)]
+            if local_start is not None and len(members) > 1:
+                exits[local_start] = np.inf
+            local_end, next_entry = np.unravel_index(int(exits.argmin()), exits.shape)
+            entry = following[next_entry]
+        share = None if budget_ms is None else budget_ms * len(members) / len(estimated)
+        path = solve(cluster_durations[c], start=local_start, solver=solver, end=local_end, budget_ms=share)
+        order += [members[i] for i in path.order]
+        iterations += path.iterations
+
+    greedy = nearest_neighbor(costs, 0 if start is None else start)
+    return Solution(
+        order=[int(i) for i in order],
+        cost=path_cost(costs, order),
+        solver="clustered",
+        solve_time_ms=(time.perf_counter() - started) * 1000,
+        greedy_cost=path_cost(costs, greedy),
+        clusters=len(clusters),
+        iterations=iterations,
+    )
+
+
+def insert_stops(durations, order, stops, fixed_start=True):
+    """
+    Add stops to an ordered path, e.g. of a saved crawl, without solving it again.
+
+    Every stop goes where it adds the least walking, then the path is repaired with local search. order and stops are
+    indices into durations, which covers both.
+    """
+    matrix = as_matrix(durations)
+    started = time.perf_counter()
+    order = list(order)
+    first = 1 if fixed_start and order else 0
+
+    for stop in stops:
+        if not order:
+            order = [stop]
+            continue
+        path = np.array(order)
+        positions = np.arange(first, len(path) + 1)
+        has_before = positions > 0
+        has_after = positions < len(path)
+        before = path[np.maximum(positions - 1, 0)]
+        after = path[np.minimum(positions, len(path) - 1)]
+        added = np.where(has_before, matrix[before, stop], 0) + np.where(has_after, matrix[stop, after], 0)
+        added -= np.where(has_before & has_after, matrix[before, after], 0)
+        position = int(positions[int(np.argmin(added))])
+        order.insert(position, stop)
+
+    if stops:
+        order = local_search(matrix, order, fixed_start)
+    greedy = nearest_neighbor(matrix, order[0])
+    return Solution(
+        order=[int(i) for i in order],
+        cost=path_cost(matrix, order),
+        solver="insertion",
+        solve_time_ms=(time.perf_counter() - started) * 1000,
+        greedy_cost=path_cost(matrix, greedy),
+    )
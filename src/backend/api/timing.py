@@ -0,0 +1,147 @@
+"""
+Per-request timing breakdown, sent back as a Server-Timing header and aggregated into api.metrics histograms.
+
+ServerTimingMiddleware starts a RequestTiming for every request and keeps it in a context variable, which asyncio
+tasks, sync_to_async and the thread pools of clients.submit carry along. While it is set:
+
+- every Google and ORS call adds to the "google" / "ors" phase and its call count, see clients.record
+- every database query adds to the "db" phase and its query count, see track_queries
+- views time their own phases with `with timing.phase("solve"):`
+
+Phases that run concurrently (e.g. the Google queries of one search) add up their durations, so a phase can be longer
+than the request. Outside a request, e.g. in the write-behind thread, all of these are no-ops.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics
+
+_current = contextvars.ContextVar("request_timing", default=None)
+
+
+class RequestTiming:
+    """Durations (seconds) and counts of the phases of one request"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.durations = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds, count=0):
+        with self._lock:
+            self.durations[name] = self.durations.get(name, 0) + seconds
+            if count:
+                self.counts[name] = self.counts.get(name, 0) + count
+
+    def header(self, total):
+        """Server-Timing header value, durations in milliseconds"""
+        entries = []
+        for name, seconds in self.durations.items():
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if name in self.counts:
+                entry += f';desc="{self.counts[name]} {"queries" if name == "db" else "calls"}"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+def current():
+    """The RequestTiming of the request being handled, or None"""
+    return _current.get()
+
+
+@contextmanager
+def phase(name):
+    """Time the enclosed block as a phase of the current request"""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        timing = _current.get()
+        if timing is not None:
+            timing.add(name, time.monotonic() - started)
+
+
+def upstream(provider, seconds):
+    """Count a Google or ORS call of the current request"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(provider, seconds, count=1)
+
+
+def track_queries(execute, sql, params, many, context):
+    """Database execute wrapper adding every query to the "db" phase of the current request"""
+    timing = _current.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started = time.monotonic()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.add("db", time.monotonic() - started, count=1)
+
+
+def install_query_tracking(connection, **kwargs):
+    if track_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(track_queries)
+
+
+def connect_signals():
+    """Track the queries of every database connection, called from ApiConfig.ready"""
+    connection_created.connect(install_query_tracking)
+    for connection in connections.all(initialized_only=True):
+        install_query_tracking(connection)
+
+
+class ServerTimingMiddleware:
+    """Time every request, add the Server-Timing header and record the request_* metrics, put it first in MIDDLEWARE"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = _current.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timing)
+
+    def finish(self, request, response, timing):
+        total = time.monotonic() - timing.started
+        response["Server-Timing"] = timing.header(total)
+
+        match = getattr(request, "resolver_match", None)
+        view = match.url_name if match and match.url_name else "unmatched"
+        metrics.request_latency.observe(total, view=view, status=str(response.status_code))
+        for name, seconds in timing.durations.items():
+            metrics.request_phase_latency.observe(seconds, view=view, phase=name)
+        metrics.request_db_queries.observe(timing.counts.get("db", 0), view=view)
+        metrics.request_upstream_calls.observe(timing.counts.get("google", 0) + timing.counts.get("ors", 0), view=view)
+        return response
@@ -1,13 +1,17 @@
+import asyncio
+import hmac
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from django.db import Error
 from django.http.response import HttpResponseBadRequest
 import googlemaps
-import requests
 import logging
 import time, json
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
 from django.conf import settings
-from knox.auth import TokenAuthentication
+from django.utils import timezone
 from knox.views import LoginView as KnoxLoginView
 from rest_framework import mixins
 from rest_framework.authentication import BasicAuthentication
@@ -18,11 +22,43 @@ from rest_framework.viewsets import GenericViewSet
 from rest_framework.views import APIView
 from decimal import Decimal
 
-from .serializers import RegisterSerializer, UserSerializer, LocationSerializer
-from .models import Location
+from . import (
+    clients,
+    http_cache,
+    metrics,
+    pagination,
+    query_planner,
+    renderers,
+    search_cache,
+    singleflight,
+    timing,
+    writeback,
+)
+from .auth import CachedTokenAuthentication
+from . import solver as crawl_solver
+from .geo import (
+    GEOHASH_PRECISION,
+    GEOMETRY_ENCODINGS,
+    encode_line,
+    geohash_encode,
+    hex_cover,
+    project_miles,
+    simplify,
+)
+from .matrix import cluster_matrices, crawl_matrix, estimate_matrix, extend_matrix, submatrix
+from .routes import compact_geometry, route_legs, stitch_legs
+from .renderers import ORJSONResponse
+from .serializers import RegisterSerializer, UserSerializer, location_data
+from .models import Crawl, Location
 
 logger = logging.getLogger(__name__)
 
+# Content types of the streaming search formats
+STREAM_CONTENT_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+# Google answers a nearby search in pages of at most this many places, and hands out at most PLACES_MAX_PAGES of them
+PLACES_PAGE_SIZE = 20
+PLACES_MAX_PAGES = 3
+
 
 class LoginView(KnoxLoginView):
     authentication_classes = [BasicAuthentication]
@@ -31,6 +67,17 @@ class LoginView(KnoxLoginView):
 def handle_api_error(func):
     """Decorator to handle API errors consistently"""
 
+    if asyncio.iscoroutinefunction(func):
+
+        async def async_wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f"API Error in {func.__name__}: {str(e)}")
+                return JsonResponse({"error": str(e)}, status=500)
+
+        return async_wrapper
+
     def wrapper(*args, **kwargs):
         try:
             return func(*args, **kwargs)
@@ -41,41 +88,235 @@ def handle_api_error(func):
     return wrapper
 
 
-class LocationSearchView(APIView):
-    authentication_classes = (TokenAuthentication,)
-    permission_classes = (IsAuthenticated,)
+class LocationSearchMixin:
+    """Parameter handling, filtering and storage shared by the sync and async search views"""
 
-    def __init__(self):
-        super().__init__()
-        self.gmaps = googlemaps.Client(key=settings.GOOGLE_MAPS_API_KEY)
+    # Set by the Google fan-out, False when it stopped early with enough venues, see enough_places
+    fanout_complete = True
 
-    def get_places_by_type(self, location, radius, place_type):
+    def search_params(self, request):
+        """The validated search parameters, or the response to send when they are missing or invalid"""
+        if not (request.GET.get("latitude") and request.GET.get("latitude")):
+            return JsonResponse(
+                {
+                    "message": "Please provide search parameters",
+                    "parameters": {
+                        "latitude": "float (required)",
+                        "longitude": "float (required)",
+                        "radius": "integer (optional, default: 10 miles)",
+                        "type": "string (optional, default: bar)",
+                        "source": "string (optional, default: google). 'local' only searches venues already known",
+                        "stream": "string (optional). 'ndjson' or 'sse' to stream venues as they are found",
+                        "sort": "string (optional). 'rating', 'distance' or 'popularity', default the search's order",
+                        "limit": f"integer (optional, at most {settings.SEARCH_MAX_LIMIT}). Venues per page",
+                        "cursor": "string (optional). next_cursor of the previous page",
+                    },
+                    "example": "/api/search/?address=Philadelphia&radius=5&type=bar",
+                }
+            )
+
+        # Get and process search parameters
+        latitude = request.GET.get("latitude")
+        longitude = request.GET.get("longitude")
+        radius_miles = int(request.GET.get("radius", 10))
+        search_type = request.GET.get("type", "bar")
+        source = request.GET.get("source", "google")
+        stream = request.GET.get("stream")
+
+        try:
+            lat, lng = float(latitude), float(longitude)
+        except (TypeError, ValueError):
+            return JsonResponse(
+                {"error": "Invalid coordinates. Latitude and longitude must be valid numbers."},
+                status=400,
+            )
+        if source not in ("google", "local"):
+            return JsonResponse({"error": "source must be either 'google' or 'local'"}, status=400)
+        if stream not in (None, *STREAM_CONTENT_TYPES):
+            return JsonResponse({"error": "stream must be either 'ndjson' or 'sse'"}, status=400)
+
+        sort = request.GET.get("sort")
+        limit = request.GET.get("limit")
+        cursor = request.GET.get("cursor")
+        if sort not in (None, *pagination.SORTS):
+            return JsonResponse({"error": f"sort must be one of {', '.join(pagination.SORTS)}"}, status=400)
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if not 1 <= limit <= settings.SEARCH_MAX_LIMIT:
+                return JsonResponse(
+                    {"error": f"limit must be an integer between 1 and {settings.SEARCH_MAX_LIMIT}"}, status=400
+                )
+        if cursor is not None:
+            try:
+                cursor = pagination.decode_cursor(cursor, sort)
+            except ValueError as e:
+                return JsonResponse({"error": str(e)}, status=400)
+        if stream and (sort or limit or cursor):
+            # Streamed venues are sent as they are found, before the rest are known
+            return JsonResponse({"error": "sort, limit and cursor cannot be combined with stream"}, status=400)
+
+        return {
+            "latitude": latitude,
+            "longitude": longitude,
+            "lat": lat,
+            "lng": lng,
+            "radius_miles": radius_miles,
+            "type": search_type,
+            "source": source,
+            "stream": stream,
+            "sort": sort,
+            "limit": limit,
+            "after": cursor,
+        }
+
+    def search_response(self, request, params, locations, cache_status, last_modified=None):
         """
-        Get places of a specific type with pagination handling
+        The search response, or a 304 when the client already has it.
+
+        Only the page of the venues asked for is sent, see api.pagination. last_modified is when Google was asked for
+        the venues, None for local searches. The ETag is weak, responses only differing in their cache status are the
+        same search.
         """
-        places = []
-        result = self.gmaps.places_nearby(location=location, radius=radius, type=place_type)
+        total_locations = len(locations)
+        keys = pagination.sort_keys(locations, params["sort"], params["lat"], params["lng"])
+        locations, last_key = pagination.page(locations, keys, params["limit"], params["after"])
+        data = {
+            "locations": location_data(locations),
+            **self.search_summary(params, total_locations, cache_status),
+            "next_cursor": pagination.encode_cursor(params["sort"], last_key) if last_key is not None else None,
+        }
+        etag = http_cache.etag(
+            data["search_params"], data["locations"], data["total_locations"], data["next_cursor"], weak=True
+        )
+        not_modified = http_cache.not_modified(request, etag, last_modified, settings.SEARCH_HTTP_MAX_AGE)
+        if not_modified is not None:
+            return not_modified
+        return http_cache.add_validators(ORJSONResponse(data), etag, last_modified, settings.SEARCH_HTTP_MAX_AGE)
+
+    def search_summary(self, params, total_locations, cache_status):
+        return {
+            "search_params": {
+                "longitude": params["longitude"],
+                "latitude": params["latitude"],
+                "radius_miles": params["radius_miles"],
+                "type": params["type"],
+                "source": params["source"],
+                "sort": params["sort"],
+                "limit": params["limit"],
+            },
+            "total_locations": total_locations,
+            "cache": cache_status,
+        }
 
-        if result.get("results"):
-            places.extend(result["results"])
+    def stream_response(self, params, records):
+        """
+        Stream the records of a search as NDJSON lines or Server-Sent Events.
 
-        while "next_page_token" in result:
-            time.sleep(2)  # Respect API rate limits
-            result = self.gmaps.places_nearby(
-                location=location, radius=radius, type=place_type, page_token=result["next_page_token"]
-            )
-            if result.get("results"):
-                places.extend(result["results"])
+        records is an iterator, or async iterator, of stream_record strings: a "location" record per venue as soon as
+        it is found, then one "summary" record, or an "error" record if the search failed part way.
+        """
+        response = StreamingHttpResponse(records, content_type=STREAM_CONTENT_TYPES[params["stream"]])
+        response["Cache-Control"] = "no-cache"
+        # Keep proxies such as nginx from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+    def stream_record(self, params, kind, data):
+        body = renderers.dumps({"type": kind, **data})
+        if params["stream"] == "sse":
+            return b"event: " + kind.encode() + b"\ndata: " + body + b"\n\n"
+        return body + b"\n"
+
+    def location_record(self, params, location):
+        return self.stream_record(params, "location", {"location": location_data([location])[0]})
+
+    def in_radius(self, params, location):
+        """Whether a venue found at the bucketed radius is within the radius that was asked for"""
+        return bool(search_cache.within_radius([location], params["lat"], params["lng"], params["radius_miles"]))
+
+    def search_terms(self, search_type):
+        """The (place types, keywords) Google is queried with for a search type"""
+        type_mappings = {
+            "bar": ["bar", "night_club"],
+            "night_club": ["night_club", "bar"],
+            "brewery": ["brewery"],
+            "pub": ["bar"],
+        }
 
-        return places
+        search_types = type_mappings.get(search_type, [search_type])
+        keywords = ["bar", "pub", "tavern", "brewery", "beer", "cocktail"]
+        return search_types, keywords
 
-    def get_places_by_keyword(self, location, radius, keyword):
+    def search_queries(self, location, radius_miles, search_type):
         """
-        Get places by keyword search
+        The (query, location, radius in meters, term) Google calls of a search at the bucketed radius.
+
+        Every type and keyword is searched once over the whole circle, see tile_queries for the type queries that come
+        back full. Keywords that rarely add venues in the area are left out, or searched last when the planner
+        explores them, see api.query_planner.
         """
-        results = self.gmaps.places(query=keyword, location=location, radius=radius).get("results", [])
+        radius = round(search_cache.radius_bucket(radius_miles) * 1609)
+        search_types, keywords = self.search_terms(search_type)
+        keywords, explored = query_planner.plan(*location, search_type, keywords)
+        queries = [(self.get_places_by_type, location, radius, term) for term in search_types]
+        queries += [(self.get_places_by_keyword, location, radius, term) for term in keywords + explored]
+        return queries
+
+    def tile_queries(self, location, radius_miles, query, places):
+        """
+        The queries to run once query of search_queries has found places, nearest first.
 
-        return [place for place in results if self.is_alcohol_venue(place)]
+        A nearby search returns at most 60 places, so when the one over a circle wider than SEARCH_TILE_RADIUS_MILES
+        is saturated, its type is searched again on a hexagonal cover of at most SEARCH_MAX_TILES smaller circles.
+        Text searches only use the location as a bias and are never tiled.
+        """
+        search, _, radius, term = query
+        bucket = search_cache.radius_bucket(radius_miles)
+        if search != self.get_places_by_type or radius != round(bucket * 1609) or not self.saturated(places):
+            return []
+        if bucket <= settings.SEARCH_TILE_RADIUS_MILES:
+            return []
+        cell_radius = settings.SEARCH_TILE_RADIUS_MILES
+        while len(centers := hex_cover(*location, bucket, cell_radius)) > settings.SEARCH_MAX_TILES:
+            cell_radius *= 1.25
+        centers[0] = location
+        return [(self.get_places_by_type, center, round(cell_radius * 1609), term) for center in centers]
+
+    def saturated(self, places):
+        """Whether a nearby search got to its last page, so Google may have left out places of its circle"""
+        return len(places) > PLACES_PAGE_SIZE * (PLACES_MAX_PAGES - 1)
+
+    def record_yields(self, location, search_type, queries, results):
+        """
+        Record how many new venues every keyword query added, see api.query_planner.
+
+        results holds the places of each of the queries, None for the ones that did not finish. A keyword's venues are
+        new when none of the finished type queries or the keywords before it found them.
+        """
+        seen_place_ids = set()
+        for (query, *_), places in zip(queries, results):
+            if places is not None and query == self.get_places_by_type:
+                self.filter_places(places, seen_place_ids)
+        yields = {
+            term: len(self.filter_places(places, seen_place_ids))
+            for (query, _, _, term), places in zip(queries, results)
+            if places is not None and query == self.get_places_by_keyword
+        }
+        query_planner.record(*location, search_type, yields)
+
+    def enough_places(self, places):
+        """Whether raw Google results hold SEARCH_TARGET_RESULTS venues rated SEARCH_TARGET_RATING or better"""
+        if not settings.SEARCH_TARGET_RESULTS:
+            return False
+        rated = {
+            place["place_id"]
+            for place in places
+            if (place.get("rating") or 0) >= settings.SEARCH_TARGET_RATING and self.is_alcohol_venue(place)
+        }
+        return len(rated) >= settings.SEARCH_TARGET_RESULTS
 
     def is_alcohol_venue(self, place):
         """Check if a place is likely to serve alcohol"""
@@ -98,11 +339,16 @@ class LocationSearchView(APIView):
 
         return any(term in place_name for term in alcohol_terms) or any(t in alcohol_types for t in place_types)
 
-    def filter_places(self, places):
-        """Filter out duplicates and unwanted business types"""
+    def filter_places(self, places, seen_place_ids=None):
+        """
+        Filter out duplicates and unwanted business types
+
+        Pass the same seen_place_ids set to filter pages of one search as they arrive.
+        """
         unwanted_types = {"beauty_salon", "hair_care", "barber", "grocery_store", "supermarket", "school", "store"}
 
-        seen_place_ids = set()
+        if seen_place_ids is None:
+            seen_place_ids = set()
         filtered_places = []
 
         for place in places:
@@ -115,50 +361,14 @@ class LocationSearchView(APIView):
 
         return filtered_places
 
-    def get(self, request):
-        if not (request.GET.get("latitude") and request.GET.get("latitude")):
-            return JsonResponse(
-                {
-                    "message": "Please provide search parameters",
-                    "parameters": {
-                        "latitude": "float (required)",
-                        "longitude": "float (required)",
-                        "radius": "integer (optional, default: 10 miles)",
-                        "type": "string (optional, default: bar)",
-                    },
-                    "example": "/api/search/?address=Philadelphia&radius=5&type=bar",
-                }
-            )
-
-        # Get and process search parameters
-        latitude = request.GET.get("latitude")
-        longitude = request.GET.get("longitude")
-        radius = int(request.GET.get("radius", 10)) * 1609  # Convert miles to meters
-        search_type = request.GET.get("type", "bar")
-
-        location = (latitude, longitude)
-
-        # Get places based on type and keywords
-        type_mappings = {
-            "bar": ["bar", "night_club"],
-            "night_club": ["night_club", "bar"],
-            "brewery": ["brewery"],
-            "pub": ["bar"],
-        }
+    def save_places(self, places):
+        """Filter the raw Google results, queue them to be upserted as Locations and return those"""
+        return self.save_locations(self.place_locations(places))
 
-        search_types = type_mappings.get(search_type, [search_type])
-        keywords = ["bar", "pub", "tavern", "brewery", "beer", "cocktail"]
-
-        # Collect all places
-        all_places = []
-        for place_type in search_types:
-            all_places.extend(self.get_places_by_type(location, radius, place_type))
-        for keyword in keywords:
-            all_places.extend(self.get_places_by_keyword(location, radius, keyword))
-
-        # Filter and format results
-        filtered_places = self.filter_places(all_places)
-        locations = [
+    def place_locations(self, places, seen_place_ids=None):
+        """Filter raw Google results and turn them into unsaved Locations"""
+        filtered_places = self.filter_places(places, seen_place_ids)
+        return [
             Location(
                 name=place["name"],
                 address=place.get("vicinity"),
@@ -167,36 +377,295 @@ class LocationSearchView(APIView):
                 rating=place.get("rating"),
                 user_ratings_total=place.get("user_ratings_total", 0),
                 place_id=place["place_id"],
+                geohash=geohash_encode(
+                    place["geometry"]["location"]["lat"], place["geometry"]["location"]["lng"], GEOHASH_PRECISION
+                ),
             )
             for place in filtered_places
         ]
 
-        fields_to_update = [field.name for field in Location._meta.fields]
-        fields_to_update.remove("place_id")
-        Location.objects.bulk_create(
-            locations, update_conflicts=True, unique_fields=["place_id"], update_fields=fields_to_update
+    def save_locations(self, locations):
+        """Hand the locations to the write-behind queue, see api.writeback"""
+        writeback.locations.save(locations)
+        return locations
+
+    def cache_search(self, params, locations):
+        """Record a fresh Google search in the tile cache and trim its results to the requested radius"""
+        return self.trim_search(params, self.store_search(params, locations))
+
+    def store_search(self, params, locations):
+        """Record a fresh Google search in the tile cache, returns the locations"""
+        search_cache.store(
+            params["lat"],
+            params["lng"],
+            params["radius_miles"],
+            params["type"],
+            [loc.place_id for loc in locations],
+            complete=self.fanout_complete,
         )
+        return locations
 
-        return JsonResponse(
-            {
-                "locations": LocationSerializer(locations, many=True).data,
-                "search_params": {
-                    "longitude": longitude,
-                    "latitude": latitude,
-                    "radius_miles": radius / 1609,
-                    "type": search_type,
-                },
-                "total_locations": len(locations),
-            }
-        )
+    def trim_search(self, params, locations):
+        """Google was asked for the whole radius bucket, trim back down to what was requested"""
+        lat, lng, radius_miles = params["lat"], params["lng"], params["radius_miles"]
+        if search_cache.radius_bucket(radius_miles) > radius_miles:
+            locations = search_cache.within_radius(locations, lat, lng, radius_miles)
+        return locations
+
+    def search_key(self, params):
+        """Searches with the same key that are in flight together share one Google fan-out, see api.singleflight"""
+        return search_cache.tile_key(params["lat"], params["lng"], params["radius_miles"], params["type"])
 
 
-class RouteView(APIView):
-    authentication_classes = (TokenAuthentication,)
+class LocationSearchView(LocationSearchMixin, APIView):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
-    @handle_api_error
+    def __init__(self):
+        super().__init__()
+        self.gmaps = clients.google_maps()
+
+    def get_places_by_type(self, location, radius, place_type, on_page=None):
+        """
+        Get places of a specific type with pagination handling
+
+        on_page is called with the results of every page as soon as it arrives.
+        """
+        places = []
+        result = self.gmaps.places_nearby(location=location, radius=radius, type=place_type)
+
+        if result.get("results"):
+            places.extend(result["results"])
+            if on_page:
+                on_page(result["results"])
+
+        while "next_page_token" in result:
+            result = self.get_next_page(location, radius, place_type, result["next_page_token"])
+            if result.get("results"):
+                places.extend(result["results"])
+                if on_page:
+                    on_page(result["results"])
+
+        return places
+
+    def get_next_page(self, location, radius, place_type, page_token):
+        """
+        Fetch the next page of a nearby search.
+
+        Google hands out page tokens slightly before they become valid and answers INVALID_REQUEST until then,
+        so retry with exponential backoff instead of always sleeping for the worst case.
+        """
+        delay = settings.PLACES_PAGE_TOKEN_DELAY
+        for attempt in range(settings.PLACES_PAGE_TOKEN_ATTEMPTS):
+            time.sleep(delay)
+            try:
+                return self.gmaps.places_nearby(
+                    location=location, radius=radius, type=place_type, page_token=page_token
+                )
+            except googlemaps.exceptions.ApiError as e:
+                if e.status != "INVALID_REQUEST" or attempt == settings.PLACES_PAGE_TOKEN_ATTEMPTS - 1:
+                    raise
+                delay *= 2
+
+    def get_places_by_keyword(self, location, radius, keyword, on_page=None):
+        """
+        Get places by keyword search
+        """
+        results = self.gmaps.places(query=keyword, location=location, radius=radius).get("results", [])
+
+        places = [place for place in results if self.is_alcohol_venue(place)]
+        if on_page:
+            on_page(places)
+        return places
+
     def get(self, request):
+        params = self.search_params(request)
+        if isinstance(params, HttpResponse):
+            return params
+        if params["stream"]:
+            return self.stream_response(params, self.stream_search(params))
+        lat, lng, radius_miles, search_type = params["lat"], params["lng"], params["radius_miles"], params["type"]
+
+        if params["source"] == "local":
+            # Venues are only stored once they have been found as bars, so the type filter does not apply here
+            with timing.phase("local"):
+                locations = Location.objects.within_radius(lat, lng, radius_miles)
+            cache_status, fetched_at = "bypass", None
+        else:
+            with timing.phase("cache"):
+                locations, fetched_at = search_cache.find(lat, lng, radius_miles, search_type)
+            cache_status = "hit"
+            if locations is None:
+                location = (params["latitude"], params["longitude"])
+                with timing.phase("places"):
+                    locations, shared = singleflight.searches.do(
+                        self.search_key(params),
+                        lambda: self.store_search(params, self.search_google(location, radius_miles, search_type)),
+                    )
+                locations = self.trim_search(params, locations)
+                cache_status, fetched_at = "coalesced" if shared else "miss", timezone.now()
+
+        return self.search_response(request, params, locations, cache_status, fetched_at)
+
+    def search_google(self, location, radius_miles, search_type):
+        """
+        Run the Google fan-out for a search at the bucketed radius, see search_queries, and upsert the results.
+
+        Saturated type queries are followed by their tiles, see tile_queries. The fan-out stops early once enough well
+        rated venues have been found, see enough_places. The venues of the queries that have finished by then are kept.
+        """
+        queries = self.search_queries(location, radius_miles, search_type)
+        executor = ThreadPoolExecutor(max_workers=settings.SEARCH_MAX_CONCURRENCY)
+        futures = [clients.submit(executor, *query) for query in queries]
+        results = []
+        all_places = []
+        try:
+            # Run every query concurrently, but take the results in query order so deduplication stays deterministic
+            while len(results) < len(futures):
+                places = futures[len(results)].result()
+                tiles = self.tile_queries(location, radius_miles, queries[len(results)], places)
+                queries += tiles
+                futures += [clients.submit(executor, *query) for query in tiles]
+                results.append(places)
+                all_places.extend(places)
+                if len(results) < len(futures) and self.enough_places(all_places):
+                    self.fanout_complete = False
+                    break
+        finally:
+            # Queries that have not started when stopping early are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        results += [None] * (len(futures) - len(results))
+        for index, future in enumerate(futures):
+            if results[index] is None and future.done() and not future.cancelled() and future.exception() is None:
+                results[index] = future.result()
+                all_places.extend(results[index])
+
+        self.record_yields(location, search_type, queries, results)
+        return self.save_places(all_places)
+
+    def stream_search(self, params):
+        """Yield the stream records of a search, see stream_response"""
+        lat, lng, radius_miles, search_type = params["lat"], params["lng"], params["radius_miles"], params["type"]
+        try:
+            if params["source"] == "local":
+                locations, cache_status = Location.objects.within_radius(lat, lng, radius_miles), "bypass"
+            else:
+                locations, cache_status = search_cache.lookup(lat, lng, radius_miles, search_type), "hit"
+
+            if locations is None:
+                cache_status = "miss"
+                locations = []
+                for location in self.stream_google(
+                    (params["latitude"], params["longitude"]), radius_miles, search_type
+                ):
+                    locations.append(location)
+                    if self.in_radius(params, location):
+                        yield self.location_record(params, location)
+                # Queued before the summary, so the venues can be used in a crawl as soon as the stream ends
+                locations = self.cache_search(params, self.save_locations(locations))
+            else:
+                for location in locations:
+                    yield self.location_record(params, location)
+
+            yield self.stream_record(params, "summary", self.search_summary(params, len(locations), cache_status))
+        except Exception as e:
+            logger.error(f"API Error in stream_search: {str(e)}")
+            yield self.stream_record(params, "error", {"error": str(e)})
+
+    def stream_google(self, location, radius_miles, search_type):
+        """
+        Run the Google fan-out of search_google, yielding the new unsaved Locations of every page as it arrives.
+
+        Pages come in whatever order the queries answer, so the duplicate kept for a place can differ from
+        search_google, which deduplicates in query order.
+        """
+        # (index of the query, page), or (index, None) once the query is done
+        pages = queue.Queue()
+
+        def run(index, query, center, radius, term):
+            try:
+                query(center, radius, term, on_page=lambda page: pages.put((index, page)))
+            except Exception as e:
+                pages.put(e)
+            finally:
+                pages.put((index, None))
+
+        queries = self.search_queries(location, radius_miles, search_type)
+        executor = ThreadPoolExecutor(max_workers=settings.SEARCH_MAX_CONCURRENCY)
+        for index, query in enumerate(queries):
+            clients.submit(executor, run, index, *query)
+
+        seen_place_ids = set()
+        found = []
+        # Places of every query, kept for the ones that finish
+        results = [[] for _ in queries]
+        finished = set()
+        try:
+            while len(finished) < len(queries):
+                if self.enough_places(found):
+                    self.fanout_complete = False
+                    break
+                page = pages.get()
+                if isinstance(page, Exception):
+                    raise page
+                index, page = page
+                if page is None:
+                    finished.add(index)
+                    for tile in self.tile_queries(location, radius_miles, queries[index], results[index]):
+                        queries.append(tile)
+                        results.append([])
+                        clients.submit(executor, run, len(queries) - 1, *tile)
+                else:
+                    results[index].extend(page)
+                    found.extend(page)
+                    yield from self.place_locations(page, seen_place_ids)
+        finally:
+            # The client may have gone away, do not wait for queries nobody will read
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        # Pages that arrived before stopping early are kept
+        while not pages.empty():
+            page = pages.get_nowait()
+            if isinstance(page, Exception):
+                continue
+            index, page = page
+            if page is None:
+                finished.add(index)
+            else:
+                results[index].extend(page)
+                yield from self.place_locations(page, seen_place_ids)
+
+        results = [places if index in finished else None for index, places in enumerate(results)]
+        self.record_yields(location, search_type, queries, results)
+
+
+def geometry_params(request):
+    """
+    The geometry, precision and tolerance query params of the route and crawl views.
+
+    Raises ValueError with a message for the client when one is invalid.
+    """
+    encoding = request.GET.get("geometry", "geojson")
+    if encoding not in GEOMETRY_ENCODINGS:
+        raise ValueError(f"geometry must be one of {', '.join(GEOMETRY_ENCODINGS)}")
+    try:
+        precision = int(request.GET.get("precision", 5))
+        tolerance = float(request.GET.get("tolerance", 0))
+    except ValueError:
+        raise ValueError("precision must be an integer and tolerance a number of meters")
+    if not 1 <= precision <= 7:
+        raise ValueError("precision must be between 1 and 7")
+    if not 0 <= tolerance <= 1000:
+        raise ValueError("tolerance must be between 0 and 1000 meters")
+    return {"encoding": encoding, "precision": precision, "tolerance": tolerance}
+
+
+class RouteMixin:
+    """Parameter handling and response formatting shared by the sync and async route views"""
+
+    def route_params(self, request):
+        """The ((start_lat, start_lng), (end_lat, end_lng)) points, or the response to send when they are invalid"""
         # Validate required parameters
         required_params = ["start_lat", "start_lng", "end_lat", "end_lng"]
         missing_params = [param for param in required_params if not request.GET.get(param)]
@@ -231,52 +700,53 @@ class RouteView(APIView):
                 },
                 status=400,
             )
-        start_name = request.GET.get("start_name", "Start")
-        end_name = request.GET.get("end_name", "End")
-
-        url = "https://api.openrouteservice.org/v2/directions/foot-walking"
-        headers = {"Authorization": settings.ORS_API_KEY, "Content-Type": "application/json; charset=utf-8"}
-        params = {
-            "start": f"{start_lng},{start_lat}",
-            "end": f"{end_lng},{end_lat}",
-            "instructions": "true",
-            "units": "mi",
+        try:
+            geometry_params(request)
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+        return (start_lat, start_lng), (end_lat, end_lng)
+
+    def route_response(self, request, leg):
+        """The route response, or a 304 when the client already has it"""
+        start = {
+            "name": request.GET.get("start_name", "Start"),
+            "lat": float(request.GET["start_lat"]),
+            "lng": float(request.GET["start_lng"]),
         }
-
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        route_data = response.json()
-
-        # Extract route details
-        route_summary = route_data["features"][0]["properties"]["segments"][0]
-        duration_minutes = route_summary["duration"] / 60
-        distance_miles = route_summary["distance"] / 1609.34
-
-        steps = []
-        if "steps" in route_summary:
-            for step in route_summary["steps"]:
-                steps.append(
-                    {
-                        "instruction": step.get("instruction", ""),
-                        "distance": f"{step['distance'] / 1609.34:.1f} miles",
-                        "duration": f"{step['duration'] / 60:.1f} minutes",
-                    }
-                )
+        end = {
+            "name": request.GET.get("end_name", "End"),
+            "lat": float(request.GET["end_lat"]),
+            "lng": float(request.GET["end_lng"]),
+        }
+        geometry = geometry_params(request)
+        # The leg is hashed as stored, so directions fetched again with changes make a new ETag
+        etag = http_cache.etag(start, end, geometry, leg)
+        not_modified = http_cache.not_modified(request, etag, max_age=settings.ROUTE_HTTP_MAX_AGE)
+        if not_modified is not None:
+            return not_modified
+
+        route_summary = {**leg["summary"], "steps": leg["steps"]}
+        coordinates = leg["coordinates"]
+        kept = simplify(coordinates, geometry["tolerance"])
+        if len(kept) < len(coordinates):
+            coordinates = [coordinates[i] for i in kept]
+        if geometry["encoding"] == "geojson":
+            line = {"coordinates": [[coord[1], coord[0]] for coord in coordinates]}
+        else:
+            line = {
+                "geometry": {
+                    "encoding": geometry["encoding"],
+                    "precision": geometry["precision"],
+                    "coordinates": encode_line(coordinates, geometry["encoding"], geometry["precision"]),
+                }
+            }
 
         # Format route response
-        return JsonResponse(
+        response = ORJSONResponse(
             {
                 "route": {
-                    "start": {
-                        "name": request.GET.get("start_name", "Start"),
-                        "lat": float(request.GET["start_lat"]),
-                        "lng": float(request.GET["start_lng"]),
-                    },
-                    "end": {
-                        "name": request.GET.get("end_name", "End"),
-                        "lat": float(request.GET["end_lat"]),
-                        "lng": float(request.GET["end_lng"]),
-                    },
+                    "start": start,
+                    "end": end,
                     "summary": {
                         "distance": f"{route_summary['distance'] / 1609.34:.1f} miles",
                         "duration": f"{route_summary['duration'] / 60:.1f} minutes",
@@ -289,82 +759,375 @@ class RouteView(APIView):
                         }
                         for step in route_summary.get("steps", [])
                     ],
-                    "coordinates": [
-                        [coord[1], coord[0]] for coord in route_data["features"][0]["geometry"]["coordinates"]
-                    ],
+                    **line,
                 }
             }
         )
+        return http_cache.add_validators(response, etag, max_age=settings.ROUTE_HTTP_MAX_AGE)
 
 
-class OptimizedCrawlView(APIView):
-    authentication_classes = (TokenAuthentication,)
+class RouteView(RouteMixin, APIView):
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
-    def find_optimal_route(self, durations):
-        """Find optimal route using nearest neighbor algorithm"""
-        n = len(durations)
-        unvisited = set(range(1, n))
-        current = 0  # Starting point
-        route = [current]
+    @handle_api_error
+    def get(self, request):
+        points = self.route_params(request)
+        if isinstance(points, HttpResponse):
+            return points
 
-        while unvisited:
-            # Find the nearest unvisited location
-            next_location = min(unvisited, key=lambda x: durations[current][x])
-            route.append(next_location)
-            unvisited.remove(next_location)
-            current = next_location
+        # Served from the shared leg cache, ORS is only asked when this leg has not been walked before
+        with timing.phase("legs"):
+            leg = route_legs(list(points))[0]
+        return self.route_response(request, leg)
 
-        return route
 
-    def get(self, request):
+class OptimizedCrawlMixin:
+    """Parameter handling and response formatting shared by the sync and async crawl views"""
 
+    def crawl_params(self, request):
+        """The validated crawl parameters, or the response to send when they are invalid"""
         location_ids = request.GET.getlist("location")
         if len(location_ids) == 0:
             return HttpResponseBadRequest(
                 "Pass locations as multiple 'location' query params.\nExample: /api/optimize-crawl/?location=ChIJKQ4bL1w-xIkRYJYkqbIBQHs&location=ChIJx500k1w-xIkR5KvpUFbeIpg&location=ChIJI8mjjUM-xIkRadn_q5C1hTQ"
             )
-        locations = list(Location.objects.filter(place_id__in=location_ids))
+
+        start_id = request.GET.get("start")
+        if start_id is not None and start_id not in location_ids:
+            return HttpResponseBadRequest("The start location must be one of the passed locations")
+        solver = request.GET.get("solver", "auto")
+        if solver not in ("auto", "held_karp", "local_search", "greedy", "clustered"):
+            return HttpResponseBadRequest("solver must be one of auto, held_karp, local_search, greedy or clustered")
+        matrix_mode = request.GET.get("matrix", "auto")
+        if matrix_mode not in ("auto", "ors", "estimate"):
+            return HttpResponseBadRequest("matrix must be one of auto, ors or estimate")
+        try:
+            geometry = geometry_params(request)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        budget_ms = request.GET.get("budget_ms")
+        if budget_ms is not None:
+            try:
+                budget_ms = float(budget_ms)
+            except ValueError:
+                return HttpResponseBadRequest("budget_ms must be a number of milliseconds")
+            if not 0 < budget_ms <= settings.CRAWL_MAX_BUDGET_MS:
+                return HttpResponseBadRequest(f"budget_ms must be between 0 and {settings.CRAWL_MAX_BUDGET_MS}")
+            if solver not in ("auto", "local_search", "clustered"):
+                return HttpResponseBadRequest("budget_ms only applies to the auto, local_search and clustered solvers")
+
+        return {
+            "location_ids": location_ids,
+            "start": location_ids.index(start_id) if start_id is not None else None,
+            "solver": solver,
+            "matrix": matrix_mode,
+            "geometry": geometry,
+            "budget_ms": budget_ms,
+        }
+
+    def crawl_locations(self, locations, location_ids):
+        """The stops in the order the client sent them, or the response to send when some were not found"""
         if len(locations) != len(location_ids):
             return HttpResponseBadRequest(
                 "Not all location ids were found. Make sure all of the location ids are valid and have been searched before"
             )
+        # Keep the order the client sent the stops in, so the greedy baseline does not depend on the DB
+        locations.sort(key=lambda location: location_ids.index(location.place_id))
+        return locations
 
-        coordinates = [[float(str(loc.longitude)), float(str(loc.latitude))] for loc in locations]
+    def crawl_key(self, params):
+        """
+        Crawls with the same key that are in flight together share one matrix, solve and directions run, see
+        api.singleflight. The order the stops were passed in does not matter, only the stop set and the options do.
+        """
+        start_id = params["location_ids"][params["start"]] if params["start"] is not None else None
+        stops = tuple(sorted(set(params["location_ids"])))
+        return stops, start_id, params["solver"], params["matrix"], params["budget_ms"]
+
+    def find_optimal_route(self, durations, start=None, solver="auto", budget_ms=None):
+        """
+        Find the optimal order of the stops, see api.solver for the available solvers. With budget_ms the greedy order
+        is improved for about that long instead, see api.solver.anytime.
+        """
+        return crawl_solver.solve(durations, start=start, solver=solver, budget_ms=budget_ms)
+
+    def clustered(self, params, locations):
+        """
+        Whether a crawl is ordered cluster by cluster, see api.solver.solve_clustered. "auto" does so for crawls too
+        large for one ORS matrix request.
+        """
+        if params["solver"] == "auto":
+            return len(locations) > settings.CRAWL_CLUSTER_THRESHOLD
+        return params["solver"] == "clustered"
+
+    def crawl_clusters(self, locations):
+        """Stop indices of every cluster of nearby stops of a crawl"""
+        points = project_miles(
+            [location.latitude for location in locations], [location.longitude for location in locations]
+        )
+        return crawl_solver.cluster(points, settings.CRAWL_CLUSTER_SIZE)
 
-        # Call ORS Matrix API for optimization
-        url = "https://api.openrouteservice.org/v2/matrix/foot-walking"
-        headers = {"Authorization": settings.ORS_API_KEY, "Content-Type": "application/json"}
-        body = {"locations": coordinates, "metrics": ["duration", "distance"], "resolve_locations": True, "units": "mi"}
+    def find_clustered_route(self, locations, clusters, cluster_durations, start=None, budget_ms=None):
+        """Order a large crawl from the walking matrices within its clusters, see api.solver.solve_clustered"""
+        estimated, _ = estimate_matrix(locations)
+        return crawl_solver.solve_clustered(estimated, clusters, cluster_durations, start=start, budget_ms=budget_ms)
+
+    def plan(self, params, locations):
+        """
+        Measure, order and route a crawl.
 
-        matrix_response = requests.post(url, json=body, headers=headers)
-        matrix_response.raise_for_status()
-        matrix_data = matrix_response.json()
+        Returns the ordered locations, their legs, the solution, the matrix source and the (durations, distances)
+        matrices between the locations as passed in, or None for a clustered crawl, which has no full matrix.
+        """
+        if self.clustered(params, locations):
+            # Walking times within every cluster of nearby stops, the clusters' ORS requests go out concurrently
+            clusters = self.crawl_clusters(locations)
+            with timing.phase("matrix"):
+                durations, matrix_source = cluster_matrices(
+                    [[locations[i] for i in members] for members in clusters], params["matrix"]
+                )
+            with timing.phase("solve"):
+                solution = self.find_clustered_route(
+                    locations, clusters, durations, start=params["start"], budget_ms=params["budget_ms"]
+                )
+            matrices = None
+        else:
+            # Walking times between every pair of stops, only pairs we have not measured before go to ORS
+            with timing.phase("matrix"):
+                durations, distances, matrix_source = crawl_matrix(locations, params["matrix"])
+
+            # Find optimal route order
+            with timing.phase("solve"):
+                solution = self.find_optimal_route(
+                    durations, start=params["start"], solver=params["solver"], budget_ms=params["budget_ms"]
+                )
+            matrices = durations, distances
+        ordered_locations = [locations[i] for i in solution.order]
 
-        # Find optimal route order
-        optimal_route = self.find_optimal_route(matrix_data["durations"])
-        ordered_locations = [locations[i] for i in optimal_route]
+        # Stitch the route together from cached legs, ORS is only asked for the legs we have not seen before
+        with timing.phase("legs"):
+            legs = route_legs([(location.latitude, location.longitude) for location in ordered_locations])
+        return ordered_locations, legs, solution, matrix_source, matrices
 
-        url = "https://api.openrouteservice.org/v2/directions/foot-walking/geojson"
-        headers = {"Authorization": settings.ORS_API_KEY, "Content-Type": "application/json; charset=utf-8"}
+    def crawl_data(self, ordered_locations, geo_json, solution=None, matrix_source=None):
         data = {
-            "coordinates": [[str(location.longitude), str(location.latitude)] for location in ordered_locations],
-            "preference": "shortest",
-            "instructions": "true",
-            "units": "mi",
+            "total_distance_miles": geo_json["features"][0]["properties"]["summary"]["distance"],
+            "total_time_seconds": geo_json["features"][0]["properties"]["summary"]["duration"],
+            "ordered_locations": location_data(ordered_locations),
+            "geo_json": geo_json,
         }
+        if solution is not None:
+            data["solver"] = {
+                "name": solution.solver,
+                "solve_time_ms": solution.solve_time_ms,
+                "duration_seconds": solution.cost,
+                "greedy_duration_seconds": solution.greedy_cost,
+                "improvement_percent": solution.improvement_percent,
+                "matrix": matrix_source,
+                "clusters": solution.clusters,
+                "iterations": solution.iterations,
+            }
+        return data
 
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        geo_json = response.json()
+    def crawl_response(self, ordered_locations, geo_json, solution, matrix_source):
+        return ORJSONResponse(self.crawl_data(ordered_locations, geo_json, solution, matrix_source))
 
-        return JsonResponse(
-            {
-                "total_distance_miles": geo_json["features"][0]["properties"]["summary"]["distance"],
-                "total_time_seconds": geo_json["features"][0]["properties"]["summary"]["duration"],
-                "ordered_locations": LocationSerializer(ordered_locations, many=True).data,
-                "geo_json": geo_json,
-            }
+
+class OptimizedCrawlView(OptimizedCrawlMixin, APIView):
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        params = self.crawl_params(request)
+        if isinstance(params, HttpResponse):
+            return params
+        # Venues from a search a moment ago may still be waiting in the write-behind queue
+        writeback.locations.flush_pending(params["location_ids"])
+        locations = list(Location.objects.filter(place_id__in=params["location_ids"]))
+        locations = self.crawl_locations(locations, params["location_ids"])
+        if isinstance(locations, HttpResponse):
+            return locations
+
+        (ordered_locations, legs, solution, matrix_source, _), _ = singleflight.crawls.do(
+            self.crawl_key(params), lambda: self.plan(params, locations)
+        )
+        geo_json = compact_geometry(stitch_legs(legs), **params["geometry"])
+
+        return self.crawl_response(ordered_locations, geo_json, solution, matrix_source)
+
+
+class CrawlsView(OptimizedCrawlMixin, APIView):
+    """Save a crawl, optimized like OptimizedCrawlView, so it can be changed a stop at a time with CrawlView"""
+
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        """The user's saved crawls, most recently changed first, without their routes"""
+        crawls = request.user.crawls.order_by("-updated_at").values(
+            "id", "place_ids", "total_distance_miles", "total_time_seconds", "updated_at"
+        )
+        return ORJSONResponse(list(crawls))
+
+    def post(self, request):
+        params = self.crawl_params(request)
+        if isinstance(params, HttpResponse):
+            return params
+        writeback.locations.flush_pending(params["location_ids"])
+        locations = list(Location.objects.filter(place_id__in=params["location_ids"]))
+        locations = self.crawl_locations(locations, params["location_ids"])
+        if isinstance(locations, HttpResponse):
+            return locations
+        if self.clustered(params, locations):
+            return HttpResponseBadRequest(
+                f"Saved crawls can have at most {settings.CRAWL_CLUSTER_THRESHOLD} stops and cannot be clustered"
+            )
+
+        ordered_locations, legs, solution, matrix_source, (durations, distances) = self.plan(params, locations)
+        crawl = Crawl(
+            user=request.user,
+            place_ids=[location.place_id for location in ordered_locations],
+            fixed_start=params["start"] is not None,
+            matrix=params["matrix"],
+            matrix_source=matrix_source,
+            durations=submatrix(durations, solution.order),
+            distances=submatrix(distances, solution.order),
+        )
+        crawl.set_route(stitch_legs(legs))
+        crawl.save()
+        # The route is stored as stitched, compacting it in place afterwards does not change the saved crawl
+        geo_json = compact_geometry(crawl.geo_json, **params["geometry"])
+        return ORJSONResponse(
+            {"id": crawl.id, **self.crawl_data(ordered_locations, geo_json, solution, matrix_source)}, status=201
+        )
+
+
+class CrawlView(OptimizedCrawlMixin, APIView):
+    """
+    A saved crawl of the user's.
+
+    GET serves the stored route, so reopening a crawl needs no ORS calls, and answers a matching If-None-Match with
+    304 Not Modified.
+
+    PATCH adds and removes stops without optimizing the crawl from scratch. Added stops go where they add the least
+    walking and the order is repaired with local search, removed stops are spliced out. Only the walking times to and
+    from the added stops are measured and only the legs that changed are fetched from ORS.
+    """
+
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_crawl(self, request, pk):
+        crawl = Crawl.objects.filter(pk=pk, user=request.user).first()
+        if crawl is None:
+            return JsonResponse({"error": "Crawl not found"}, status=404)
+        return crawl
+
+    def get(self, request, pk):
+        crawl = self.get_crawl(request, pk)
+        if isinstance(crawl, HttpResponse):
+            return crawl
+        try:
+            geometry = geometry_params(request)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        locations = self.crawl_locations(list(Location.objects.filter(place_id__in=crawl.place_ids)), crawl.place_ids)
+        if isinstance(locations, HttpResponse):
+            return locations
+
+        # The venue details come from the locations, the rest from the stored route
+        etag = http_cache.etag(crawl.etag, geometry, location_data(locations))
+        not_modified = http_cache.not_modified(request, etag)
+        if not_modified is not None:
+            return not_modified
+        geo_json = compact_geometry(crawl.geo_json, **geometry)
+        return http_cache.add_validators(ORJSONResponse({"id": crawl.id, **self.crawl_data(locations, geo_json)}), etag)
+
+    def patch(self, request, pk):
+        crawl = self.get_crawl(request, pk)
+        if isinstance(crawl, HttpResponse):
+            return crawl
+        try:
+            geometry = geometry_params(request)
+        except ValueError as e:
+            return HttpResponseBadRequest(str(e))
+        add = list(dict.fromkeys(request.GET.getlist("add")))
+        remove = set(request.GET.getlist("remove"))
+        if not add and not remove:
+            return HttpResponseBadRequest("Pass the stops to change as 'add' and/or 'remove' query params")
+        if set(add) & set(crawl.place_ids):
+            return HttpResponseBadRequest("Stops to add must not be in the crawl already")
+        if remove - set(crawl.place_ids):
+            return HttpResponseBadRequest("Stops to remove must be in the crawl")
+        kept = [i for i, place_id in enumerate(crawl.place_ids) if place_id not in remove]
+        if not kept and not add:
+            return HttpResponseBadRequest("A crawl needs at least one stop")
+        if len(kept) + len(add) > settings.CRAWL_CLUSTER_THRESHOLD:
+            return HttpResponseBadRequest(f"Saved crawls can have at most {settings.CRAWL_CLUSTER_THRESHOLD} stops")
+
+        writeback.locations.flush_pending(add)
+        location_ids = [crawl.place_ids[i] for i in kept] + add
+        locations = self.crawl_locations(list(Location.objects.filter(place_id__in=location_ids)), location_ids)
+        if isinstance(locations, HttpResponse):
+            return locations
+
+        # The walking times between the stops that stay are kept, only those of the added stops are looked up
+        durations, distances = submatrix(crawl.durations, kept), submatrix(crawl.distances, kept)
+        matrix_source = crawl.matrix_source
+        if add:
+            with timing.phase("matrix"):
+                if crawl.matrix_source == "ors":
+                    durations, distances, matrix_source = extend_matrix(locations, durations, distances, crawl.matrix)
+                else:
+                    # Estimated walking times are not worth keeping, they are recomputed or measured now
+                    durations, distances, matrix_source = crawl_matrix(locations, crawl.matrix)
+
+        with timing.phase("solve"):
+            solution = crawl_solver.insert_stops(
+                durations, range(len(kept)), range(len(kept), len(locations)), fixed_start=crawl.fixed_start
+            )
+        ordered_locations = [locations[i] for i in solution.order]
+
+        with timing.phase("legs"):
+            legs = route_legs([(location.latitude, location.longitude) for location in ordered_locations])
+
+        crawl.place_ids = [location.place_id for location in ordered_locations]
+        crawl.matrix_source = matrix_source
+        crawl.durations = submatrix(durations, solution.order)
+        crawl.distances = submatrix(distances, solution.order)
+        crawl.set_route(stitch_legs(legs))
+        crawl.save()
+
+        geo_json = compact_geometry(crawl.geo_json, **geometry)
+        return ORJSONResponse({"id": crawl.id, **self.crawl_data(ordered_locations, geo_json, solution, matrix_source)})
+
+    def delete(self, request, pk):
+        crawl = self.get_crawl(request, pk)
+        if isinstance(crawl, HttpResponse):
+            return crawl
+        crawl.delete()
+        return HttpResponse(status=204)
+
+
+class MetricsView(View):
+    """
+    The process's metrics in the Prometheus text format, see api.metrics.
+
+    Scrapers send METRICS_TOKEN as a bearer token. Staff users logged in to the admin can read them too, and everyone
+    can when METRICS_PUBLIC is set.
+    """
+
+    def get(self, request):
+        if not (settings.METRICS_PUBLIC or request.user.is_staff or self.has_token(request)):
+            response = HttpResponse("Unauthorized", status=401, content_type="text/plain")
+            response["WWW-Authenticate"] = "Bearer"
+            return response
+        return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    def has_token(self, request):
+        return bool(settings.METRICS_TOKEN) and hmac.compare_digest(
+            request.headers.get("Authorization", "").encode(), f"Bearer {settings.METRICS_TOKEN}".encode()
         )
 
 
@@ -381,7 +1144,7 @@ class UserViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.Des
     @action(
         methods=["get"],
         detail=False,
-        authentication_classes=[TokenAuthentication],
+        authentication_classes=[CachedTokenAuthentication],
         permission_classes=[IsAuthenticated],
         url_path="user",
     )
@@ -391,7 +1154,7 @@ class UserViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.Des
     @action(
         methods=["delete"],
         detail=False,
-        authentication_classes=[TokenAuthentication],
+        authentication_classes=[CachedTokenAuthentication],
         permission_classes=[IsAuthenticated],
         url_path="user",
     )
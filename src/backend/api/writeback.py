@@ -0,0 +1,157 @@
+"""
+Write-behind queue for the Location upserts made by searches.
+
+Searches hand their venues to the module level locations writer instead of upserting them before responding.
+Pending venues are merged by place_id across requests, so a venue found by several concurrent searches of one area is
+written once with its latest data. A background thread flushes the queue every LOCATION_FLUSH_INTERVAL seconds, or
+as soon as LOCATION_FLUSH_SIZE venues are waiting, and a flush only writes the rows that are new or have changed.
+
+Readers that need a venue right after it was found go through pending() or flush_pending(), see search_cache._load
+and the crawl views. Both only see the queue of their own process, so LOCATION_WRITE_BEHIND is off by default and only
+meant for deployments that run a single worker process.
+"""
+
+import atexit
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import close_old_connections, models
+
+from . import metrics
+from .models import Location
+
+logger = logging.getLogger(__name__)
+
+# Every column is rewritten on upsert except the primary key
+UPDATE_FIELDS = [field.name for field in Location._meta.fields if not field.primary_key]
+
+
+def comparable(field, value):
+    """A field value as it reads back from the database, Google's float coordinates and ratings are rounded"""
+    if value is None or not isinstance(field, models.DecimalField):
+        return value
+    return Decimal(str(value)).quantize(Decimal(1).scaleb(-field.decimal_places))
+
+
+def changed_locations(locations):
+    """The locations that are not stored yet, or differ from their stored row"""
+    fields = [Location._meta.get_field(name) for name in UPDATE_FIELDS]
+    stored = {
+        row["place_id"]: row
+        for row in Location.objects.filter(place_id__in=[location.place_id for location in locations]).values(
+            "place_id", *UPDATE_FIELDS
+        )
+    }
+    return [
+        location
+        for location in locations
+        if location.place_id not in stored
+        or any(
+            comparable(field, getattr(location, field.name)) != comparable(field, stored[location.place_id][field.name])
+            for field in fields
+        )
+    ]
+
+
+class LocationWriter:
+    """Batches Location upserts, use the module level locations instance"""
+
+    def __init__(self):
+        self._pending = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        # Held for a whole flush, so flushes never overlap and flush() returns only once earlier writes are committed
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def save(self, locations):
+        """Queue locations to be upserted, or upsert the changed ones right away when LOCATION_WRITE_BEHIND is off"""
+        if not settings.LOCATION_WRITE_BEHIND:
+            self.write(locations)
+            return
+
+        with self._lock:
+            for location in locations:
+                self._pending[location.place_id] = location
+            depth = len(self._pending)
+        metrics.location_writes_pending.set(depth)
+
+        if depth >= settings.LOCATION_FLUSH_SIZE:
+            if self._start():
+                self._wake.set()
+            else:
+                self.flush()
+        else:
+            self._start()
+
+    def pending(self, place_ids):
+        """{place_id: Location} of the given venues that are queued or being written but may not be stored yet"""
+        with self._lock:
+            found = {**self._in_flight, **self._pending}
+        return {place_id: found[place_id] for place_id in place_ids if place_id in found}
+
+    def flush_pending(self, place_ids):
+        """Make sure the given venues are stored, flushing the queue if any of them are still waiting"""
+        if self.pending(place_ids):
+            self.flush()
+
+    def flush(self):
+        """Write every queued venue now"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._in_flight = batch
+            metrics.location_writes_pending.set(0)
+            try:
+                if batch:
+                    self.write(list(batch.values()))
+            except Exception:
+                # Put the batch back for the next flush, behind anything queued since
+                with self._lock:
+                    self._pending = {**batch, **self._pending}
+                    depth = len(self._pending)
+                metrics.location_writes_pending.set(depth)
+                raise
+            finally:
+                with self._lock:
+                    self._in_flight = {}
+
+    def write(self, locations):
+        """Upsert the locations that changed"""
+        started = time.monotonic()
+        changed = changed_locations(locations)
+        Location.objects.bulk_create(
+            changed, update_conflicts=True, unique_fields=["place_id"], update_fields=UPDATE_FIELDS
+        )
+        metrics.location_writes.inc(len(changed), outcome="written")
+        metrics.location_writes.inc(len(locations) - len(changed), outcome="unchanged")
+        metrics.location_flush_latency.observe(time.monotonic() - started)
+        logger.debug(f"Wrote {len(changed)} of {len(locations)} queued locations")
+
+    def _start(self):
+        """Start the background flusher unless LOCATION_FLUSH_INTERVAL is 0, returns whether it is running"""
+        if settings.LOCATION_FLUSH_INTERVAL <= 0:
+            return False
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="location-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.LOCATION_FLUSH_INTERVAL)
+            self._wake.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Flushing queued locations failed, retrying on the next flush: {e}")
+
+
+locations = LocationWriter()
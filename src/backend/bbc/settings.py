@@ -19,6 +19,87 @@ load_dotenv()
 # Get the API key from environment variables
 ORS_API_KEY = os.getenv("ORS_API_KEY")
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+GOOGLE_MAPS_BASE_URL = os.getenv("GOOGLE_MAPS_BASE_URL", "https://maps.googleapis.com")
+ORS_BASE_URL = os.getenv("ORS_BASE_URL", "https://api.openrouteservice.org")
+
+# Outbound HTTP: connections kept alive per upstream host, per-call deadlines (seconds) and retries
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", 20))
+GOOGLE_TIMEOUT = float(os.getenv("GOOGLE_TIMEOUT", 10))
+GOOGLE_RETRY_TIMEOUT = float(os.getenv("GOOGLE_RETRY_TIMEOUT", 15))
+ORS_TIMEOUT = float(os.getenv("ORS_TIMEOUT", 15))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 2))
+UPSTREAM_RETRY_BACKOFF = float(os.getenv("UPSTREAM_RETRY_BACKOFF", 0.25))
+# Consecutive failures before calls to an upstream are cut off, and seconds before it is tried again
+CIRCUIT_BREAKER_FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", 5))
+CIRCUIT_BREAKER_RESET = float(os.getenv("CIRCUIT_BREAKER_RESET", 30))
+
+# Maximum number of Google Places queries a single search request runs at once
+SEARCH_MAX_CONCURRENCY = int(os.getenv("SEARCH_MAX_CONCURRENCY", 4))
+# A nearby search returns 60 places at most, so when one over a circle wider than this many miles comes back full, its
+# type is searched again on a hexagonal cover of smaller circles. The circles grow as needed to keep the cover at
+# SEARCH_MAX_TILES circles.
+SEARCH_TILE_RADIUS_MILES = float(os.getenv("SEARCH_TILE_RADIUS_MILES", 2))
+SEARCH_MAX_TILES = int(os.getenv("SEARCH_MAX_TILES", 19))
+# A search stops querying Google once it has found this many venues rated SEARCH_TARGET_RATING or better, 0 never stops
+SEARCH_TARGET_RESULTS = int(os.getenv("SEARCH_TARGET_RESULTS", 60))
+SEARCH_TARGET_RATING = float(os.getenv("SEARCH_TARGET_RATING", 4.0))
+# Skip the keyword text searches that have added fewer than SEARCH_PLANNER_MIN_YIELD new venues per search on average
+# in an area, once they have been run SEARCH_PLANNER_MIN_SAMPLES times there. A SEARCH_PLANNER_EXPLORE share of
+# searches runs them anyway, see api.query_planner.
+SEARCH_PLANNER = os.getenv("SEARCH_PLANNER", "True") == "True"
+SEARCH_PLANNER_MIN_SAMPLES = int(os.getenv("SEARCH_PLANNER_MIN_SAMPLES", 3))
+SEARCH_PLANNER_MIN_YIELD = float(os.getenv("SEARCH_PLANNER_MIN_YIELD", 1))
+SEARCH_PLANNER_EXPLORE = float(os.getenv("SEARCH_PLANNER_EXPLORE", 0.1))
+# Most venues one page of search results can ask for with limit
+SEARCH_MAX_LIMIT = int(os.getenv("SEARCH_MAX_LIMIT", 200))
+# Initial wait (seconds) before requesting the next page of results, doubled every time the token is not ready yet
+PLACES_PAGE_TOKEN_DELAY = float(os.getenv("PLACES_PAGE_TOKEN_DELAY", 0.5))
+PLACES_PAGE_TOKEN_ATTEMPTS = int(os.getenv("PLACES_PAGE_TOKEN_ATTEMPTS", 4))
+# Queue Location upserts from searches and write them in batches in the background instead of during the request.
+# Single process only: the queue lives in the process that ran the search, so with several workers a crawl of venues
+# found a moment ago on another worker is rejected until that worker has flushed them
+LOCATION_WRITE_BEHIND = os.getenv("LOCATION_WRITE_BEHIND", "False") == "True"
+# Seconds between write-behind flushes, 0 only flushes on LOCATION_FLUSH_SIZE or on demand
+LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", 2))
+# Queued Locations that trigger a flush before the interval is up
+LOCATION_FLUSH_SIZE = int(os.getenv("LOCATION_FLUSH_SIZE", 500))
+# Seconds a validated auth token is trusted without looking it up again, 0 looks up every request. Deleted tokens are
+# dropped from AUTH_TOKEN_CACHE right away, but the default cache is per process: other workers keep accepting a token
+# for up to this long after logout. Only raise it with a shared cache (e.g. Redis) as AUTH_TOKEN_CACHE.
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", 5))
+AUTH_TOKEN_CACHE = os.getenv("AUTH_TOKEN_CACHE", "default")
+# Bearer token Prometheus has to send to scrape /api/metrics/, without it only staff users can read the metrics unless
+# METRICS_PUBLIC opens the endpoint to everyone
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "False") == "True"
+# Identical searches (same tile, radius bucket and type) and crawls (same stops and options) that are in flight at the
+# same time share one upstream computation
+REQUEST_COALESCING = os.getenv("REQUEST_COALESCING", "True") == "True"
+# How long (seconds) the place ids of a search tile are reused before Google is asked again
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 6 * 60 * 60))
+# How long (seconds) a walking time measured between two stops is reused for crawl optimization
+WALKING_MATRIX_TTL = int(os.getenv("WALKING_MATRIX_TTL", 30 * 24 * 60 * 60))
+# How long (seconds) walking directions between two points are reused
+ROUTE_LEG_TTL = int(os.getenv("ROUTE_LEG_TTL", 7 * 24 * 60 * 60))
+# How long (seconds) clients and reverse proxies may reuse a search or route response without revalidating it
+SEARCH_HTTP_MAX_AGE = int(os.getenv("SEARCH_HTTP_MAX_AGE", 5 * 60))
+ROUTE_HTTP_MAX_AGE = int(os.getenv("ROUTE_HTTP_MAX_AGE", 24 * 60 * 60))
+# Seconds to wait for the ORS matrix API before estimating walking times locally
+ORS_MATRIX_TIMEOUT = float(os.getenv("ORS_MATRIX_TIMEOUT", 5))
+# Longest solver time budget_ms can ask for
+CRAWL_MAX_BUDGET_MS = float(os.getenv("CRAWL_MAX_BUDGET_MS", 10000))
+# Most ORS requests one crawl makes at once, and most stops ORS accepts in one directions request
+ORS_MAX_CONCURRENCY = int(os.getenv("ORS_MAX_CONCURRENCY", 4))
+ORS_MAX_WAYPOINTS = int(os.getenv("ORS_MAX_WAYPOINTS", 50))
+# Crawls with more stops than this are split into clusters of at most CRAWL_CLUSTER_SIZE nearby stops, which are
+# ordered and measured separately, see api.solver.solve_clustered
+CRAWL_CLUSTER_THRESHOLD = int(os.getenv("CRAWL_CLUSTER_THRESHOLD", 50))
+CRAWL_CLUSTER_SIZE = int(os.getenv("CRAWL_CLUSTER_SIZE", 25))
+# Walking time estimates: straight-line distance is multiplied by the detour factor and walked at WALKING_SPEED_MPH
+WALKING_DETOUR_FACTOR = float(os.getenv("WALKING_DETOUR_FACTOR", 1.3))
+WALKING_SPEED_MPH = float(os.getenv("WALKING_SPEED_MPH", 3.0))
+# Crawls whose stops all lie within this many miles of each other skip ORS and use the estimate
+WALKING_ESTIMATE_MAX_MILES = float(os.getenv("WALKING_ESTIMATE_MAX_MILES", 0.5))
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
@@ -47,6 +128,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its Server-Timing total covers the other middleware too
+    "api.timing.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -134,6 +217,10 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "knox.auth.TokenAuthentication",
-    ]
+        "api.auth.CachedTokenAuthentication",
+    ],
+    "DEFAULT_RENDERER_CLASSES": [
+        "api.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
@@ -1,6 +1,16 @@
 from django.contrib import admin
 from django.urls import path, include
-from api.views import LoginView, RouteView, LocationSearchView, UserViewSet, OptimizedCrawlView
+from api.views import (
+    CrawlsView,
+    CrawlView,
+    LoginView,
+    MetricsView,
+    RouteView,
+    LocationSearchView,
+    UserViewSet,
+    OptimizedCrawlView,
+)
+from api.async_views import AsyncLocationSearchView, AsyncOptimizedCrawlView, AsyncRouteView
 from django.urls import include, path
 from rest_framework.routers import Route, SimpleRouter
 
@@ -33,6 +43,15 @@ urlpatterns = [
     path("api/search/", LocationSearchView.as_view(), name="api_search"),
     path("api/route/", RouteView.as_view(), name="api_route"),
     path("api/optimize-crawl/", OptimizedCrawlView.as_view(), name="optimize_crawl"),
+    # Saved crawls, changed a stop at a time without optimizing them from scratch
+    path("api/crawls/", CrawlsView.as_view(), name="crawls"),
+    path("api/crawls/<int:pk>/", CrawlView.as_view(), name="crawl"),
+    # Same endpoints, served without blocking a thread on Google/ORS when running under ASGI
+    path("api/async/search/", AsyncLocationSearchView.as_view(), name="api_search_async"),
+    path("api/async/route/", AsyncRouteView.as_view(), name="api_route_async"),
+    path("api/async/optimize-crawl/", AsyncOptimizedCrawlView.as_view(), name="optimize_crawl_async"),
+    # Prometheus scrape target for staff users or METRICS_TOKEN, public only with METRICS_PUBLIC
+    path("api/metrics/", MetricsView.as_view(), name="metrics"),
 ]
 
 urlpatterns += user_router.urls
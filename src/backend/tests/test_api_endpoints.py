@@ -1,9 +1,16 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from unittest.mock import patch, MagicMock
-from api.models import Location
+from api.geo import decode_polyline
+from api.models import Location, SearchTile, WalkingDistance
+import googlemaps
 import requests
 import base64
+import json
+import threading
+import time
+from urllib.parse import urlencode
 
 TEST_LAT = "40.7128"
 TEST_LNG = "-74.0060"
@@ -16,6 +23,33 @@ def basic_auth_header(username, password):
     return f"Basic {base64.b64encode(bytes(f"{username}:{password}", "utf-8")).decode("utf-8")}"
 
 
+def ors_directions(body):
+    """Fake ORS directions response walking straight between the requested coordinates, 100m and 60s per leg"""
+    coordinates = body["coordinates"]
+    response = MagicMock(spec=requests.Response)
+    response.json.return_value = {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "properties": {
+                    "segments": [
+                        {
+                            "distance": 100,
+                            "duration": 60,
+                            "steps": [{"distance": 100, "duration": 60, "way_points": [i, i + 1]}],
+                        }
+                        for i in range(len(coordinates) - 1)
+                    ],
+                    "way_points": list(range(len(coordinates))),
+                    "summary": {"distance": 100 * (len(coordinates) - 1), "duration": 60 * (len(coordinates) - 1)},
+                },
+                "geometry": {"coordinates": coordinates},
+            }
+        ],
+    }
+    return response
+
+
 def login(test_case: TestCase, username=TEST_USERNAME, password=TEST_PASSWORD):
     response = test_case.client.post(
         "/api/auth/login/",
@@ -25,6 +59,8 @@ def login(test_case: TestCase, username=TEST_USERNAME, password=TEST_PASSWORD):
     return response.json()["token"]
 
 
+# Venues are written during the request, so the test transaction sees them, see tests.test_writeback
+@override_settings(LOCATION_WRITE_BEHIND=False)
 class LocationTest(TestCase):
     @classmethod
     def setUpTestData(cls):
@@ -57,6 +93,419 @@ class LocationTest(TestCase):
         self.assertIn("search_params", data)
         self.assertIn("locations", data)
 
+    @patch("api.views.time.sleep")
+    @patch("googlemaps.Client")
+    def test_location_search_page_token_backoff(self, mock_client, mock_sleep):
+        # The first page token is rejected once before it becomes valid, every other query returns nothing
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        place = {
+            "place_id": "page2",
+            "name": "Second Page Bar",
+            "vicinity": "2 Main St",
+            "types": ["bar"],
+            "geometry": {"location": {"lat": float(TEST_LAT), "lng": float(TEST_LNG)}},
+        }
+        pages = {
+            None: {"results": [], "next_page_token": "token"},
+            "token": {"results": [place]},
+        }
+        attempts = []
+
+        def places_nearby(location, radius, type, page_token=None):
+            if page_token and not attempts:
+                attempts.append(page_token)
+                raise googlemaps.exceptions.ApiError("INVALID_REQUEST")
+            return pages[page_token] if type == "bar" else {"results": []}
+
+        gmaps_mock.places_nearby.side_effect = places_nearby
+        gmaps_mock.places.return_value = {"results": []}
+
+        # A radius of a single tile, so only one query pages
+        response = self.client.get(
+            "/api/search/",
+            {"longitude": TEST_LNG, "latitude": TEST_LAT, "radius": 2},
+            headers={"authorization": f"Token {login(self)}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([loc["place_id"] for loc in response.json()["locations"]], ["page2"])
+        # Backoff doubles after the rejected token
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        self.assertEqual(delays, [delays[0], delays[0] * 2])
+
+    @patch("googlemaps.Client")
+    def test_location_search_tile_cache(self, mock_client):
+        # Repeat and overlapping searches are answered from the tile cache without calling Google
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        gmaps_mock.places_nearby.return_value = {
+            "results": [
+                {
+                    "place_id": "near",
+                    "name": "Near Bar",
+                    "vicinity": "1 Main St",
+                    "types": ["bar"],
+                    "geometry": {"location": {"lat": 40.7130, "lng": -74.0060}},
+                },
+                {
+                    "place_id": "far",
+                    "name": "Far Bar",
+                    "vicinity": "9 Main St",
+                    "types": ["bar"],
+                    "geometry": {"location": {"lat": 40.7900, "lng": -74.0060}},
+                },
+            ]
+        }
+        gmaps_mock.places.return_value = {"results": []}
+        headers = {"authorization": f"Token {login(self)}"}
+
+        response = self.client.get("/api/search/", {"longitude": TEST_LNG, "latitude": TEST_LAT}, headers=headers)
+        self.assertEqual(response.json()["cache"], "miss")
+        google_calls = gmaps_mock.places_nearby.call_count
+
+        response = self.client.get("/api/search/", {"longitude": TEST_LNG, "latitude": TEST_LAT}, headers=headers)
+        self.assertEqual(response.json()["cache"], "hit")
+        self.assertEqual(response.json()["total_locations"], 2)
+
+        # A 1 mile search a few blocks away sits inside the 10 mile circle and only keeps the nearby bar
+        response = self.client.get(
+            "/api/search/", {"longitude": "-74.0070", "latitude": "40.7140", "radius": 1}, headers=headers
+        )
+        self.assertEqual(response.json()["cache"], "hit")
+        self.assertEqual([loc["place_id"] for loc in response.json()["locations"]], ["near"])
+        self.assertEqual(gmaps_mock.places_nearby.call_count, google_calls)
+
+    @patch("googlemaps.Client")
+    def test_large_search_is_tiled(self, mock_client):
+        # The 10 mile bar search comes back full, so bars are searched again on smaller circles around the center
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        bars = [
+            {
+                "place_id": f"bar{i}",
+                "name": "Busy Bar",
+                "vicinity": "1 Main St",
+                "types": ["bar"],
+                "geometry": {"location": {"lat": float(TEST_LAT), "lng": float(TEST_LNG)}},
+            }
+            for i in range(60)
+        ]
+        gmaps_mock.places_nearby.side_effect = lambda location, radius, type: {
+            "results": bars if type == "bar" and radius == 10 * 1609 else []
+        }
+        gmaps_mock.places.return_value = {"results": []}
+
+        response = self.client.get(
+            "/api/search/", {"longitude": TEST_LNG, "latitude": TEST_LAT}, headers={"authorization": f"Token {login(self)}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_locations"], 60)
+        nearby = [call.kwargs for call in gmaps_mock.places_nearby.call_args_list]
+        tiles = [call for call in nearby if call["radius"] < 10 * 1609]
+        self.assertEqual(len({call["location"] for call in tiles}), settings.SEARCH_MAX_TILES)
+        # The night club search was not full and is not tiled, keywords are searched once at the center
+        self.assertEqual(len(nearby), settings.SEARCH_MAX_TILES + 2)
+        self.assertTrue(all(call["type"] == "bar" for call in tiles))
+        self.assertTrue(all(call.kwargs["radius"] == 10 * 1609 for call in gmaps_mock.places.call_args_list))
+
+    @patch("googlemaps.Client")
+    def test_sparse_large_search_is_not_tiled(self, mock_client):
+        # Nothing came back full, so one search per type over the whole circle found every venue there is
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        gmaps_mock.places_nearby.return_value = {"results": []}
+        gmaps_mock.places.return_value = {"results": []}
+
+        response = self.client.get(
+            "/api/search/", {"longitude": TEST_LNG, "latitude": TEST_LAT}, headers={"authorization": f"Token {login(self)}"}
+        )
+        self.assertEqual(response.status_code, 200)
+        nearby = [call.kwargs for call in gmaps_mock.places_nearby.call_args_list]
+        self.assertEqual(
+            [(call["type"], call["radius"]) for call in nearby], [("bar", 10 * 1609), ("night_club", 10 * 1609)]
+        )
+
+    @override_settings(SEARCH_TARGET_RESULTS=2, SEARCH_MAX_CONCURRENCY=1)
+    @patch("googlemaps.Client")
+    def test_search_stops_once_enough_venues(self, mock_client):
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        # The first keyword search holds the only worker until the response is back
+        release = threading.Event()
+
+        def places(query, location, radius):
+            release.wait(5)
+            return {"results": []}
+
+        gmaps_mock.places_nearby.side_effect = lambda location, radius, type: {
+            "results": [
+                {
+                    "place_id": type,
+                    "name": "Good Bar",
+                    "vicinity": "1 Main St",
+                    "types": ["bar"],
+                    "rating": 4.5,
+                    "geometry": {"location": {"lat": float(TEST_LAT), "lng": float(TEST_LNG)}},
+                }
+            ]
+        }
+        gmaps_mock.places.side_effect = places
+
+        try:
+            response = self.client.get(
+                "/api/search/",
+                {"longitude": TEST_LNG, "latitude": TEST_LAT},
+                headers={"authorization": f"Token {login(self)}"},
+            )
+        finally:
+            release.set()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_locations"], 2)
+        # The bar and night club searches were enough, the other keywords were never searched
+        self.assertLessEqual(gmaps_mock.places.call_count, 1)
+
+        # The stopped search is not reused for a search 7 miles north, which it may not have covered
+        response = self.client.get(
+            "/api/search/",
+            {"longitude": TEST_LNG, "latitude": float(TEST_LAT) + 7 / 69, "radius": 2},
+            headers={"authorization": f"Token {login(self)}"},
+        )
+        self.assertEqual(response.json()["cache"], "miss")
+        self.assertGreater(gmaps_mock.places_nearby.call_count, 2)
+
+    @override_settings(SEARCH_TARGET_RESULTS=1, SEARCH_MAX_CONCURRENCY=2)
+    @patch("googlemaps.Client")
+    def test_search_keeps_finished_queries_when_stopping(self, mock_client):
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        night_club_done = threading.Event()
+
+        def places_nearby(location, radius, type):
+            if type == "bar":
+                # Answer after the night club search, which runs next to this one, has finished
+                night_club_done.wait(5)
+                time.sleep(0.2)
+            else:
+                night_club_done.set()
+            return {
+                "results": [
+                    {
+                        "place_id": type,
+                        "name": "Good Bar",
+                        "vicinity": "1 Main St",
+                        "types": ["bar"],
+                        "rating": 4.5,
+                        "geometry": {"location": {"lat": float(TEST_LAT), "lng": float(TEST_LNG)}},
+                    }
+                ]
+            }
+
+        gmaps_mock.places_nearby.side_effect = places_nearby
+        gmaps_mock.places.return_value = {"results": []}
+        response = self.client.get(
+            "/api/search/",
+            {"longitude": TEST_LNG, "latitude": TEST_LAT, "radius": 2},
+            headers={"authorization": f"Token {login(self)}"},
+        )
+        # The bar search alone was enough, but the night club venue had already been found
+        self.assertEqual(sorted(loc["place_id"] for loc in response.json()["locations"]), ["bar", "night_club"])
+
+    @override_settings(SEARCH_PLANNER_MIN_SAMPLES=2, SEARCH_PLANNER_EXPLORE=0)
+    @patch("googlemaps.Client")
+    def test_search_skips_redundant_keywords(self, mock_client):
+        # The type queries find the venue, "tavern" finds it again and only "pub" finds one of its own
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+
+        def place(place_id):
+            return {
+                "place_id": place_id,
+                "name": "Corner Bar",
+                "vicinity": "1 Main St",
+                "types": ["bar"],
+                "geometry": {"location": {"lat": float(TEST_LAT), "lng": float(TEST_LNG)}},
+            }
+
+        gmaps_mock.places_nearby.return_value = {"results": [place("corner")]}
+        gmaps_mock.places.side_effect = lambda query, location, radius: {
+            "results": [place("pub-only")] if query == "pub" else [place("corner")]
+        }
+        headers = {"authorization": f"Token {login(self)}"}
+
+        for _ in range(3):
+            # Search the area afresh every time
+            SearchTile.objects.all().delete()
+            gmaps_mock.places.reset_mock()
+            response = self.client.get("/api/search/", {"longitude": TEST_LNG, "latitude": TEST_LAT}, headers=headers)
+            self.assertEqual(response.json()["total_locations"], 2)
+        self.assertEqual([call.kwargs["query"] for call in gmaps_mock.places.call_args_list], ["pub"])
+
+    @patch("googlemaps.Client")
+    def test_local_search(self, mock_client):
+        # source=local answers from the Location table, nearest first, without calling Google
+        for place_id, lat in (("two_blocks", 40.7150), ("next_door", 40.7130), ("uptown", 40.7589)):
+            Location.objects.create(
+                place_id=place_id, name=place_id, latitude=lat, longitude=-74.0060, user_ratings_total=1
+            )
+
+        response = self.client.get(
+            "/api/search/",
+            {"longitude": TEST_LNG, "latitude": TEST_LAT, "radius": 1, "source": "local"},
+            headers={"authorization": f"Token {login(self)}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([loc["place_id"] for loc in response.json()["locations"]], ["next_door", "two_blocks"])
+        self.assertNotIn("geohash", response.json()["locations"][0])
+        mock_client.return_value.places_nearby.assert_not_called()
+
+    @patch("googlemaps.Client")
+    def test_search_sort_and_pagination(self, mock_client):
+        for place_id, lat, rating, reviews in (
+            ("next_door", 40.7130, 3.5, 900),
+            ("two_blocks", 40.7150, 4.8, 20),
+            ("corner", 40.7140, None, 0),
+            ("across", 40.7135, 4.2, 150),
+        ):
+            Location.objects.create(
+                place_id=place_id,
+                name=place_id,
+                latitude=lat,
+                longitude=-74.0060,
+                rating=rating,
+                user_ratings_total=reviews,
+            )
+        headers = {"authorization": f"Token {login(self)}"}
+        params = {"longitude": TEST_LNG, "latitude": TEST_LAT, "radius": 1, "source": "local"}
+
+        def place_ids(response):
+            return [loc["place_id"] for loc in response.json()["locations"]]
+
+        response = self.client.get("/api/search/", {**params, "sort": "popularity"}, headers=headers)
+        self.assertEqual(place_ids(response), ["next_door", "across", "two_blocks", "corner"])
+        self.assertIsNone(response.json()["next_cursor"])
+
+        # Pages of two, each continuing after the last venue of the one before
+        response = self.client.get("/api/search/", {**params, "sort": "rating", "limit": 2}, headers=headers)
+        data = response.json()
+        self.assertEqual((place_ids(response), data["total_locations"]), (["two_blocks", "across"], 4))
+        response = self.client.get(
+            "/api/search/", {**params, "sort": "rating", "limit": 2, "cursor": data["next_cursor"]}, headers=headers
+        )
+        self.assertEqual(place_ids(response), ["next_door", "corner"])
+        self.assertIsNone(response.json()["next_cursor"])
+
+        response = self.client.get("/api/search/", {**params, "sort": "distance", "limit": 1}, headers=headers)
+        self.assertEqual(place_ids(response), ["next_door"])
+
+        for invalid in (
+            {"sort": "name"},
+            {"limit": 0},
+            {"limit": "ten"},
+            {"sort": "distance", "cursor": data["next_cursor"]},
+            {"limit": 5, "stream": "ndjson"},
+        ):
+            response = self.client.get("/api/search/", {**params, **invalid}, headers=headers)
+            self.assertEqual(response.status_code, 400, invalid)
+
+    @patch("googlemaps.Client")
+    def test_search_conditional_get(self, mock_client):
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        gmaps_mock.places_nearby.return_value = {
+            "results": [
+                {
+                    "place_id": "near",
+                    "name": "Near Bar",
+                    "vicinity": "1 Main St",
+                    "types": ["bar"],
+                    "geometry": {"location": {"lat": 40.7130, "lng": -74.0060}},
+                }
+            ]
+        }
+        gmaps_mock.places.return_value = {"results": []}
+        headers = {"authorization": f"Token {login(self)}"}
+        params = {"longitude": TEST_LNG, "latitude": TEST_LAT, "radius": 1}
+
+        response = self.client.get("/api/search/", params, headers=headers)
+        self.assertEqual(response["Cache-Control"], "public, max-age=300")
+        self.assertIn("Authorization", response["Vary"])
+        etag, last_modified = response["ETag"], response["Last-Modified"]
+        self.assertTrue(etag.startswith("W/"))
+
+        # The cached answer is the same search, even though its cache status differs
+        response = self.client.get("/api/search/", params, headers={**headers, "if-none-match": etag})
+        self.assertEqual((response.status_code, response.content, response["ETag"]), (304, b"", etag))
+        response = self.client.get("/api/search/", params, headers={**headers, "if-modified-since": last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        # Venues known locally have no fetch time, and are another response
+        response = self.client.get(
+            "/api/search/", {**params, "source": "local"}, headers={**headers, "if-none-match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Last-Modified", response)
+
+    @patch("googlemaps.Client")
+    def test_search_etag_covers_total(self, mock_client):
+        for place_id, lat in (("next_door", 40.7130), ("two_blocks", 40.7150)):
+            Location.objects.create(
+                place_id=place_id, name=place_id, latitude=lat, longitude=-74.0060, user_ratings_total=1
+            )
+        headers = {"authorization": f"Token {login(self)}"}
+        params = {"longitude": TEST_LNG, "latitude": TEST_LAT, "radius": 1, "source": "local", "sort": "distance"}
+        response = self.client.get("/api/search/", {**params, "limit": 1}, headers=headers)
+        etag = response["ETag"]
+
+        # The first page and its cursor stay the same, but the count of venues does not
+        Location.objects.create(
+            place_id="three_blocks", name="three_blocks", latitude=40.7170, longitude=-74.0060, user_ratings_total=1
+        )
+        response = self.client.get("/api/search/", {**params, "limit": 1}, headers={**headers, "if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_locations"], 3)
+
+    @patch("googlemaps.Client")
+    def test_streaming_search(self, mock_client):
+        # Venues are streamed one NDJSON record at a time, stored, and followed by a summary record
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        bar = {
+            "place_id": "streamed",
+            "name": "Streamed Bar",
+            "vicinity": "1 Main St",
+            "types": ["bar"],
+            "geometry": {"location": {"lat": 40.7130, "lng": -74.0060}},
+        }
+        gmaps_mock.places_nearby.side_effect = lambda **kwargs: {"results": [bar] if kwargs["type"] == "bar" else []}
+        gmaps_mock.places.return_value = {"results": []}
+
+        response = self.client.get(
+            "/api/search/",
+            {"longitude": TEST_LNG, "latitude": TEST_LAT, "stream": "ndjson"},
+            headers={"authorization": f"Token {login(self)}"},
+        )
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        records = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual([record["type"] for record in records], ["location", "summary"])
+        self.assertEqual(records[0]["location"]["place_id"], "streamed")
+        self.assertEqual(records[1]["total_locations"], 1)
+        self.assertEqual(records[1]["cache"], "miss")
+        self.assertTrue(Location.objects.filter(place_id="streamed").exists())
+
+    @patch("googlemaps.Client")
+    def test_streaming_search_error(self, mock_client):
+        mock_client.return_value.places_nearby.side_effect = googlemaps.exceptions.ApiError("REQUEST_DENIED")
+        mock_client.return_value.places.return_value = {"results": []}
+
+        response = self.client.get(
+            "/api/search/",
+            {"longitude": TEST_LNG, "latitude": TEST_LAT, "stream": "ndjson"},
+            headers={"authorization": f"Token {login(self)}"},
+        )
+        records = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+        self.assertEqual(records[-1]["type"], "error")
+        self.assertIn("REQUEST_DENIED", records[-1]["error"])
+
     def test_missing_address_parameter(self):
         response = self.client.get("/api/search/", headers={"authorization": f"Token {login(self)}"})
         self.assertEqual(response.status_code, 200)
@@ -77,8 +526,8 @@ class RouteTest(TestCase):
         user.set_password(TEST_PASSWORD)
         user.save()
 
-    @patch("requests.get")
-    def test_get_route(self, mock_get):
+    @patch("requests.Session.post")
+    def test_get_route(self, mock_post):
         # Test successful route calculation between two points
         mock_response = MagicMock()
         mock_response.status_code = 200
@@ -90,7 +539,7 @@ class RouteTest(TestCase):
                 }
             ]
         }
-        mock_get.return_value = mock_response
+        mock_post.return_value = mock_response
 
         response = self.client.get(
             "/api/route/",
@@ -100,6 +549,63 @@ class RouteTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn("route", response.json())
 
+    @patch("requests.Session.post")
+    def test_route_leg_cache(self, mock_post):
+        # A route that has been walked before is served from the leg cache, shared with crawl optimization
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+        params = {"start_lat": TEST_LAT, "start_lng": TEST_LNG, "end_lat": "40.7589", "end_lng": "-73.9851"}
+        headers = {"authorization": f"Token {login(self)}"}
+
+        first = self.client.get("/api/route/", params, headers=headers).json()
+        second = self.client.get("/api/route/", params, headers=headers).json()
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(second["route"]["coordinates"], [[40.7128, -74.006], [40.7589, -73.9851]])
+
+    @patch("requests.Session.post")
+    def test_route_conditional_get(self, mock_post):
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+        params = {"start_lat": TEST_LAT, "start_lng": TEST_LNG, "end_lat": "40.7589", "end_lng": "-73.9851"}
+        headers = {"authorization": f"Token {login(self)}"}
+
+        response = self.client.get("/api/route/", params, headers=headers)
+        self.assertEqual(response["Cache-Control"], "public, max-age=86400")
+        self.assertIn("Authorization", response["Vary"])
+        etag = response["ETag"]
+
+        response = self.client.get("/api/route/", params, headers={**headers, "if-none-match": etag})
+        self.assertEqual((response.status_code, response.content), (304, b""))
+        # The same points written differently are the same route
+        response = self.client.get(
+            "/api/route/", {**params, "end_lat": "40.75890"}, headers={**headers, "if-none-match": etag}
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            "/api/route/", {**params, "end_name": "Home"}, headers={**headers, "if-none-match": etag}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_post.call_count, 1)
+
+    @patch("requests.Session.post")
+    def test_route_geometry_encodings(self, mock_post):
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+        params = {"start_lat": TEST_LAT, "start_lng": TEST_LNG, "end_lat": "40.7589", "end_lng": "-73.9851"}
+        headers = {"authorization": f"Token {login(self)}"}
+
+        route = self.client.get("/api/route/", {**params, "geometry": "polyline"}, headers=headers).json()["route"]
+        self.assertNotIn("coordinates", route)
+        self.assertEqual((route["geometry"]["encoding"], route["geometry"]["precision"]), ("polyline", 5))
+        self.assertEqual(decode_polyline(route["geometry"]["coordinates"]), [[-74.006, 40.7128], [-73.9851, 40.7589]])
+
+        route = self.client.get("/api/route/", {**params, "geometry": "delta", "precision": 6}, headers=headers).json()
+        self.assertEqual(route["route"]["geometry"]["coordinates"], [40712800, -74006000, 46100, 20900])
+
+        response = self.client.get("/api/route/", {**params, "geometry": "wkt"}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("geometry must be one of", response.json()["error"])
+        response = self.client.get("/api/route/", {**params, "precision": 12}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
     @patch("requests.get")
     def test_invalid_route(self, mock_get):
         mock_response = MagicMock()
@@ -168,8 +674,8 @@ class OptimizedCrawlTest(TestCase):
         self.token = login(self)
         self.headers = {"authorization": f"Token {self.token}"}
 
-    @patch('requests.get')
-    def test_successful_optimization(self, mock_get):
+    @patch('requests.Session.post')
+    def test_successful_optimization(self, mock_post):
         # Mock matrix API response
         matrix_response = MagicMock(spec=requests.Response)
         matrix_response.status_code = 200
@@ -185,7 +691,8 @@ class OptimizedCrawlTest(TestCase):
             "type": "FeatureCollection",
             "features": [{
                 "properties": {
-                    "segments": [{"distance": 2000, "duration": 1000}]
+                    "segments": [{"distance": 2000, "duration": 1000}],
+                    "summary": {"distance": 2000, "duration": 1000}
                 },
                 "geometry": {
                     "coordinates": [[-74.0060, 40.7128], [-73.9851, 40.7589]]
@@ -193,7 +700,7 @@ class OptimizedCrawlTest(TestCase):
             }]
         }
         
-        mock_get.side_effect = [matrix_response, route_response]
+        mock_post.side_effect = [matrix_response, route_response]
 
         response = self.client.get(
             "/api/optimize-crawl/",
@@ -207,6 +714,201 @@ class OptimizedCrawlTest(TestCase):
         self.assertIn("total_time_seconds", data)
         self.assertIn("ordered_locations", data)
         self.assertIn("geo_json", data)
+        self.assertEqual(data["solver"]["name"], "held_karp")
+
+    @patch('requests.Session.post')
+    def test_optimization_fixed_start(self, mock_post):
+        matrix_response = MagicMock(spec=requests.Response)
+        matrix_response.json.return_value = {"durations": [[0, 1000], [10, 0]], "distances": [[0, 2000], [20, 0]]}
+        route_response = ors_directions({"coordinates": [[-74.006, 40.7128], [-73.9851, 40.7589]]})
+        mock_post.side_effect = [matrix_response, route_response]
+
+        response = self.client.get(
+            "/api/optimize-crawl/",
+            {"location": ["place1", "place2"], "start": "place1"},
+            headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([loc["place_id"] for loc in response.json()["ordered_locations"]], ["place1", "place2"])
+
+    @patch('requests.Session.post')
+    def test_walking_matrix_cache(self, mock_post):
+        for place_id, lat in (("place3", 40.7300), ("place4", 40.7400)):
+            Location.objects.create(
+                place_id=place_id, name=place_id, latitude=lat, longitude=-73.995, user_ratings_total=1
+            )
+
+        def ors(url, json=None, **kwargs):
+            response = MagicMock(spec=requests.Response)
+            if "matrix" in url:
+                rows, cols = json["sources"], json["destinations"]
+                response.json.return_value = {
+                    "durations": [[0 if r == c else 100 for c in cols] for r in rows],
+                    "distances": [[0 if r == c else 0.1 for c in cols] for r in rows],
+                }
+            else:
+                response = ors_directions(json)
+            return response
+
+        mock_post.side_effect = ors
+
+        def matrix_calls():
+            return [call.kwargs["json"] for call in mock_post.call_args_list if "matrix" in call.args[0]]
+
+        crawl = ["place1", "place2", "place3"]
+        self.client.get("/api/optimize-crawl/", {"location": crawl}, headers=self.headers)
+        self.assertEqual(len(matrix_calls()), 1)
+
+        # Every pair is known now, only the directions are requested
+        self.client.get("/api/optimize-crawl/", {"location": crawl[::-1]}, headers=self.headers)
+        self.assertEqual(len(matrix_calls()), 1)
+
+        # Adding a stop only asks for the row and column of the new stop
+        response = self.client.get("/api/optimize-crawl/", {"location": crawl + ["place4"]}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        blocks = [(len(body["sources"]), len(body["destinations"])) for body in matrix_calls()[1:]]
+        self.assertEqual(sorted(blocks), [(1, 3), (3, 1)])
+        self.assertEqual(WalkingDistance.objects.count(), 12)
+
+    @patch('requests.Session.post')
+    def test_estimated_matrix(self, mock_post):
+        # The estimate needs no matrix call, only the directions are requested
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+        response = self.client.get(
+            "/api/optimize-crawl/", {"location": ["place1", "place2"], "matrix": "estimate"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["solver"]["matrix"], "estimate")
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertNotIn("matrix", mock_post.call_args.args[0])
+
+    @patch("api.clients.time.sleep")
+    @patch('requests.Session.post')
+    def test_matrix_timeout_falls_back_to_estimate(self, mock_post, mock_sleep):
+        def ors(url, json=None, **kwargs):
+            if "matrix" in url:
+                raise requests.exceptions.Timeout()
+            return ors_directions(json)
+
+        mock_post.side_effect = ors
+        response = self.client.get("/api/optimize-crawl/", {"location": ["place1", "place2"]}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["solver"]["matrix"], "ors_fallback")
+        # Estimates are not remembered as measured walking times
+        self.assertEqual(WalkingDistance.objects.count(), 0)
+
+    @patch('requests.Session.post')
+    def test_crawl_reuses_route_legs(self, mock_post):
+        Location.objects.create(
+            place_id="place3", name="place3", latitude=40.73, longitude=-73.995, user_ratings_total=1
+        )
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+        crawl = {
+            "location": ["place1", "place3", "place2"],
+            "start": "place1",
+            "solver": "greedy",
+            "matrix": "estimate",
+        }
+
+        first = self.client.get("/api/optimize-crawl/", crawl, headers=self.headers).json()
+        self.assertEqual(mock_post.call_count, 1)
+        geo_json = first["geo_json"]["features"][0]
+        self.assertEqual(geo_json["properties"]["way_points"], [0, 1, 2])
+        self.assertEqual(len(geo_json["geometry"]["coordinates"]), 3)
+        self.assertEqual(first["total_time_seconds"], 120)
+
+        # Both legs are cached now, a new crawl over the same legs needs no directions call
+        second = self.client.get("/api/optimize-crawl/", crawl, headers=self.headers).json()
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(first["geo_json"], second["geo_json"])
+
+        compact = self.client.get("/api/optimize-crawl/", {**crawl, "geometry": "delta"}, headers=self.headers).json()
+        geometry = compact["geo_json"]["features"][0]["geometry"]
+        self.assertEqual((geometry["encoding"], geometry["precision"]), ("delta", 5))
+        self.assertEqual(len(geometry["coordinates"]), 6)
+        self.assertEqual(compact["ordered_locations"], first["ordered_locations"])
+
+    @override_settings(CRAWL_CLUSTER_THRESHOLD=30, CRAWL_CLUSTER_SIZE=12, ORS_MAX_WAYPOINTS=20)
+    @patch('requests.Session.post')
+    def test_large_crawl_is_clustered(self, mock_post):
+        # Three neighbourhoods of a dozen bars each
+        crawl = []
+        for n in range(36):
+            lat, lng = ((40.70, -74.01), (40.73, -73.99), (40.76, -73.97))[n % 3]
+            Location.objects.create(
+                place_id=f"stop{n}",
+                name=f"Stop {n}",
+                latitude=lat + n * 0.0001,
+                longitude=lng - n * 0.0001,
+                user_ratings_total=1,
+            )
+            crawl.append(f"stop{n}")
+
+        def ors(url, json=None, **kwargs):
+            if "matrix" not in url:
+                return ors_directions(json)
+            response = MagicMock(spec=requests.Response)
+            rows, cols = json["sources"], json["destinations"]
+            response.json.return_value = {
+                "durations": [[0 if r == c else 100 for c in cols] for r in rows],
+                "distances": [[0 if r == c else 0.1 for c in cols] for r in rows],
+            }
+            return response
+
+        mock_post.side_effect = ors
+        response = self.client.get(
+            "/api/optimize-crawl/", {"location": crawl, "start": "stop4", "matrix": "ors"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data["solver"]["name"], data["solver"]["clusters"]), ("clustered", 3))
+        self.assertEqual(data["ordered_locations"][0]["place_id"], "stop4")
+        self.assertEqual(sorted(loc["place_id"] for loc in data["ordered_locations"]), sorted(crawl))
+
+        bodies = [(call.args[0], call.kwargs["json"]) for call in mock_post.call_args_list]
+        # Only the walking times within each neighbourhood are measured
+        self.assertEqual(sorted(len(body["locations"]) for url, body in bodies if "matrix" in url), [12, 12, 12])
+        # 35 legs in requests of at most 20 stops, stitched back into one line
+        directions = [body for url, body in bodies if "matrix" not in url]
+        self.assertEqual(sorted(len(body["coordinates"]) for body in directions), [17, 20])
+        self.assertEqual(data["total_time_seconds"], 35 * 60)
+        self.assertEqual(data["geo_json"]["features"][0]["properties"]["way_points"], list(range(36)))
+
+    @patch('requests.Session.post')
+    def test_optimization_budget(self, mock_post):
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+        response = self.client.get(
+            "/api/optimize-crawl/",
+            {"location": ["place1", "place2"], "matrix": "estimate", "budget_ms": 50},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        solver = response.json()["solver"]
+        # Held-Karp solves two stops well within the budget
+        self.assertEqual(solver["name"], "held_karp")
+        self.assertIn("iterations", solver)
+        self.assertGreaterEqual(solver["improvement_percent"], 0)
+
+    def test_invalid_budget(self):
+        for params in ({"budget_ms": "soon"}, {"budget_ms": 0}, {"budget_ms": 50, "solver": "held_karp"}):
+            response = self.client.get(
+                "/api/optimize-crawl/", {"location": ["place1", "place2"], **params}, headers=self.headers
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_invalid_geometry_tolerance(self):
+        response = self.client.get(
+            "/api/optimize-crawl/", {"location": ["place1", "place2"], "tolerance": "-1"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_optimization_start_not_in_crawl(self):
+        response = self.client.get(
+            "/api/optimize-crawl/",
+            {"location": ["place1", "place2"], "start": "place3"},
+            headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
 
     def test_missing_locations(self):
         response = self.client.get(
@@ -234,3 +936,131 @@ class OptimizedCrawlTest(TestCase):
         )
         
         self.assertEqual(response.status_code, 400)
+
+
+class SavedCrawlTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username=TEST_USERNAME)
+        user.set_password(TEST_PASSWORD)
+        user.save()
+        for n in range(5):
+            Location.objects.create(
+                place_id=f"stop{n}", name=f"Stop {n}", latitude=40.70 + n * 0.01, longitude=-74.0, user_ratings_total=1
+            )
+
+    def setUp(self):
+        self.headers = {"authorization": f"Token {login(self)}"}
+        patcher = patch("requests.Session.post", side_effect=self.ors)
+        self.mock_post = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def ors(self, url, json=None, **kwargs):
+        if "matrix" not in url:
+            return ors_directions(json)
+        # Walking times grow with the distance between the stops, which lie on a line
+        response = MagicMock(spec=requests.Response)
+        rows, cols = json["sources"], json["destinations"]
+        lats = [json["locations"][i][1] for i in range(len(json["locations"]))]
+        response.json.return_value = {
+            "durations": [[abs(lats[r] - lats[c]) * 10000 for c in cols] for r in rows],
+            "distances": [[abs(lats[r] - lats[c]) * 70 for c in cols] for r in rows],
+        }
+        return response
+
+    def requests(self):
+        """Bodies of the (matrix, directions) requests since the last call"""
+        bodies = [(call.args[0], call.kwargs["json"]) for call in self.mock_post.call_args_list]
+        self.mock_post.reset_mock()
+        return [body for url, body in bodies if "matrix" in url], [body for url, body in bodies if "matrix" not in url]
+
+    def create(self, stops, **params):
+        # Crawls are created with the query params of /api/optimize-crawl/
+        response = self.client.post(
+            "/api/crawls/?" + urlencode({"location": stops, **params}, doseq=True), headers=self.headers
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()
+
+    def test_change_saved_crawl(self):
+        crawl = self.create(["stop0", "stop2", "stop4"], start="stop0")
+        self.assertEqual([loc["place_id"] for loc in crawl["ordered_locations"]], ["stop0", "stop2", "stop4"])
+        self.assertEqual(len(self.requests()[0]), 1)
+
+        # Reopening the crawl fetches nothing
+        response = self.client.get(f"/api/crawls/{crawl['id']}/", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["geo_json"], crawl["geo_json"])
+        self.assertEqual(self.mock_post.call_count, 0)
+
+        # The new stop goes between its neighbours, only its row and column and its legs are requested
+        response = self.client.patch(f"/api/crawls/{crawl['id']}/?add=stop3", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([loc["place_id"] for loc in data["ordered_locations"]], ["stop0", "stop2", "stop3", "stop4"])
+        self.assertEqual(data["solver"]["name"], "insertion")
+        matrix, directions = self.requests()
+        self.assertEqual(sorted((len(body["sources"]), len(body["destinations"])) for body in matrix), [(1, 3), (3, 1)])
+        self.assertEqual([len(body["coordinates"]) for body in directions], [3])
+
+        # Removing splices the stop out, the leg around it is the only request
+        response = self.client.patch(f"/api/crawls/{crawl['id']}/?remove=stop2", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [loc["place_id"] for loc in response.json()["ordered_locations"]], ["stop0", "stop3", "stop4"]
+        )
+        matrix, directions = self.requests()
+        self.assertEqual((matrix, [len(body["coordinates"]) for body in directions]), ([], [2]))
+
+        response = self.client.delete(f"/api/crawls/{crawl['id']}/", headers=self.headers)
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(f"/api/crawls/{crawl['id']}/", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_changes(self):
+        crawl = self.create(["stop0", "stop1"], matrix="estimate")
+        for query in ("", "add=stop0", "remove=stop3", "remove=stop0&remove=stop1", "add=nowhere"):
+            response = self.client.patch(f"/api/crawls/{crawl['id']}/?{query}", headers=self.headers)
+            self.assertEqual(response.status_code, 400, query)
+
+    def test_other_users_crawl(self):
+        crawl = self.create(["stop0", "stop1"], matrix="estimate")
+        other = User.objects.create(username="someone")
+        other.set_password(TEST_PASSWORD)
+        other.save()
+        headers = {"authorization": f"Token {login(self, 'someone')}"}
+        self.assertEqual(self.client.get(f"/api/crawls/{crawl['id']}/", headers=headers).status_code, 404)
+        self.assertEqual(self.client.delete(f"/api/crawls/{crawl['id']}/", headers=headers).status_code, 404)
+
+    def test_reopen_saved_crawl(self):
+        crawl = self.create(["stop0", "stop1", "stop2"], matrix="estimate")
+        self.mock_post.reset_mock()
+        with patch("api.views.route_legs") as mock_route_legs:
+            response = self.client.get(f"/api/crawls/{crawl['id']}/", headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["geo_json"], crawl["geo_json"])
+            self.assertEqual(response["Cache-Control"], "private, no-cache")
+            self.assertIn("Authorization", response["Vary"])
+
+            # Nothing changed, the client's copy is still good
+            etag = response["ETag"]
+            response = self.client.get(f"/api/crawls/{crawl['id']}/", headers={**self.headers, "if-none-match": etag})
+            self.assertEqual((response.status_code, response.content, response["ETag"]), (304, b"", etag))
+
+            # Another encoding of the route is another representation
+            response = self.client.get(
+                f"/api/crawls/{crawl['id']}/", {"geometry": "polyline"}, headers={**self.headers, "if-none-match": etag}
+            )
+            self.assertEqual(response.status_code, 200)
+        # The route is served as stored, legs are neither looked up nor fetched
+        mock_route_legs.assert_not_called()
+        self.assertEqual(self.mock_post.call_count, 0)
+
+        # Changing the crawl changes its ETag
+        self.client.patch(f"/api/crawls/{crawl['id']}/?remove=stop1", headers=self.headers)
+        response = self.client.get(f"/api/crawls/{crawl['id']}/", headers={**self.headers, "if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        crawls = self.client.get("/api/crawls/", headers=self.headers).json()
+        self.assertEqual([(c["id"], sorted(c["place_ids"])) for c in crawls], [(crawl["id"], ["stop0", "stop2"])])
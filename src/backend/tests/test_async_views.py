@@ -0,0 +1,172 @@
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from knox.models import AuthToken
+
+from api.models import Location, RouteLeg
+
+TEST_LAT = "40.7128"
+TEST_LNG = "-74.0060"
+
+
+def json_response(method, url, body):
+    return httpx.Response(200, json=body, request=httpx.Request(method, url))
+
+
+def ors_directions(coordinates):
+    """Fake ORS directions body walking straight between the requested coordinates, 100m and 60s per leg"""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "properties": {
+                    "segments": [
+                        {
+                            "distance": 100,
+                            "duration": 60,
+                            "steps": [{"distance": 100, "duration": 60, "way_points": [i, i + 1]}],
+                        }
+                        for i in range(len(coordinates) - 1)
+                    ],
+                    "way_points": list(range(len(coordinates))),
+                    "summary": {"distance": 100 * (len(coordinates) - 1), "duration": 60 * (len(coordinates) - 1)},
+                },
+                "geometry": {"coordinates": coordinates},
+            }
+        ],
+    }
+
+
+def fake_upstream(method, url, json=None, params=None, **kwargs):
+    """Answers Google Places with one bar for the "bar" type, and ORS matrix/directions requests"""
+    if "nearbysearch" in url:
+        results = []
+        if params.get("type") == "bar":
+            results.append(
+                {
+                    "place_id": "async_bar",
+                    "name": "Async Bar",
+                    "vicinity": "1 Main St",
+                    "types": ["bar"],
+                    "geometry": {"location": {"lat": 40.7130, "lng": -74.0060}},
+                }
+            )
+        return json_response(method, url, {"status": "OK" if results else "ZERO_RESULTS", "results": results})
+    if "textsearch" in url:
+        return json_response(method, url, {"status": "ZERO_RESULTS", "results": []})
+    if "matrix" in url:
+        rows, cols = json["sources"], json["destinations"]
+        return json_response(
+            method,
+            url,
+            {
+                "durations": [[0 if r == c else 100 for c in cols] for r in rows],
+                "distances": [[0 if r == c else 0.1 for c in cols] for r in rows],
+            },
+        )
+    return json_response(method, url, ors_directions(json["coordinates"]))
+
+
+@override_settings(LOCATION_WRITE_BEHIND=False)
+@patch("httpx.AsyncClient.request", side_effect=fake_upstream)
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username="johnny", email="johndoe@example.com")
+        cls.headers = {"authorization": f"Token {AuthToken.objects.create(user)[1]}"}
+        Location.objects.create(
+            place_id="place1", name="Location 1", latitude=40.7128, longitude=-74.0060, user_ratings_total=100
+        )
+        Location.objects.create(
+            place_id="place2", name="Location 2", latitude=40.7589, longitude=-73.9851, user_ratings_total=50
+        )
+
+    async def test_requires_token(self, mock_request):
+        response = await self.async_client.get("/api/async/route/")
+        self.assertEqual(response.status_code, 401)
+        response = await self.async_client.get("/api/async/route/", headers={"authorization": "Token nope"})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_search(self, mock_request):
+        params = {"longitude": TEST_LNG, "latitude": TEST_LAT}
+        response = await self.async_client.get("/api/async/search/", params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["cache"], "miss")
+        self.assertEqual([loc["place_id"] for loc in response.json()["locations"]], ["async_bar"])
+        self.assertTrue(await Location.objects.filter(place_id="async_bar").aexists())
+        google_calls = mock_request.call_count
+
+        response = await self.async_client.get("/api/async/search/", params, headers=self.headers)
+        self.assertEqual(response.json()["cache"], "hit")
+        self.assertEqual(mock_request.call_count, google_calls)
+
+    async def test_concurrent_searches_are_coalesced(self, mock_request):
+        async def slow_upstream(*args, **kwargs):
+            await asyncio.sleep(0.05)
+            return fake_upstream(*args, **kwargs)
+
+        mock_request.side_effect = slow_upstream
+        # Different points in the same ~150m tile
+        searches = [{"longitude": TEST_LNG, "latitude": TEST_LAT}, {"longitude": "-74.0061", "latitude": "40.7129"}]
+        responses = await asyncio.gather(
+            *(self.async_client.get("/api/async/search/", params, headers=self.headers) for params in searches)
+        )
+        self.assertEqual(sorted(response.json()["cache"] for response in responses), ["coalesced", "miss"])
+        self.assertEqual(responses[0].json()["locations"], responses[1].json()["locations"])
+        requested = [
+            (call.args[1], tuple(sorted(call.kwargs["params"].items()))) for call in mock_request.call_args_list
+        ]
+        self.assertEqual(len(requested), len(set(requested)))
+
+    async def test_streaming_search(self, mock_request):
+        params = {"longitude": TEST_LNG, "latitude": TEST_LAT, "stream": "sse"}
+        response = await self.async_client.get("/api/async/search/", params, headers=self.headers)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = b"".join([chunk async for chunk in response.streaming_content]).decode().strip().split("\n\n")
+        self.assertEqual([event.splitlines()[0] for event in events], ["event: location", "event: summary"])
+        self.assertEqual(json.loads(events[0].splitlines()[1][len("data: ") :])["location"]["place_id"], "async_bar")
+        self.assertTrue(await Location.objects.filter(place_id="async_bar").aexists())
+
+    async def test_route_matches_sync_view(self, mock_request):
+        params = {"start_lat": TEST_LAT, "start_lng": TEST_LNG, "end_lat": "40.7589", "end_lng": "-73.9851"}
+        response = await self.async_client.get("/api/async/route/", params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_request.call_count, 1)
+        self.assertEqual(await RouteLeg.objects.acount(), 1)
+        self.assertIn("ors;dur=", response["Server-Timing"])
+        self.assertIn('desc="1 calls"', response["Server-Timing"])
+
+        # The leg cache is shared, so the sync view answers the same route without calling ORS
+        sync_response = await self.async_client.get("/api/route/", params, headers=self.headers)
+        self.assertEqual(sync_response.json(), response.json())
+        self.assertEqual(mock_request.call_count, 1)
+
+    async def test_route_missing_parameters(self, mock_request):
+        response = await self.async_client.get("/api/async/route/", {"start_lat": TEST_LAT}, headers=self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Missing required parameters", response.json()["error"])
+
+    async def test_optimize_crawl(self, mock_request):
+        response = await self.async_client.get(
+            "/api/async/optimize-crawl/",
+            {"location": ["place1", "place2"], "start": "place1", "matrix": "ors"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([loc["place_id"] for loc in data["ordered_locations"]], ["place1", "place2"])
+        self.assertEqual(data["solver"]["matrix"], "ors")
+        self.assertEqual(data["total_time_seconds"], 60)
+        urls = [call.args[1] for call in mock_request.call_args_list]
+        self.assertEqual(len(urls), 2)
+        self.assertIn("matrix", urls[0])
+
+    async def test_optimize_crawl_unknown_location(self, mock_request):
+        response = await self.async_client.get(
+            "/api/async/optimize-crawl/", {"location": ["place1", "nowhere"]}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,75 @@
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from knox.models import AuthToken
+
+from api import metrics
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="johnny", email="johndoe@example.com")
+
+    def setUp(self):
+        cache.clear()
+
+    def login(self):
+        return {"authorization": f"Token {AuthToken.objects.create(self.user)[1]}"}
+
+    def get_user(self, headers):
+        return self.client.get("/api/user/", headers=headers)
+
+    def test_cached_token_skips_lookup(self):
+        headers = self.login()
+        hits = metrics.auth_token_cache.get(outcome="hit")
+        self.assertEqual(self.get_user(headers).status_code, 200)
+        # The user comes with the cached token, so the view needs no query at all
+        with self.assertNumQueries(0):
+            response = self.get_user(headers)
+        self.assertEqual(response.json()["username"], "johnny")
+        self.assertEqual(metrics.auth_token_cache.get(outcome="hit"), hits + 1)
+
+    def test_logout_invalidates(self):
+        headers = self.login()
+        self.assertEqual(self.get_user(headers).status_code, 200)
+        self.assertEqual(self.client.post("/api/auth/logout/", headers=headers).status_code, 204)
+        self.assertEqual(self.get_user(headers).status_code, 401)
+
+    def test_logoutall_invalidates(self):
+        first, second = self.login(), self.login()
+        self.assertEqual(self.get_user(first).status_code, 200)
+        self.assertEqual(self.get_user(second).status_code, 200)
+        self.assertEqual(self.client.post("/api/auth/logoutall/", headers=first).status_code, 204)
+        self.assertEqual(self.get_user(first).status_code, 401)
+        self.assertEqual(self.get_user(second).status_code, 401)
+
+    def test_expired_token(self):
+        headers = self.login()
+        self.assertEqual(self.get_user(headers).status_code, 200)
+        # Expiry is checked on cached tokens too, the expired row is then cleaned up by knox
+        with patch("django.utils.timezone.now", return_value=timezone.now() + timedelta(days=1)):
+            self.assertEqual(self.get_user(headers).status_code, 401)
+        self.assertFalse(AuthToken.objects.exists())
+
+    @override_settings(AUTH_TOKEN_CACHE_TTL=0)
+    def test_cache_disabled(self):
+        headers = self.login()
+        self.assertEqual(self.get_user(headers).status_code, 200)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_user(headers).status_code, 200)
+
+    def test_purge_expired_tokens(self):
+        self.login()
+        expired, _ = AuthToken.objects.create(self.user, expiry=timedelta(seconds=-1))
+        out = StringIO()
+        call_command("purge_expired_tokens", stdout=out)
+        self.assertIn("Purged 1 expired auth tokens", out.getvalue())
+        self.assertEqual(AuthToken.objects.count(), 1)
+        self.assertFalse(AuthToken.objects.filter(pk=expired.pk).exists())
@@ -0,0 +1,124 @@
+from unittest.mock import MagicMock, patch
+
+import googlemaps
+import httpx
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from api import clients, metrics
+
+
+def ors_response(status, body=None):
+    response = MagicMock(spec=requests.Response)
+    response.status_code = status
+    response.json.return_value = body or {}
+    if status >= 400:
+        response.raise_for_status.side_effect = requests.HTTPError(f"{status} Error", response=response)
+    return response
+
+
+@override_settings(UPSTREAM_RETRIES=2, CIRCUIT_BREAKER_FAILURES=3, CIRCUIT_BREAKER_RESET=60)
+@patch("api.clients.time.sleep")
+class ORSClientTest(SimpleTestCase):
+    def setUp(self):
+        self.client_under_test = clients.ORSClient()
+
+    @patch("requests.Session.post")
+    def test_retries_transient_errors(self, mock_post, mock_sleep):
+        mock_post.side_effect = [ors_response(503), ors_response(200, {"ok": True})]
+        before = metrics.upstream_requests.get(provider="ors", endpoint="test", outcome="retryable_error")
+
+        self.assertEqual(self.client_under_test.post("/test", endpoint="test", json={}), {"ok": True})
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+        after = metrics.upstream_requests.get(provider="ors", endpoint="test", outcome="retryable_error")
+        self.assertEqual(after - before, 1)
+
+    @patch("requests.Session.post")
+    def test_does_not_retry_bad_requests(self, mock_post, mock_sleep):
+        mock_post.return_value = ors_response(400)
+        with self.assertRaises(requests.HTTPError):
+            self.client_under_test.post("/test", endpoint="test", json={})
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertFalse(self.client_under_test.breaker.is_open)
+
+    @patch("requests.Session.post")
+    def test_circuit_breaker(self, mock_post, mock_sleep):
+        mock_post.side_effect = requests.ConnectionError()
+        with self.assertRaises(requests.ConnectionError):
+            self.client_under_test.post("/test", endpoint="test", json={})
+        # 1 call and 2 retries open the breaker, later calls fail without reaching ORS
+        self.assertTrue(self.client_under_test.breaker.is_open)
+        with self.assertRaises(clients.CircuitOpenError):
+            self.client_under_test.post("/test", endpoint="test", json={})
+        self.assertEqual(mock_post.call_count, 3)
+
+    @patch("requests.Session.post")
+    def test_deadline_is_passed_as_timeout(self, mock_post, mock_sleep):
+        mock_post.return_value = ors_response(200)
+        self.client_under_test.post("/test", endpoint="test", deadline=2, json={})
+        self.assertLessEqual(mock_post.call_args.kwargs["timeout"], 2)
+
+
+class GoogleMapsClientTest(SimpleTestCase):
+    def tearDown(self):
+        clients.google_breaker.reset()
+
+    @patch("googlemaps.Client")
+    def test_shares_session_and_records_calls(self, mock_client):
+        mock_client.return_value.places_nearby.return_value = {"results": []}
+        before = metrics.upstream_requests.get(provider="google", endpoint="places_nearby", outcome="ok")
+
+        clients.google_maps().places_nearby(location=(0, 0), radius=1)
+        clients.google_maps().places_nearby(location=(0, 0), radius=1)
+        sessions = {call.kwargs["requests_session"] for call in mock_client.call_args_list}
+        self.assertEqual(sessions, {clients.google_session})
+        after = metrics.upstream_requests.get(provider="google", endpoint="places_nearby", outcome="ok")
+        self.assertEqual(after - before, 2)
+
+    @patch("googlemaps.Client")
+    def test_api_errors_do_not_trip_breaker(self, mock_client):
+        mock_client.return_value.places_nearby.side_effect = googlemaps.exceptions.ApiError("INVALID_REQUEST")
+        for _ in range(10):
+            with self.assertRaises(googlemaps.exceptions.ApiError):
+                clients.google_maps().places_nearby(location=(0, 0), radius=1)
+        self.assertFalse(clients.google_breaker.is_open)
+
+
+def httpx_response(status, body=None):
+    return httpx.Response(status, json=body or {}, request=httpx.Request("POST", "http://upstream/test"))
+
+
+@override_settings(UPSTREAM_RETRIES=2, CIRCUIT_BREAKER_FAILURES=3, CIRCUIT_BREAKER_RESET=60)
+@patch("api.clients.asyncio.sleep")
+class AsyncClientsTest(SimpleTestCase):
+    def setUp(self):
+        self.breaker = clients.CircuitBreaker("test", 3, 60)
+
+    @patch("httpx.AsyncClient.request")
+    async def test_retries_transient_errors(self, mock_request, mock_sleep):
+        mock_request.side_effect = [httpx_response(503), httpx_response(200, {"ok": True})]
+        ors = clients.AsyncORSClient(self.breaker)
+
+        self.assertEqual(await ors.post("/test", endpoint="test", json={}), {"ok": True})
+        self.assertEqual(mock_request.call_count, 2)
+        self.assertEqual(mock_sleep.call_count, 1)
+
+    @patch("httpx.AsyncClient.request")
+    async def test_circuit_breaker(self, mock_request, mock_sleep):
+        mock_request.side_effect = httpx.ConnectError("refused")
+        ors = clients.AsyncORSClient(self.breaker)
+        with self.assertRaises(httpx.ConnectError):
+            await ors.post("/test", endpoint="test", json={})
+        with self.assertRaises(clients.CircuitOpenError):
+            await ors.post("/test", endpoint="test", json={})
+        self.assertEqual(mock_request.call_count, 3)
+
+    @patch("httpx.AsyncClient.request")
+    async def test_google_status_errors(self, mock_request, mock_sleep):
+        mock_request.return_value = httpx_response(200, {"status": "INVALID_REQUEST", "results": []})
+        google = clients.AsyncGooglePlaces(self.breaker)
+        with self.assertRaises(googlemaps.exceptions.ApiError):
+            await google.places_nearby(location=(0, 0), radius=1, page_token="token")
+        self.assertEqual(mock_request.call_args.kwargs["params"]["pagetoken"], "token")
+        self.assertFalse(self.breaker.is_open)
@@ -0,0 +1,100 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.geo import (
+    covering_geohashes,
+    decode_polyline,
+    delta_encode,
+    encode_polyline,
+    geohash_encode,
+    haversine_matrix_miles,
+    haversine_miles,
+    haversine_miles_array,
+    hex_cover,
+    simplify,
+)
+from api.routes import compact_geometry, stitch_legs
+
+
+class GeoTest(SimpleTestCase):
+    def test_geohash_encode(self):
+        # Reference value from the original geohash.org implementation
+        self.assertEqual(geohash_encode(57.64911, 10.40744, 11), "u4pruydqqvj")
+
+    def test_haversine(self):
+        # Philadelphia City Hall to the Liberty Bell
+        self.assertAlmostEqual(haversine_miles(39.9526, -75.1635, 39.9496, -75.1503), 0.73, places=2)
+        distances = haversine_miles_array(39.9526, -75.1635, [39.9526, 39.9496], [-75.1635, -75.1503])
+        self.assertAlmostEqual(distances[0], 0)
+        self.assertAlmostEqual(distances[1], haversine_miles(39.9526, -75.1635, 39.9496, -75.1503))
+        matrix = haversine_matrix_miles([39.9526, 39.9496], [-75.1635, -75.1503])
+        self.assertEqual(matrix.shape, (2, 2))
+        self.assertAlmostEqual(matrix[0, 1], distances[1])
+        self.assertAlmostEqual(matrix[1, 0], distances[1])
+
+    def test_hex_cover(self):
+        self.assertEqual(hex_cover(39.9526, -75.1635, 1, 2), [(39.9526, -75.1635)])
+        centers = hex_cover(39.9526, -75.1635, 10, 3.125)
+        self.assertEqual(len(centers), 19)
+        self.assertAlmostEqual(haversine_miles(*centers[0], 39.9526, -75.1635), 0, places=6)
+        # Every point of the 10 mile circle is within a cell radius of a center
+        for bearing in range(0, 360, 15):
+            for miles in (2.5, 5, 7.5, 10):
+                lat = 39.9526 + miles / 69.055 * np.cos(np.radians(bearing))
+                lng = -75.1635 + miles / (69.055 * np.cos(np.radians(39.9526))) * np.sin(np.radians(bearing))
+                self.assertLessEqual(min(haversine_miles(lat, lng, *center) for center in centers), 3.125)
+
+    def test_covering_geohashes(self):
+        prefixes = covering_geohashes(39.9526, -75.1635, 1)
+        self.assertLessEqual(len(prefixes), 16)
+        # Points on the edge of the circle in every direction fall inside one of the prefixes
+        for lat, lng in ((39.9671, -75.1635), (39.9381, -75.1635), (39.9526, -75.1446), (39.9526, -75.1824)):
+            geohash = geohash_encode(lat, lng, 9)
+            self.assertTrue(any(geohash.startswith(prefix) for prefix in prefixes))
+
+    def test_encode_polyline(self):
+        # Reference line from Google's encoded polyline algorithm documentation
+        coordinates = [[-120.2, 38.5], [-120.95, 40.7], [-126.453, 43.252]]
+        self.assertEqual(encode_polyline(coordinates), "_p~iF~ps|U_ulLnnqC_mqNvxq`@")
+        self.assertEqual(decode_polyline("_p~iF~ps|U_ulLnnqC_mqNvxq`@"), coordinates)
+        self.assertEqual(delta_encode(coordinates), [3850000, -12020000, 220000, -75000, 255200, -550300])
+        self.assertEqual(decode_polyline(encode_polyline(coordinates, precision=6), precision=6), coordinates)
+        self.assertEqual(encode_polyline([]), "")
+
+    def test_simplify(self):
+        # A straight street with a 0.5m wobble and a 100m turn at the end
+        line = [[-75.0, 39.95], [-74.9995, 39.950004], [-74.999, 39.95], [-74.999, 39.951]]
+        self.assertEqual(simplify(line, 0), [0, 1, 2, 3])
+        self.assertEqual(simplify(line, 1), [0, 2, 3])
+        self.assertEqual(simplify(line, 1, keep=[1]), [0, 1, 2, 3])
+        self.assertEqual(simplify(line, 500), [0, 3])
+
+    def test_compact_geometry(self):
+        leg = {
+            "coordinates": [[-75.0, 39.95], [-74.9995, 39.950004], [-74.999, 39.95]],
+            "steps": [
+                {"distance": 50, "duration": 40, "way_points": [0, 1]},
+                {"distance": 50, "duration": 40, "way_points": [1, 2]},
+            ],
+            "summary": {"distance": 100, "duration": 80},
+        }
+        turn = {
+            "coordinates": [[-74.999, 39.95], [-74.999, 39.9505], [-74.999, 39.951]],
+            "steps": [{"distance": 111, "duration": 90, "way_points": [0, 2]}],
+            "summary": {"distance": 111, "duration": 90},
+        }
+        geo_json = compact_geometry(stitch_legs([leg, turn]), encoding="polyline", precision=6, tolerance=1)
+        feature = geo_json["features"][0]
+        # Step ends are kept, the straight middle of the second leg is dropped
+        self.assertEqual(feature["properties"]["way_points"], [0, 2, 3])
+        self.assertEqual(
+            [step["way_points"] for segment in feature["properties"]["segments"] for step in segment["steps"]],
+            [[0, 1], [1, 2], [2, 3]],
+        )
+        self.assertEqual(feature["geometry"]["encoding"], "polyline")
+        self.assertEqual(
+            decode_polyline(feature["geometry"]["coordinates"], precision=6),
+            [[-75.0, 39.95], [-74.9995, 39.950004], [-74.999, 39.95], [-74.999, 39.951]],
+        )
+        # The cached legs are left as they were
+        self.assertEqual(turn["steps"][0]["way_points"], [0, 2])
@@ -0,0 +1,43 @@
+import requests
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from api.management.loadtest import FakeUpstream, percentile, summarize
+
+
+class FakeUpstreamTest(SimpleTestCase):
+    def serve(self, **kwargs):
+        upstream = FakeUpstream(0, **kwargs).start()
+        self.addCleanup(upstream.server_close)
+        self.addCleanup(upstream.shutdown)
+        return upstream
+
+    def test_pagination(self):
+        upstream = self.serve(pages=2, results_per_page=3)
+        url = f"{upstream.url}/maps/api/place/nearbysearch/json"
+        first = requests.get(url, params={"location": "39.95,-75.16"}).json()
+        self.assertEqual(len(first["results"]), 3)
+        second = requests.get(url, params={"pagetoken": first["next_page_token"]}).json()
+        self.assertEqual(len(second["results"]), 3)
+        self.assertNotIn("next_page_token", second)
+        self.assertEqual(second["results"][0]["geometry"]["location"], {"lat": 39.95, "lng": -75.16})
+
+    def test_error_injection(self):
+        upstream = self.serve(error_rate=1)
+        response = requests.post(f"{upstream.url}/v2/matrix/foot-walking", json={"sources": [0], "destinations": [0]})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual((upstream.calls, upstream.failures), (1, 1))
+
+    def test_settings(self):
+        upstream = self.serve()
+        with upstream.settings():
+            self.assertEqual(settings.GOOGLE_MAPS_BASE_URL, upstream.url)
+            self.assertFalse(settings.SEARCH_PLANNER)
+
+    def test_summary(self):
+        self.assertEqual(percentile([], 99), 0)
+        self.assertEqual(percentile(list(range(1, 101)), 95), 95)
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        result = summarize(2, [(0.1, 200), (0.3, 200), (1, 502)])
+        self.assertEqual((result["requests"], result["errors"], result["throughput"]), (3, 1, 1))
+        self.assertEqual(result["p50_ms"], 200)
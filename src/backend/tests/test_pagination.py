@@ -0,0 +1,67 @@
+import random
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+
+from api import pagination
+from api.models import Location
+
+LAT, LNG = 40.7128, -74.0060
+
+
+def venues(n, seed):
+    rng = random.Random(seed)
+    return [
+        Location(
+            place_id=f"place{i}",
+            latitude=Decimal(f"{LAT + rng.uniform(-0.05, 0.05):.7f}"),
+            longitude=Decimal(f"{LNG + rng.uniform(-0.05, 0.05):.7f}"),
+            rating=rng.choice([None, Decimal("3.5"), Decimal("4.0"), Decimal("4.5")]),
+            user_ratings_total=rng.randrange(0, 50),
+        )
+        for i in range(n)
+    ]
+
+
+class PaginationTest(SimpleTestCase):
+    def test_pages_match_a_full_sort(self):
+        locations = venues(50, 1)
+        for sort in (None, *pagination.SORTS):
+            keys = pagination.sort_keys(locations, sort, LAT, LNG)
+            expected = [location for _, location in sorted(zip(keys, locations), key=lambda pair: pair[0])]
+            pages, after = [], None
+            while True:
+                cursor = pagination.encode_cursor(sort, after) if after is not None else None
+                after = pagination.decode_cursor(cursor, sort) if cursor is not None else None
+                locations_page, after = pagination.page(locations, keys, limit=7, after=after)
+                pages.append(locations_page)
+                if after is None:
+                    break
+            self.assertEqual([location for page in pages for location in page], expected, sort)
+            self.assertEqual([len(page) for page in pages], [7] * 7 + [1])
+
+    def test_sort_orders(self):
+        locations = venues(30, 2)
+        rating = pagination.page(locations, pagination.sort_keys(locations, "rating", LAT, LNG))[0]
+        rated = [location.rating for location in rating if location.rating is not None]
+        self.assertEqual(rated, sorted(rated, reverse=True))
+        self.assertIsNone(rating[-1].rating)
+
+        popular = pagination.page(locations, pagination.sort_keys(locations, "popularity", LAT, LNG))[0]
+        totals = [location.user_ratings_total for location in popular]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+        keys = pagination.sort_keys(locations, None, LAT, LNG)
+        self.assertEqual(pagination.page(locations, keys, limit=3)[0], locations[:3])
+
+    def test_invalid_cursor(self):
+        cursor = pagination.encode_cursor("rating", (False, -4.5, -10, "place1"))
+        self.assertEqual(pagination.decode_cursor(cursor, "rating"), (False, -4.5, -10, "place1"))
+        for bad, sort in (
+            (cursor, "distance"),
+            ("not a cursor!", "rating"),
+            (pagination.encode_cursor("rating", ["x", "y"]), "rating"),
+            (pagination.encode_cursor("distance", ["near", "place1"]), "distance"),
+        ):
+            with self.assertRaises(ValueError):
+                pagination.decode_cursor(bad, sort)
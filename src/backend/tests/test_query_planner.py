@@ -0,0 +1,43 @@
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from api import query_planner
+from api.models import KeywordYield
+
+LAT, LNG = 40.7128, -74.0060
+KEYWORDS = ["bar", "pub", "tavern"]
+
+
+@override_settings(SEARCH_PLANNER_MIN_SAMPLES=3, SEARCH_PLANNER_MIN_YIELD=1, SEARCH_PLANNER_EXPLORE=0.1)
+class QueryPlannerTest(TestCase):
+    def test_record_keeps_a_moving_average(self):
+        query_planner.record(LAT, LNG, "bar", {"bar": 4, "pub": 0})
+        query_planner.record(LAT, LNG, "bar", {"bar": 0, "pub": 0})
+        row = KeywordYield.objects.get(area=query_planner.area_key(LAT, LNG), search_type="bar", keyword="bar")
+        self.assertEqual((row.queries, row.new_places), (2, 4))
+        self.assertAlmostEqual(row.recent_yield, 4 * (1 - query_planner.SMOOTHING))
+        self.assertEqual(KeywordYield.objects.count(), 2)
+
+    def test_low_yield_keywords_are_skipped_after_enough_samples(self):
+        for _ in range(2):
+            query_planner.record(LAT, LNG, "bar", {"bar": 5, "pub": 0, "tavern": 0})
+        self.assertEqual(query_planner.plan(LAT, LNG, "bar", KEYWORDS), (KEYWORDS, []))
+
+        query_planner.record(LAT, LNG, "bar", {"bar": 5, "pub": 0, "tavern": 0})
+        with patch("api.query_planner.random.random", return_value=0.5):
+            self.assertEqual(query_planner.plan(LAT, LNG, "bar", KEYWORDS), (["bar"], []))
+        # Now and then the skipped keywords are searched anyway
+        with patch("api.query_planner.random.random", return_value=0.05):
+            self.assertEqual(query_planner.plan(LAT, LNG, "bar", KEYWORDS), (["bar"], ["pub", "tavern"]))
+
+        # Other areas and search types keep their own statistics
+        self.assertEqual(query_planner.plan(LAT + 1, LNG, "bar", KEYWORDS), (KEYWORDS, []))
+        self.assertEqual(query_planner.plan(LAT, LNG, "brewery", KEYWORDS), (KEYWORDS, []))
+
+    @override_settings(SEARCH_PLANNER=False)
+    def test_disabled(self):
+        for _ in range(3):
+            query_planner.record(LAT, LNG, "bar", {"pub": 0})
+        self.assertFalse(KeywordYield.objects.exists())
+        self.assertEqual(query_planner.plan(LAT, LNG, "bar", KEYWORDS), (KEYWORDS, []))
@@ -0,0 +1,42 @@
+from decimal import Decimal
+
+from django.test import SimpleTestCase
+
+from api.models import Location
+from api.renderers import ORJSONRenderer, dumps
+from api.serializers import LocationSerializer, location_data
+
+
+class LocationDataTest(SimpleTestCase):
+    def test_matches_location_serializer(self):
+        locations = [
+            # As stored
+            Location(
+                place_id="stored",
+                name="Stored Bar",
+                address="1 Main St",
+                latitude=Decimal("40.7128000"),
+                longitude=Decimal("-74.0060000"),
+                rating=Decimal("4.5"),
+                user_ratings_total=10,
+            ),
+            # Straight from Google, with more decimals than are stored
+            Location(
+                place_id="fresh",
+                name="Fresh Bar",
+                address=None,
+                latitude=40.71284445,
+                longitude=-74.00605,
+                rating=4.25,
+                user_ratings_total=0,
+            ),
+            Location(place_id="unrated", name="Unrated", latitude=0, longitude=180, rating=None, user_ratings_total=0),
+        ]
+        self.assertEqual(location_data(locations), LocationSerializer(locations, many=True).data)
+        self.assertEqual(
+            set(location_data(locations[:1])[0]), set(LocationSerializer(locations[0]).data), "fields out of sync"
+        )
+
+    def test_renderer(self):
+        self.assertEqual(dumps({"rating": Decimal("4.5"), "name": "Café"}), '{"rating":"4.5","name":"Café"}'.encode())
+        self.assertEqual(ORJSONRenderer().render(None), b"")
@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import SimpleTestCase, override_settings
+
+from api.singleflight import SingleFlight
+
+
+class SingleFlightTest(SimpleTestCase):
+    def test_concurrent_calls_share_one_result(self):
+        group = SingleFlight("test")
+        release = threading.Event()
+        calls = []
+
+        def work():
+            calls.append(1)
+            release.wait(5)
+            return ["result"]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(group.do, "key", work)]
+            # Wait until the leader is inside work() before the others ask
+            while not calls:
+                pass
+            futures += [executor.submit(group.do, "key", work) for _ in range(2)]
+            other = executor.submit(group.do, "other", lambda: "other")
+            self.assertEqual(other.result(), ("other", False))
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([shared for _, shared in results], [False, True, True])
+        self.assertTrue(all(value is results[0][0] for value, _ in results))
+        # Nothing is remembered once the call is done
+        self.assertEqual(group.do("key", lambda: "again"), ("again", False))
+
+    def test_errors_are_shared(self):
+        group = SingleFlight("test")
+        started, release = threading.Event(), threading.Event()
+
+        def fail():
+            started.set()
+            release.wait(5)
+            raise ValueError("upstream down")
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            leader = executor.submit(group.do, "key", fail)
+            started.wait(5)
+            follower = executor.submit(group.do, "key", fail)
+            release.set()
+            for future in (leader, follower):
+                with self.assertRaisesMessage(ValueError, "upstream down"):
+                    future.result()
+
+    @override_settings(REQUEST_COALESCING=False)
+    def test_disabled(self):
+        group = SingleFlight("test")
+        self.assertEqual(group.do("key", lambda: 1), (1, False))
+
+    def test_async(self):
+        group = SingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run():
+            leader = asyncio.create_task(group.ado("key", work))
+            await asyncio.sleep(0)
+            followers = [asyncio.create_task(group.ado("key", work)) for _ in range(2)]
+            await asyncio.sleep(0)
+            # The shared work carries on for the others when the first request goes away
+            leader.cancel()
+            return await asyncio.gather(*followers)
+
+        self.assertEqual(asyncio.run(run()), [("result", True), ("result", True)])
+        self.assertEqual(len(calls), 1)
@@ -0,0 +1,146 @@
+import itertools
+import time
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from api.solver import (
+    anytime,
+    cluster,
+    held_karp,
+    insert_stops,
+    kmeans,
+    local_search,
+    nearest_neighbor,
+    path_cost,
+    solve,
+    solve_clustered,
+)
+
+
+def brute_force(matrix, start=None):
+    n = len(matrix)
+    orders = (order for order in itertools.permutations(range(n)) if start is None or order[0] == start)
+    return min(path_cost(matrix, order) for order in orders)
+
+
+def random_matrix(n, seed):
+    # Walking times between random points, slightly asymmetric like ORS results
+    rng = np.random.default_rng(seed)
+    points = rng.random((n, 2)) * 1000
+    matrix = np.linalg.norm(points[:, None] - points[None, :], axis=2)
+    return matrix * rng.uniform(1, 1.1, size=(n, n))
+
+
+class SolverTest(SimpleTestCase):
+    def test_held_karp_is_optimal(self):
+        for seed in range(5):
+            matrix = random_matrix(7, seed)
+            self.assertAlmostEqual(path_cost(matrix, held_karp(matrix)), brute_force(matrix))
+            self.assertAlmostEqual(path_cost(matrix, held_karp(matrix, start=3)), brute_force(matrix, start=3))
+            self.assertEqual(held_karp(matrix, start=3)[0], 3)
+
+    def test_local_search_beats_greedy(self):
+        matrix = random_matrix(40, 0)
+        greedy = nearest_neighbor(matrix, 0)
+        improved = local_search(matrix, greedy, fixed_start=True)
+        self.assertEqual(improved[0], 0)
+        self.assertEqual(sorted(improved), list(range(40)))
+        self.assertLess(path_cost(matrix, improved), path_cost(matrix, greedy))
+
+    def test_solve(self):
+        matrix = random_matrix(8, 1)
+        solution = solve(matrix.tolist())
+        self.assertEqual(solution.solver, "held_karp")
+        self.assertAlmostEqual(solution.cost, brute_force(matrix))
+        self.assertGreaterEqual(solution.improvement_percent, 0)
+
+        solution = solve(random_matrix(20, 2).tolist(), start=5)
+        self.assertEqual(solution.solver, "local_search")
+        self.assertEqual(solution.order[0], 5)
+
+    def test_unreachable_pairs(self):
+        solution = solve([[0, None, 5], [1, 0, 1], [5, 1, 0]], start=0)
+        self.assertEqual(solution.order, [0, 2, 1])
+
+    def test_fixed_end(self):
+        matrix = random_matrix(9, 3)
+        for solver in ("held_karp", "local_search", "greedy"):
+            solution = solve(matrix.tolist(), start=2, end=6, solver=solver)
+            self.assertEqual((solution.order[0], solution.order[-1]), (2, 6))
+            self.assertAlmostEqual(solution.cost, path_cost(matrix, solution.order))
+        expected = min(path_cost(matrix, order) for order in itertools.permutations(range(9)) if order[-1] == 6)
+        self.assertAlmostEqual(solve(matrix.tolist(), end=6).cost, expected)
+
+    def test_kmeans(self):
+        rng = np.random.default_rng(0)
+        centers = np.array([[0, 0], [10, 0], [0, 10]])
+        points = np.concatenate([center + rng.normal(size=(20, 2)) for center in centers])
+        labels = kmeans(points, 3)
+        # Every blob ends up in a cluster of its own
+        self.assertEqual(sorted(len(set(labels[i : i + 20])) for i in range(0, 60, 20)), [1, 1, 1])
+        self.assertEqual(len(set(labels)), 3)
+
+        groups = cluster(points, 8)
+        self.assertEqual(sorted(i for group in groups for i in group), list(range(60)))
+        self.assertTrue(all(len(group) <= 8 for group in groups))
+        # Stops at the same spot are split up anyway
+        self.assertEqual(sorted(len(group) for group in cluster(np.zeros((5, 2)), 2)), [1, 2, 2])
+
+    def test_solve_clustered(self):
+        rng = np.random.default_rng(4)
+        points = rng.random((80, 2)) * 5000
+        estimated = np.linalg.norm(points[:, None] - points[None, :], axis=2)
+        groups = cluster(points, 20)
+        solution = solve_clustered(estimated, groups, [estimated[np.ix_(g, g)].tolist() for g in groups], start=7)
+        self.assertEqual(solution.order[0], 7)
+        self.assertEqual(sorted(solution.order), list(range(80)))
+        self.assertEqual((solution.solver, solution.clusters), ("clustered", len(groups)))
+        self.assertAlmostEqual(solution.cost, path_cost(estimated, solution.order))
+        # Every cluster is walked in one go
+        runs = [next(c for c, group in enumerate(groups) if stop in group) for stop in solution.order]
+        self.assertEqual(len([c for c, following in zip(runs, runs[1:] + [None]) if c != following]), len(groups))
+        self.assertLess(solution.cost, solution.greedy_cost * 1.1)
+
+    def test_anytime_keeps_to_its_budget(self):
+        matrix = random_matrix(60, 5)
+        started = time.perf_counter()
+        solution = solve(matrix.tolist(), start=3, budget_ms=100)
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual((solution.solver, solution.order[0]), ("anytime", 3))
+        self.assertEqual(sorted(solution.order), list(range(60)))
+        self.assertGreater(solution.iterations, 0)
+        self.assertLessEqual(solution.cost, path_cost(matrix, local_search(matrix, nearest_neighbor(matrix, 3))))
+
+        # Small crawls stop once perturbing stops finding anything better
+        matrix = random_matrix(6, 6)
+        started = time.perf_counter()
+        order, _ = anytime(matrix, nearest_neighbor(matrix, 0), False, started + 10)
+        self.assertLess(time.perf_counter() - started, 10)
+        self.assertAlmostEqual(path_cost(matrix, order), brute_force(matrix))
+
+        # and are solved exactly when Held-Karp fits in the budget
+        solution = solve(matrix.tolist(), budget_ms=10000)
+        self.assertEqual(solution.solver, "held_karp")
+        self.assertAlmostEqual(solution.cost, brute_force(matrix))
+
+    def test_budget_too_short_for_held_karp(self):
+        matrix = random_matrix(12, 7)
+        started = time.perf_counter()
+        solution = solve(matrix.tolist(), budget_ms=5)
+        self.assertLess(time.perf_counter() - started, 0.025)
+        self.assertEqual(solution.solver, "anytime")
+        self.assertEqual(sorted(solution.order), list(range(12)))
+
+    def test_insert_stops(self):
+        matrix = random_matrix(9, 7)
+        order = solve(matrix[:6, :6].tolist(), start=2).order
+        solution = insert_stops(matrix.tolist(), order, [6, 7, 8])
+        self.assertEqual(solution.solver, "insertion")
+        self.assertEqual((solution.order[0], sorted(solution.order)), (2, list(range(9))))
+        # Within a few percent of solving from scratch
+        self.assertLessEqual(solution.cost, brute_force(matrix, start=2) * 1.1)
+
+        # Removing needs no solving, the rest of the path stays in order
+        solution = insert_stops(matrix.tolist(), [i for i in order if i != 4], [])
+        self.assertEqual(solution.order, [i for i in order if i != 4])
@@ -0,0 +1,108 @@
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+from knox.models import AuthToken
+
+from api import metrics
+from api.models import Location
+from tests.test_api_endpoints import ors_directions
+
+
+def server_timing(response):
+    """{name: (milliseconds, description)} of a Server-Timing header"""
+    entries = {}
+    for entry in response["Server-Timing"].split(", "):
+        name, *params = entry.split(";")
+        params = dict(param.split("=", 1) for param in params)
+        entries[name] = (float(params["dur"]), params.get("desc", "").strip('"'))
+    return entries
+
+
+@override_settings(LOCATION_WRITE_BEHIND=False)
+class ServerTimingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username="johnny", email="johndoe@example.com")
+        cls.headers = {"authorization": f"Token {AuthToken.objects.create(user)[1]}"}
+        Location.objects.create(
+            place_id="place1", name="Location 1", latitude=40.7128, longitude=-74.0060, user_ratings_total=100
+        )
+        Location.objects.create(
+            place_id="place2", name="Location 2", latitude=40.7589, longitude=-73.9851, user_ratings_total=50
+        )
+
+    @patch("requests.Session.post")
+    def test_crawl_phases(self, mock_post):
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+        count = metrics.request_latency.get(view="optimize_crawl", status="200")["count"]
+        response = self.client.get(
+            "/api/optimize-crawl/", {"location": ["place1", "place2"], "matrix": "estimate"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+
+        timings = server_timing(response)
+        self.assertLessEqual({"db", "ors", "solve", "legs", "serialize", "total"}, set(timings))
+        self.assertEqual(timings["ors"][1], "1 calls")
+        self.assertRegex(timings["db"][1], r"^\d+ queries$")
+        self.assertLessEqual(timings["legs"][0], timings["total"][0])
+        self.assertEqual(metrics.request_latency.get(view="optimize_crawl", status="200")["count"], count + 1)
+
+    @patch("googlemaps.Client")
+    def test_search_counts_google_calls_from_worker_threads(self, mock_client):
+        mock_client.return_value = MagicMock(**{"places_nearby.return_value": {}, "places.return_value": {}})
+        response = self.client.get(
+            "/api/search/", {"longitude": "-74.0060", "latitude": "40.7128"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        timings = server_timing(response)
+        calls = mock_client.return_value.places_nearby.call_count + mock_client.return_value.places.call_count
+        self.assertEqual(timings["google"][1], f"{calls} calls")
+        self.assertIn("places", timings)
+
+
+class MetricsEndpointTest(TestCase):
+    @override_settings(METRICS_PUBLIC=True)
+    def test_prometheus_format(self):
+        self.client.get("/api/route/")
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        text = response.content.decode()
+        self.assertIn("# TYPE request_seconds histogram", text)
+        self.assertRegex(text, r'request_seconds_bucket\{status="401",view="api_route",le="\+Inf"\} \d+')
+        self.assertIn("# TYPE search_cache_hits_total counter", text)
+
+    def test_staff_only_by_default(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 401)
+        user = User.objects.create(username="ops")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 401)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get("/api/metrics/").status_code, 401)
+        self.assertEqual(self.client.get("/api/metrics/", headers={"authorization": "Bearer nope"}).status_code, 401)
+        self.assertEqual(self.client.get("/api/metrics/", headers={"authorization": "Bearer secret"}).status_code, 200)
+
+
+class RenderTest(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("test_render_seconds", "Rendered in a test", buckets=(0.1, 1))
+        self.addCleanup(metrics.REGISTRY.remove, histogram)
+        histogram.observe(0.05, view='say "hi"')
+        histogram.observe(0.5, view='say "hi"')
+        lines = [line for line in metrics.render().splitlines() if line.startswith("test_render_seconds")]
+        self.assertEqual(
+            lines,
+            [
+                'test_render_seconds_bucket{view="say \\"hi\\"",le="0.1"} 1',
+                'test_render_seconds_bucket{view="say \\"hi\\"",le="1"} 2',
+                'test_render_seconds_bucket{view="say \\"hi\\"",le="+Inf"} 2',
+                'test_render_seconds_sum{view="say \\"hi\\""} 0.55',
+                'test_render_seconds_count{view="say \\"hi\\""} 2',
+            ],
+        )
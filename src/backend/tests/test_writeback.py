@@ -0,0 +1,103 @@
+from unittest.mock import MagicMock, patch
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from knox.models import AuthToken
+
+from api import metrics, writeback
+from api.models import Location
+from tests.test_api_endpoints import ors_directions
+
+
+def venue(place_id, rating=4.5, lat=40.7128):
+    return Location(
+        place_id=place_id, name=place_id, latitude=lat, longitude=-74.006, rating=rating, user_ratings_total=1
+    )
+
+
+# No background thread, flushes happen on demand or when LOCATION_FLUSH_SIZE venues are queued
+@override_settings(LOCATION_WRITE_BEHIND=True, LOCATION_FLUSH_INTERVAL=0, LOCATION_FLUSH_SIZE=3)
+class LocationWriterTest(TestCase):
+    def setUp(self):
+        self.writer = writeback.LocationWriter()
+
+    def written(self):
+        return metrics.location_writes.get(outcome="written"), metrics.location_writes.get(outcome="unchanged")
+
+    def test_merges_and_flushes(self):
+        self.writer.save([venue("a", rating=3.0), venue("b")])
+        self.writer.save([venue("a", rating=4.0)])
+        self.assertEqual(Location.objects.count(), 0)
+        self.assertEqual(metrics.location_writes_pending.get(), 2)
+        self.assertEqual(float(self.writer.pending(["a", "c"])["a"].rating), 4.0)
+
+        self.writer.flush()
+        self.assertEqual(float(Location.objects.get(place_id="a").rating), 4.0)
+        self.assertEqual(Location.objects.count(), 2)
+        self.assertEqual(self.writer.pending(["a", "b"]), {})
+        self.assertEqual(metrics.location_writes_pending.get(), 0)
+
+    def test_skips_unchanged_rows(self):
+        # Google reports more decimals than are stored, that alone is not a change
+        self.writer.save([venue("a", lat=40.71280001), venue("b")])
+        self.writer.flush()
+        written, unchanged = self.written()
+
+        self.writer.save([venue("a", lat=40.71280001), venue("b", rating=2.0)])
+        self.writer.flush()
+        self.assertEqual(self.written(), (written + 1, unchanged + 1))
+        self.assertEqual(float(Location.objects.get(place_id="b").rating), 2.0)
+
+    def test_flushes_at_batch_size(self):
+        self.writer.save([venue("a"), venue("b")])
+        self.assertEqual(Location.objects.count(), 0)
+        self.writer.save([venue("c")])
+        self.assertEqual(Location.objects.count(), 3)
+
+    def test_failed_flush_keeps_batch(self):
+        self.writer.save([venue("a")])
+        with patch.object(self.writer, "write", side_effect=RuntimeError("db down")):
+            with self.assertRaises(RuntimeError):
+                self.writer.flush()
+        self.assertIn("a", self.writer.pending(["a"]))
+        self.writer.flush()
+        self.assertTrue(Location.objects.filter(place_id="a").exists())
+
+    @override_settings(LOCATION_FLUSH_SIZE=100)
+    @patch("requests.Session.post")
+    @patch("googlemaps.Client")
+    def test_crawl_sees_queued_venues(self, mock_client, mock_post):
+        user = User.objects.create(username="johnny")
+        headers = {"authorization": f"Token {AuthToken.objects.create(user)[1]}"}
+        gmaps_mock = MagicMock()
+        mock_client.return_value = gmaps_mock
+        gmaps_mock.places_nearby.return_value = {
+            "results": [
+                {
+                    "place_id": place_id,
+                    "name": f"{place_id} bar",
+                    "vicinity": "1 Main St",
+                    "types": ["bar"],
+                    "geometry": {"location": {"lat": 40.7128 + i * 0.001, "lng": -74.006}},
+                }
+                for i, place_id in enumerate(["first", "second"])
+            ]
+        }
+        gmaps_mock.places.return_value = {"results": []}
+        mock_post.side_effect = lambda url, json=None, **kwargs: ors_directions(json)
+
+        with patch("api.writeback.locations", self.writer):
+            search = self.client.get("/api/search/", {"latitude": "40.7128", "longitude": "-74.006"}, headers=headers)
+            self.assertEqual(search.json()["total_locations"], 2)
+            self.assertEqual(Location.objects.count(), 0)
+
+            # A repeat search is served from the tile cache while the venues are still queued
+            search = self.client.get("/api/search/", {"latitude": "40.7128", "longitude": "-74.006"}, headers=headers)
+            self.assertEqual(search.json()["cache"], "hit")
+            self.assertEqual(search.json()["total_locations"], 2)
+
+            crawl = self.client.get(
+                "/api/optimize-crawl/", {"location": ["first", "second"], "matrix": "estimate"}, headers=headers
+            )
+        self.assertEqual(crawl.status_code, 200)
+        self.assertEqual(Location.objects.count(), 2)